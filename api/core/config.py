@@ -21,17 +21,69 @@ class Settings(BaseSettings):
     # GPU Configuration
     gpu_device: str = "cuda"
     use_half_precision: bool = True
-    model_id: str = "runwayml/stable-diffusion-v1-5"
+    model_id: str = "runwayml/stable-diffusion-v1-5"  # used when a job names no model
+    available_models: str = ""  # comma-separated extra checkpoints jobs may request
 
     # Job Execution
     default_steps: int = 30
     max_steps: int = 50
-    job_timeout_seconds: int = 300
+    job_timeout_seconds: int = 300  # default deadline, counted from submission
+    deadline_check_seconds: int = 5  # how often the router fails jobs past their deadline
     compute_cost_per_image: float = 0.15
+    max_batch_jobs: int = 5000  # items per POST /jobs/batch or GET /jobs?ids=
+
+    # Worker Dispatch
+    # "subprocess": spawn a one-shot worker per job
+    # "queue": enqueue for resident workers (gpu_worker/worker.py --resident)
+    dispatch_mode: str = "queue"
+
+    # Job Queue
+    queue_visibility_timeout_seconds: int = 120
+    queue_max_attempts: int = 3
+    queue_journal_path: str = ""  # e.g. ./data/job_queue.jsonl; empty keeps the queue in memory
+    # Workers get jobs for models they have warm first, unless older work has waited this long
+    queue_affinity_max_wait_seconds: float = 5.0
+    # Queue wait percentiles in /system/stats cover jobs leased this recently
+    queue_wait_window_seconds: float = 300.0
+    # A worker without leases that has not polled for this long is reported stale
+    worker_stale_seconds: int = 30
+
+    # Admission Control (per X-API-Key; 0 disables a limit)
+    rate_limit_per_second: float = 0.0  # jobs per second each key may submit
+    rate_limit_burst: int = 20
+    rate_limit_max_tenants: int = 10000  # keys beyond this share one bucket
+    max_queue_depth: int = 0  # waiting jobs beyond which submissions get 429 (queue dispatch mode only)
+    admission_max_retry_after_seconds: int = 60
+    # Queue share per key under load, e.g. "key_a:4,key_b:0.5"; unlisted keys weigh 1
+    tenant_weights: str = ""
 
     # Storage
     output_dir: str = "./outputs"
-    enable_s3_storage: bool = False
+    enable_s3_storage: bool = False  # store worker uploads in S3_BUCKET instead of output_dir
+    s3_bucket: str = ""
+    s3_prefix: str = "outputs/"
+    s3_endpoint_url: str = ""  # for S3-compatible stores (MinIO, R2, ...)
+    max_output_mb: int = 64  # largest accepted PUT /jobs/{id}/output
+    max_preview_kb: int = 256  # largest accepted PUT /jobs/{id}/preview
+
+    # Job Store
+    job_store_backend: str = "memory"  # "memory" or "sql"
+    database_url: str = "sqlite:///./data/aidp_jobs.db"
+    job_store_write_batch_size: int = 500
+    job_store_flush_interval_ms: int = 50
+
+    # Job Retention (memory backend); 0 disables a bound
+    max_live_jobs: int = 10000
+    terminal_job_ttl_seconds: int = 3600
+    job_archive_path: str = "./data/job_archive.jsonl"
+
+    # Result Cache: finished images keyed by request hash
+    result_cache_enabled: bool = True
+    result_cache_dir: str = "./data/result_cache"
+    result_cache_max_mb: int = 1024
+
+    # Attach duplicates of in-flight jobs to the running job (single-flight)
+    coalesce_duplicate_jobs: bool = True
 
     # Logging
     log_level: str = "INFO"
@@ -41,6 +93,8 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
         case_sensitive = False
+        # Worker variables (WORKER_*, SUPERVISOR_*, CPU_*) may sit in the same file
+        extra = "ignore"
 
 
 @lru_cache()
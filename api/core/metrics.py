@@ -0,0 +1,298 @@
+"""
+Prometheus-style metrics, served by GET /metrics in the text exposition format.
+
+Recording sits on hot paths (every request, every job transition), so it
+takes no locks: each thread adds to its own shard of a series, a plain list
+of slots, and a scrape sums the shards. The only lock is taken the first
+time a thread records into a series and when the thread exits, which folds
+its shard into the series' base total. Labelled children are created once and
+then looked up by their label tuple; callers on hot paths keep the child.
+
+Values that already live elsewhere (queue depth, cache counters, worker
+stats) are not duplicated here: collectors registered with
+REGISTRY.collector() read them at scrape time.
+"""
+
+import bisect
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Seconds; request latencies up to job lifetimes
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Shard:
+    """Holds a thread's slots; collected with the thread's locals when it exits."""
+
+    __slots__ = ("slots", "__weakref__")
+
+    def __init__(self, slots: List[float]):
+        self.slots = slots
+
+
+class _Sharded:
+    """Slots kept per thread and summed on read. Shards of exited threads are folded into a base."""
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._base = [0.0] * size
+        self._shards: Dict[int, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def _slots(self) -> List[float]:
+        try:
+            return self._local.slots
+        except AttributeError:
+            slots = [0.0] * self._size
+            with self._lock:
+                self._shards[id(slots)] = slots
+            # Thread pools retire idle threads; keep their counts, not their shards
+            shard = self._local.shard = _Shard(slots)
+            weakref.finalize(shard, self._retire, slots)
+            self._local.slots = slots
+            return slots
+
+    def _retire(self, slots: List[float]):
+        with self._lock:
+            if self._shards.pop(id(slots), None) is not None:
+                for i, value in enumerate(slots):
+                    self._base[i] += value
+
+    def _totals(self) -> List[float]:
+        with self._lock:
+            shards = list(self._shards.values())
+            totals = list(self._base)
+        for slots in shards:
+            for i, value in enumerate(slots):
+                totals[i] += value
+        return totals
+
+
+class Counter(_Sharded):
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount: float = 1.0):
+        self._slots()[0] += amount
+
+    def value(self) -> float:
+        return self._totals()[0]
+
+
+class Histogram(_Sharded):
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One slot per bucket, one for +Inf, one for the sum
+        super().__init__(len(self.buckets) + 2)
+
+    def observe(self, value: float):
+        slots = self._slots()
+        slots[bisect.bisect_left(self.buckets, value)] += 1
+        slots[-1] += value
+
+    def time(self) -> "_Timer":
+        """Context manager observing the seconds its block takes."""
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[float], float, float]:
+        """(cumulative bucket counts including +Inf, sum, count)."""
+        totals = self._totals()
+        cumulative, running = [], 0.0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1], running
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Family:
+    """A metric and its labelled children."""
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: Sequence[str], factory: Callable):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    # Shortcuts for metrics without labels
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def children(self) -> List[tuple]:
+        with self._lock:
+            return list(self._children.items())
+
+
+class Registry:
+    def __init__(self):
+        self._families: List[Family] = []
+        self._collectors: List[Callable[[], Iterable[tuple]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Family:
+        return self._add(Family(name, documentation, "counter", labelnames, Counter))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Family:
+        return self._add(Family(name, documentation, "histogram", labelnames, lambda: Histogram(buckets)))
+
+    def _add(self, family: Family) -> Family:
+        self._families.append(family)
+        return family
+
+    def collector(self, collect: Callable[[], Iterable[tuple]]):
+        """
+        Register a function yielding (name, kind, documentation, samples) at
+        scrape time, samples being [(labels dict, value)].
+        """
+        self._collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        lines = []
+        for family in self._families:
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in family.children():
+                labels = dict(zip(family.labelnames, values))
+                if family.kind == "histogram":
+                    cumulative, total, count = child.snapshot()
+                    bounds = [_format(bound) for bound in child.buckets] + ["+Inf"]
+                    for bound, bucket_count in zip(bounds, cumulative):
+                        lines.append(f"{family.name}_bucket{_labels({**labels, 'le': bound})} {_format(bucket_count)}")
+                    lines.append(f"{family.name}_sum{_labels(labels)} {_format(total)}")
+                    lines.append(f"{family.name}_count{_labels(labels)} {_format(count)}")
+                else:
+                    lines.append(f"{family.name}{_labels(labels)} {_format(child.value())}")
+
+        for collect in self._collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{_labels(labels)} {_format(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "acr_http_request_duration_seconds",
+    "Time from request to response headers, per route",
+    ("method", "route"),
+)
+HTTP_REQUESTS = REGISTRY.counter(
+    "acr_http_requests_total",
+    "Requests served, per route and status code",
+    ("method", "route", "status"),
+)
+JOB_STATE_SECONDS = REGISTRY.histogram(
+    "acr_job_state_seconds",
+    "Time jobs spent in a state before leaving it (pending: until leased, running: until finished)",
+    ("state",),
+)
+JOBS_FINISHED = REGISTRY.counter(
+    "acr_jobs_finished_total",
+    "Jobs that reached a terminal status",
+    ("status",),
+)
+WORKER_PHASE_SECONDS = REGISTRY.histogram(
+    "acr_worker_phase_seconds",
+    "Worker-reported time per phase of a completed job",
+    ("phase",),
+)
+AIDP_API_SECONDS = REGISTRY.histogram(
+    "acr_aidp_api_request_duration_seconds",
+    "Latency of AIDP marketplace submissions, by outcome (ok, rejected, error)",
+    ("outcome",),
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request until its response headers go
+    out (so long streams and downloads measure time to first byte), labelled
+    with the matched route template rather than the raw path.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                route = scope.get("route")
+                HTTP_REQUEST_SECONDS.labels(scope["method"], route.path if route else "unmatched").observe(
+                    time.perf_counter() - start
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUESTS.labels(scope["method"], route.path if route else "unmatched", status[0]).inc()
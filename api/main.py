@@ -1,10 +1,41 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from api.routes import jobs
+from fastapi.concurrency import run_in_threadpool
+from api.core.config import get_settings
+from api.core.metrics import MetricsMiddleware
+from api.routes import jobs, workers, system
+from api.services.aidp_integration import init_aidp_client, close_aidp_client
+from api.services.job_manager import reap_deadlines
+
+
+async def reap_deadlines_periodically():
+    """Fail jobs past their deadline, also when no worker is polling."""
+    while True:
+        await asyncio.sleep(get_settings().deadline_check_seconds)
+        await run_in_threadpool(reap_deadlines)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled marketplace client for the lifetime of the app
+    init_aidp_client()
+    reaper = asyncio.create_task(reap_deadlines_periodically())
+    yield
+    reaper.cancel()
+    await close_aidp_client()
+
 
 app = FastAPI(
     title="AIDP Agent Compute Router",
     description="Decentralized GPU execution layer for AI agents",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(jobs.router)
+app.include_router(workers.router)
+app.include_router(system.router)
@@ -1,7 +1,7 @@
 from enum import Enum
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 
 class JobStatus(str, Enum):
@@ -10,6 +10,7 @@ class JobStatus(str, Enum):
     RUNNING = "RUNNING"
     COMPLETED = "COMPLETED"
     FAILED = "FAILED"
+    CANCELLED = "CANCELLED"
 
 
 class JobType(str, Enum):
@@ -19,6 +20,46 @@ class JobType(str, Enum):
     ZK_PROOF = "ZK_PROOF"
 
 
+class Sampler(str, Enum):
+    DEFAULT = "default"  # the model's own scheduler (PNDM for SD 1.5)
+    DDIM = "ddim"
+    EULER = "euler"
+    EULER_ANCESTRAL = "euler_a"
+    DPM_SOLVER_PP = "dpm_solver_pp"
+    UNIPC = "unipc"
+
+
+class Priority(str, Enum):
+    INTERACTIVE = "interactive"  # an agent is waiting on the result
+    STANDARD = "standard"
+    BATCH = "batch"  # bulk work that can wait
+
+
+# Queue order of the priority classes, most urgent first
+PRIORITY_RANK = {
+    Priority.INTERACTIVE: 0,
+    Priority.STANDARD: 1,
+    Priority.BATCH: 2,
+}
+
+
+class OutputFormat(str, Enum):
+    PNG = "png"
+    WEBP = "webp"
+    JPEG = "jpeg"
+
+
+# Fewest steps that still give usable images with each sampler
+SAMPLER_MIN_STEPS = {
+    Sampler.DEFAULT: 10,
+    Sampler.DDIM: 10,
+    Sampler.EULER: 10,
+    Sampler.EULER_ANCESTRAL: 10,
+    Sampler.DPM_SOLVER_PP: 4,
+    Sampler.UNIPC: 4,
+}
+
+
 class AIDPNodeInfo(BaseModel):
     """AIDP GPU node information"""
     node_id: Optional[str] = None
@@ -56,10 +97,54 @@ class AIDPInfo(BaseModel):
     api_mode: Optional[str] = None  # "live" or "simulation"
 
 
+class ExecutionInfo(BaseModel):
+    """How the GPU worker executed the job"""
+    execution_time: Optional[float] = None
+    batch_size: Optional[int] = None  # jobs rendered in the same pipeline call
+    batch_wait_ms: Optional[float] = None  # time spent filling the batch
+    steps_run: Optional[int] = None  # denoising steps actually executed (billed)
+    model_load_ms: Optional[float] = None  # time spent loading or restoring the checkpoint (in execution_time)
+    cache_hit: Optional[bool] = None  # served from the result cache, no GPU run
+    coalesced_with: Optional[str] = None  # job whose GPU run produced this result
+    output_bytes: Optional[int] = None  # size of the encoded image
+    encode_ms: Optional[float] = None  # time spent encoding and writing it
+    preemptions: Optional[int] = None  # times more urgent work ran in the middle of this job
+    preempted_ms: Optional[float] = None  # time spent parked meanwhile (not in execution_time)
+    avg_step_ms: Optional[float] = None  # mean time per denoising step
+
+
 class JobCreateRequest(BaseModel):
     type: JobType = JobType.TEXT_TO_IMAGE
     prompt: str
-    steps: int = Field(default=30, ge=10, le=50)
+    negative_prompt: Optional[str] = None
+    steps: int = Field(default=30, ge=1, le=50)
+    sampler: Sampler = Sampler.DEFAULT
+    model: Optional[str] = None  # checkpoint id; defaults to Settings.model_id
+    seed: Optional[int] = Field(default=None, ge=0, le=2**32 - 1)
+    region: Optional[str] = None  # preferred AIDP node region, e.g. "eu-west"
+    priority: Priority = Priority.STANDARD
+    output_format: OutputFormat = OutputFormat.PNG
+    output_quality: Optional[int] = Field(default=None, ge=1, le=100)  # WebP/JPEG; worker default if unset
+    png_compression: Optional[int] = Field(default=None, ge=0, le=9)  # zlib level; worker default if unset
+    previews: bool = False  # low-res latent previews while the job runs (preview_url)
+    timeout_seconds: Optional[int] = Field(default=None, ge=1, le=3600)  # from submission; Settings.job_timeout_seconds if unset
+
+    @model_validator(mode="after")
+    def check_min_steps(self):
+        min_steps = SAMPLER_MIN_STEPS[self.sampler]
+        if self.steps < min_steps:
+            raise ValueError(f"steps must be at least {min_steps} with the {self.sampler.value} sampler")
+        return self
+
+
+class JobProgress(BaseModel):
+    """Denoising progress reported by the worker"""
+    step: int
+    total_steps: int
+    fraction: float
+    step_ms: Optional[float] = None  # duration of the latest step
+    avg_step_ms: Optional[float] = None  # mean duration of the steps so far
+    preview_step: Optional[int] = None  # step the current preview was taken at
 
 
 class JobResponse(BaseModel):
@@ -69,7 +154,16 @@ class JobResponse(BaseModel):
     compute_cost: Optional[float] = None
     error: Optional[str] = None
     created_at: datetime
+    deadline: Optional[datetime] = None  # failed with a timeout if not finished by then
     # AIDP Integration Fields
     aidp: Optional[AIDPInfo] = None
     proof_of_execution: Optional[AIDPProof] = None
+    execution: Optional[ExecutionInfo] = None
+    progress: Optional[JobProgress] = None
+    preview_url: Optional[str] = None  # latest latent preview while running
+
 
+class JobListResponse(BaseModel):
+    """Several jobs in one response (bulk submission and lookup)"""
+    jobs: List[JobResponse] = []
+    missing: List[str] = []  # requested ids that do not exist
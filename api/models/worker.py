@@ -0,0 +1,41 @@
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any
+
+from api.models.job import Priority
+
+
+class LeaseRequest(BaseModel):
+    """Worker asking the router for work"""
+    worker_id: str
+    max_jobs: int = Field(default=1, ge=1, le=64)
+    visibility_timeout: Optional[float] = Field(default=None, gt=0, le=3600)
+    # Only lease jobs batchable with this key (used while filling a micro-batch)
+    batch_key: Optional[str] = None
+    # Models the worker has resident; jobs for them are handed out first
+    warm_models: Optional[List[str]] = None
+    # Worker-side counters (e.g. prompt embedding cache), shown in /system/stats
+    stats: Optional[Dict[str, Any]] = None
+    # Only lease jobs more urgent than this class (a busy worker checking whether to preempt)
+    more_urgent_than: Optional[Priority] = None
+
+
+class Lease(BaseModel):
+    """A job handed to a worker until expires_at"""
+    lease_id: str
+    job_id: str
+    attempt: int
+    expires_at: float
+    payload: Dict[str, Any]
+
+
+class LeaseResponse(BaseModel):
+    leases: List[Lease] = []
+
+
+class HeartbeatRequest(BaseModel):
+    visibility_timeout: Optional[float] = Field(default=None, gt=0, le=3600)
+
+
+class NackRequest(BaseModel):
+    requeue: bool = True
+    error: Optional[str] = None
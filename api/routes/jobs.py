@@ -1,17 +1,53 @@
-from fastapi import APIRouter, HTTPException, Body
+import asyncio
+import json
+import os
+
+from typing import List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Body, Header, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from api.models.job import (
     JobCreateRequest, 
     JobResponse, 
+    JobListResponse,
     AIDPInfo, 
     AIDPProof,
     AIDPNodeInfo,
+    ExecutionInfo,
     JobStatus,
 )
-from api.services.job_manager import create_job, get_job, update_job
-from api.services.aidp_client import submit_gpu_job, complete_aidp_job
+from api.core.config import get_settings
+from api.services.admission import ADMISSION, tenant_id
+from api.services.job_manager import (
+    BLOB_STORE,
+    JOB_QUEUE,
+    available_models,
+    cancel_job,
+    create_job,
+    create_jobs,
+    get_job,
+    get_jobs,
+    job_output,
+    live_progress,
+    record_progress,
+    store_output,
+    store_preview,
+    PREVIEWS,
+    update_job,
+    TERMINAL_STATUSES,
+)
+from api.services.job_events import JOB_EVENTS, job_event
+from api.services.aidp_client import submit_gpu_job, submit_gpu_jobs, complete_aidp_job
 
 router = APIRouter(prefix="/jobs", tags=["Jobs"])
 
+# Seconds between SSE keep-alive comments on an idle stream
+STREAM_KEEPALIVE_SECONDS = 15.0
+TERMINAL_STATUS_VALUES = {status.value for status in TERMINAL_STATUSES}
+# Bytes of an uploaded output buffered between writes to disk
+UPLOAD_WRITE_BYTES = 1024 * 1024
+
 
 def build_aidp_info(job: dict) -> AIDPInfo | None:
     """Build AIDPInfo model from job's aidp_data."""
@@ -54,13 +90,16 @@ def build_proof(job: dict) -> AIDPProof | None:
     )
 
 
-@router.post("/", response_model=JobResponse)
-def create_compute_job(payload: JobCreateRequest):
-    job = create_job(payload)
+def build_execution_info(job: dict) -> ExecutionInfo | None:
+    """Build ExecutionInfo model from worker-reported execution data."""
+    execution = job.get("execution")
+    if not execution:
+        return None
+
+    return ExecutionInfo(**execution)
 
-    # Route job through AIDP GPU network
-    aidp_data = submit_gpu_job(job)
 
+def build_job_response(job: dict) -> JobResponse:
     return JobResponse(
         job_id=job["id"],
         status=job["status"],
@@ -68,11 +107,103 @@ def create_compute_job(payload: JobCreateRequest):
         compute_cost=job["compute_cost"],
         error=job.get("error"),
         created_at=job["created_at"],
+        deadline=job.get("deadline"),
         aidp=build_aidp_info(job),
-        proof_of_execution=None,  # Proof generated on completion
+        proof_of_execution=build_proof(job),  # Proof generated on completion
+        execution=build_execution_info(job),
+        **live_progress(job),
     )
 
 
+def check_models(payloads: List[JobCreateRequest]):
+    models = available_models()
+    for payload in payloads:
+        if payload.model is not None and payload.model not in models:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Unknown model {payload.model!r}, available: {models}",
+            )
+
+
+def admit(api_key: Optional[str], n: int) -> str:
+    """
+    Admission control for n new jobs from a client. Returns its tenant, or
+    raises 429 with Retry-After when it is over its rate or the queue is full.
+    """
+    tenant = tenant_id(api_key)
+    rejection = ADMISSION.admit(tenant, n, JOB_QUEUE.ready_count())
+    if rejection:
+        reason, retry_after = rejection
+        detail = (
+            "Job queue is full, retry later" if reason == "queue_full"
+            else "Rate limit exceeded for this API key"
+        )
+        raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+    return tenant
+
+
+@router.post("/", response_model=JobResponse)
+async def create_compute_job(payload: JobCreateRequest, x_api_key: Optional[str] = Header(None)):
+    check_models([payload])
+    tenant = admit(x_api_key, 1)
+
+    # Store writes may hit a database; keep them off the event loop
+    job = await run_in_threadpool(create_job, payload, tenant)
+
+    # Route job through AIDP GPU network
+    await submit_gpu_job(job)
+
+    return build_job_response(job)
+
+
+@router.post("/batch", response_model=JobListResponse)
+async def create_compute_jobs(payload: List[JobCreateRequest] = Body(...), x_api_key: Optional[str] = Header(None)):
+    """Submit many jobs in one round trip; routing and enqueueing happen in one pass."""
+    if len(payload) > get_settings().max_batch_jobs:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {get_settings().max_batch_jobs} jobs per batch",
+        )
+    check_models(payload)
+    tenant = admit(x_api_key, len(payload))
+
+    jobs = await run_in_threadpool(create_jobs, payload, tenant)
+
+    # Route jobs through AIDP GPU network
+    await submit_gpu_jobs(jobs)
+
+    return JobListResponse(jobs=[build_job_response(job) for job in jobs])
+
+
+def lookup_jobs(job_ids: List[str]) -> JobListResponse:
+    job_ids = list(dict.fromkeys(job_id for job_id in job_ids if job_id))
+
+    if len(job_ids) > get_settings().max_batch_jobs:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {get_settings().max_batch_jobs} ids per request",
+        )
+
+    found = get_jobs(job_ids)
+
+    return JobListResponse(
+        jobs=[build_job_response(found[job_id]) for job_id in job_ids if job_id in found],
+        missing=[job_id for job_id in job_ids if job_id not in found],
+    )
+
+
+@router.get("/", response_model=JobListResponse)
+def list_compute_jobs(ids: str = Query(..., description="Comma-separated job ids")):
+    """Look up many jobs in one request."""
+    return lookup_jobs(ids.split(","))
+
+
+@router.post("/lookup", response_model=JobListResponse)
+def lookup_compute_jobs(ids: List[str] = Body(...)):
+    """Same as GET /jobs?ids=..., for id lists too long for a URL."""
+    return lookup_jobs(ids)
+
+
 @router.get("/{job_id}", response_model=JobResponse)
 def get_compute_job(job_id: str):
     job = get_job(job_id)
@@ -80,27 +211,257 @@ def get_compute_job(job_id: str):
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    return JobResponse(
-        job_id=job["id"],
-        status=job["status"],
-        output_url=job["output_url"],
-        compute_cost=job["compute_cost"],
-        error=job.get("error"),
-        created_at=job["created_at"],
-        aidp=build_aidp_info(job),
-        proof_of_execution=build_proof(job),
-    )
+    return build_job_response(job)
 
 
-@router.post("/{job_id}/callback")
-def gpu_job_callback(job_id: str, payload: dict = Body(...)):
+@router.delete("/{job_id}", response_model=JobResponse)
+def cancel_compute_job(job_id: str):
+    """
+    Cancel a job. A queued job is dropped from the queue; a running one is
+    stopped by its worker at the next denoising step. Coalesced duplicates
+    of it are not cancelled: one of them takes over the GPU run.
+    """
     job = get_job(job_id)
 
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    # Update job with callback data
-    update_job(job, payload)
+    result = cancel_job(job)
+    if result == "finished":
+        raise HTTPException(status_code=409, detail=f"Job already {job['status'].value}")
+
+    return build_job_response(job)
+
+
+async def job_event_stream(job_id: str):
+    """
+    Yield the job's current state, then every state change until it reaches
+    a terminal status. Yields None when nothing happened for a while.
+    """
+    # Subscribe before reading the snapshot so no transition is missed
+    queue = JOB_EVENTS.subscribe(job_id)
+    try:
+        job = get_job(job_id)
+        if not job:
+            return
+
+        event = job_event(job, live_progress(job))
+        yield event
+
+        while event["status"] not in TERMINAL_STATUS_VALUES:
+            try:
+                event = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            yield event
+    finally:
+        JOB_EVENTS.unsubscribe(job_id, queue)
+
+
+def _remove_file(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+@router.put("/{job_id}/output")
+async def upload_job_output(job_id: str, request: Request):
+    """
+    Encoded output image of a job, streamed by its worker as the raw request
+    body with its Content-Type. The worker then reports the returned
+    output_url in its callback.
+    """
+    job = await run_in_threadpool(get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    content_type = request.headers.get("content-type", "application/octet-stream").split(";")[0]
+    max_bytes = get_settings().max_output_mb * 1024 * 1024
+    path = BLOB_STORE.new_upload_path()
+
+    # Disk writes run in the threadpool, a few chunks at a time, so a slow
+    # disk does not stall the event loop
+    size = 0
+    try:
+        f = await run_in_threadpool(open, path, "wb")
+        try:
+            pending, pending_bytes = [], 0
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Outputs are limited to {get_settings().max_output_mb} MB")
+                pending.append(chunk)
+                pending_bytes += len(chunk)
+                if pending_bytes >= UPLOAD_WRITE_BYTES:
+                    await run_in_threadpool(f.writelines, pending)
+                    pending, pending_bytes = [], 0
+            await run_in_threadpool(f.writelines, pending)
+        finally:
+            await run_in_threadpool(f.close)
+        info = await run_in_threadpool(store_output, job, path, content_type)
+    finally:
+        await run_in_threadpool(_remove_file, path)
+
+    return {"output_url": f"/jobs/{job_id}/output", **info}
+
+
+@router.put("/{job_id}/preview")
+async def upload_job_preview(job_id: str, request: Request, step: Optional[int] = Query(None)):
+    """Low-res preview of a running job at a denoising step, sent by its worker."""
+    job = await run_in_threadpool(get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    data = await request.body()
+    if len(data) > get_settings().max_preview_kb * 1024:
+        raise HTTPException(status_code=413, detail=f"Previews are limited to {get_settings().max_preview_kb} KB")
+    if job["status"] in TERMINAL_STATUSES:
+        return {"status": "finished"}
+
+    content_type = request.headers.get("content-type", "image/jpeg").split(";")[0]
+    store_preview(job, data, content_type, step)
+    return {"status": "acknowledged", "preview_url": f"/jobs/{job_id}/preview"}
+
+
+@router.get("/{job_id}/preview")
+def download_job_preview(job_id: str):
+    """Latest preview of a running job; 404 once it has finished or if it has none."""
+    preview = PREVIEWS.get(job_id)
+    if preview is None:
+        raise HTTPException(status_code=404, detail="No preview for this job")
+
+    headers = {"Cache-Control": "no-store"}
+    if preview["step"] is not None:
+        headers["X-Preview-Step"] = str(preview["step"])
+    return Response(preview["data"], media_type=preview["content_type"], headers=headers)
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, end) of a single-range "bytes=..." header, end inclusive.
+    None means serve the whole file; raises 416 when nothing is satisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None  # multipart ranges are not supported, send everything
+
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+@router.get("/{job_id}/output")
+def download_job_output(job_id: str, request: Request):
+    """
+    Stream a job's output image. Supports single byte ranges (Range /
+    If-Range) and conditional requests (ETag / If-None-Match).
+    """
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    output = job_output(job)
+    info = output[0].stat(output[1]) if output else None
+    if info is None:
+        raise HTTPException(status_code=404, detail="Job has no output yet")
+    store, key = output
+
+    headers = {"ETag": info["etag"], "Accept-Ranges": "bytes"}
+    if request.headers.get("if-none-match") in (info["etag"], "*"):
+        return Response(status_code=304, headers=headers)
+
+    size = info["size"]
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", info["etag"]) == info["etag"]:
+        byte_range = parse_range(range_header, size)
+
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range:
+        status_code = 206
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(
+        store.read(key, start, end) if size else iter(()),
+        status_code=status_code,
+        media_type=info["content_type"] or "application/octet-stream",
+        headers=headers,
+    )
+
+
+@router.get("/{job_id}/events")
+async def stream_compute_job(job_id: str):
+    """
+    Server-sent events stream of job state changes ("status") and denoising
+    progress ("progress"), closed once the job finishes.
+    """
+    if not get_job(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def sse():
+        async for event in job_event_stream(job_id):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        sse(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/{job_id}/ws")
+async def watch_compute_job(websocket: WebSocket, job_id: str):
+    """WebSocket variant of the job event stream."""
+    await websocket.accept()
+
+    if not get_job(job_id):
+        await websocket.close(code=4404, reason="Job not found")
+        return
+
+    try:
+        async for event in job_event_stream(job_id):
+            if event is not None:
+                await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
+def apply_callback(job: dict, payload: dict) -> dict:
+    """Record a worker result on its job; shared by the single and bulk callbacks."""
+    # Workers deliver at least once, so a resent terminal result is not applied twice
+    status = str(payload.get("status", "")).upper()
+    if job["status"] in TERMINAL_STATUSES and job["status"].value == status:
+        return {"status": "duplicate"}
+    # A result that arrives after the client gave up is dropped
+    if job["status"] == JobStatus.CANCELLED:
+        return {"status": "cancelled"}
+
+    # Terminal states are final, e.g. a late "completed" for a job that
+    # failed at its deadline is acknowledged but not applied
+    if not update_job(job, payload):
+        return {"status": "finished"}
     
     # If job completed successfully, generate proof of execution
     if payload.get("status") == "completed" and payload.get("output_url"):
@@ -113,3 +474,54 @@ def gpu_job_callback(job_id: str, payload: dict = Body(...)):
         }
 
     return {"status": "acknowledged"}
+
+
+@router.post("/progress")
+def gpu_job_progress(payload: List[dict] = Body(...)):
+    """
+    Step progress of running jobs, one item per job: job_id, step,
+    total_steps and step timings. Sent by workers as they denoise.
+    """
+    if len(payload) > get_settings().max_batch_jobs:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {get_settings().max_batch_jobs} updates per request",
+        )
+
+    return {"results": record_progress(payload)}
+
+
+@router.post("/callbacks")
+def gpu_job_callbacks(payload: List[dict] = Body(...)):
+    """
+    Results of several jobs in one request, each a callback payload with its
+    job_id. Every item gets its own result, so one unknown job does not make
+    the worker resend the rest.
+    """
+    if len(payload) > get_settings().max_batch_jobs:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {get_settings().max_batch_jobs} callbacks per request",
+        )
+
+    found = get_jobs([item["job_id"] for item in payload if item.get("job_id")])
+
+    results = []
+    for item in payload:
+        job = found.get(item.get("job_id"))
+        if not job:
+            results.append({"job_id": item.get("job_id"), "status": "not_found"})
+            continue
+        results.append({"job_id": job["id"], **apply_callback(job, item)})
+
+    return {"results": results}
+
+
+@router.post("/{job_id}/callback")
+def gpu_job_callback(job_id: str, payload: dict = Body(...)):
+    job = get_job(job_id)
+
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return apply_callback(job, payload)
@@ -0,0 +1,35 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from api.core.metrics import CONTENT_TYPE, REGISTRY
+from api.services.job_manager import get_stats
+from api.services.aidp_integration import AIDP_API_BREAKER, live_api_enabled
+from api.services.circuit_breaker import CLOSED
+
+router = APIRouter(tags=["System"])
+
+
+@router.get("/health")
+def health():
+    """Liveness plus the state of the AIDP marketplace circuit breaker."""
+    breaker = AIDP_API_BREAKER.snapshot()
+    live = live_api_enabled()
+
+    return {
+        "status": "degraded" if live and breaker["state"] != CLOSED else "ok",
+        "aidp_api": {
+            "mode": "live" if live else "simulation",
+            "circuit_breaker": breaker,
+        },
+    }
+
+
+@router.get("/system/stats")
+def system_stats():
+    """Job retention, queue and memory counters."""
+    return get_stats()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Latency histograms and counters in the Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
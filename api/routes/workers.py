@@ -0,0 +1,77 @@
+from fastapi import APIRouter, HTTPException
+from api.models.worker import (
+    LeaseRequest,
+    LeaseResponse,
+    Lease,
+    HeartbeatRequest,
+    NackRequest,
+)
+from api.services.job_manager import (
+    list_workers,
+    lease_jobs,
+    heartbeat_lease,
+    ack_lease,
+    nack_lease,
+)
+
+router = APIRouter(prefix="/workers", tags=["Workers"])
+
+
+@router.get("/")
+def get_workers():
+    """
+    Resident workers that have polled this router: health, live leases and
+    the counters they report (utilization, restarts, caches, warm models).
+    """
+    return {"workers": list_workers()}
+
+
+@router.post("/lease", response_model=LeaseResponse)
+def lease_work(payload: LeaseRequest):
+    """
+    Resident GPU workers pull jobs here.
+    Each job is leased until expires_at; an empty list means the queue is idle.
+    Multi-job leases only contain jobs that can share one batched diffusion call.
+    Jobs for models listed in warm_models are preferred, and more urgent
+    priority classes always go first.
+    """
+    leases = lease_jobs(
+        payload.worker_id,
+        payload.max_jobs,
+        payload.visibility_timeout,
+        payload.batch_key,
+        payload.stats,
+        payload.warm_models,
+        payload.more_urgent_than,
+    )
+    return LeaseResponse(leases=[Lease(**lease) for lease in leases])
+
+
+@router.post("/leases/{lease_id}/heartbeat")
+def heartbeat_work(lease_id: str, payload: HeartbeatRequest = HeartbeatRequest()):
+    lease = heartbeat_lease(lease_id, payload.visibility_timeout)
+
+    if not lease:
+        raise HTTPException(status_code=404, detail="Lease not found or expired")
+
+    return lease
+
+
+@router.post("/leases/{lease_id}/ack")
+def ack_work(lease_id: str):
+    job_id = ack_lease(lease_id)
+
+    if not job_id:
+        raise HTTPException(status_code=404, detail="Lease not found or expired")
+
+    return {"status": "acked", "job_id": job_id}
+
+
+@router.post("/leases/{lease_id}/nack")
+def nack_work(lease_id: str, payload: NackRequest = NackRequest()):
+    result = nack_lease(lease_id, payload.requeue, payload.error)
+
+    if not result:
+        raise HTTPException(status_code=404, detail="Lease not found or expired")
+
+    return {"status": "nacked", **result}
@@ -0,0 +1,196 @@
+"""
+Admission control in front of job submission.
+
+Every client, identified by its X-API-Key header, has a token bucket of
+`rate_limit_burst` jobs refilled at `rate_limit_per_second`. A submission
+that would overdraw it is refused with 429 and a Retry-After of when the
+bucket will have refilled enough. Independently, once `max_queue_depth` jobs
+are waiting in the queue, new work from everyone is refused with a
+Retry-After estimated from how fast workers have drained the queue over the
+last `drain_window` seconds. The cap only applies in queue dispatch mode:
+one-shot worker processes never wait in the queue. Which jobs run first among
+admitted tenants is decided by the queue's weighted fair queuing (see
+job_queue.py).
+
+Keys are not authenticated here; they only separate clients. Tenants are
+identified by a hash of the key, so raw keys never reach job records. A
+bucket is dropped once it has refilled, which is the state a new one starts
+in, and at most `max_tenants` buckets are kept: keys beyond that share one
+overflow bucket, so rotating keys neither grows memory nor escapes the limit
+for long. State is in memory and per router process.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from api.core.config import get_settings
+
+ANONYMOUS = "anonymous"
+
+# Bucket of keys arriving while max_tenants buckets are in use
+OVERFLOW = "overflow"
+
+
+def tenant_id(api_key: Optional[str]) -> str:
+    """Stable, non-reversible tenant name for an API key."""
+    if not api_key:
+        return ANONYMOUS
+    return f"key_{hashlib.sha256(api_key.encode()).hexdigest()[:12]}"
+
+
+def parse_tenant_weights(spec: str) -> Dict[str, float]:
+    """"key_a:4,key_b:0.5" (raw API keys) -> {tenant_id: weight}."""
+    weights = {}
+    for item in spec.split(","):
+        key, _, weight = item.strip().rpartition(":")
+        if key and weight:
+            weights[tenant_id(key)] = float(weight)
+    return weights
+
+
+class TokenBucket:
+    """Refills at `rate` tokens per second up to `burst`."""
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def full_at(self) -> float:
+        """Time from which the bucket is full again if nothing is taken."""
+        return self.updated + max(self.burst - self.tokens, 0.0) / self.rate
+
+    def take(self, n: int, now: float) -> float:
+        """
+        Take n tokens. Returns 0 when granted, else the seconds until the
+        request could be. Requests bigger than the burst are granted from a
+        full bucket and leave it in debt.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        needed = min(n, self.burst)
+        if self.tokens >= needed:
+            self.tokens -= n
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Per-tenant token buckets plus a global queue-depth cap."""
+
+    def __init__(
+        self,
+        rate_per_second: float = 0.0,
+        burst: int = 20,
+        max_queue_depth: int = 0,
+        max_retry_after: float = 60.0,
+        drain_window: float = 60.0,
+        max_tenants: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_queue_depth = max_queue_depth
+        self.max_retry_after = max_retry_after
+        self.drain_window = drain_window
+        self.max_tenants = max_tenants
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, TokenBucket] = {}
+        # Idle buckets are swept at most this often
+        self._next_sweep = 0.0
+        # (time, jobs) of recent leases, for the drain rate
+        self._drained: Deque[Tuple[float, int]] = deque()
+        self.counters = {"admitted": 0, "rate_limited": 0, "queue_full": 0}
+
+    def admit(self, tenant: str, n: int, queue_depth: int) -> Optional[Tuple[str, int]]:
+        """
+        Decide whether `tenant` may submit n jobs while queue_depth jobs wait.
+        Returns None if admitted, else (reason, retry_after_seconds).
+        """
+        now = self._clock()
+        with self._lock:
+            if self.max_queue_depth and queue_depth + n > self.max_queue_depth:
+                self.counters["queue_full"] += 1
+                excess = queue_depth + n - self.max_queue_depth
+                rate = self._drain_rate(now)
+                wait = excess / rate if rate else self.max_retry_after
+                return "queue_full", self._retry_after(wait)
+
+            if self.rate_per_second > 0:
+                bucket = self._bucket(tenant, now)
+                wait = bucket.take(n, now)
+                if wait:
+                    self.counters["rate_limited"] += 1
+                    return "rate_limited", self._retry_after(wait)
+
+            self.counters["admitted"] += n
+            return None
+
+    def _bucket(self, tenant: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(tenant)
+        if bucket is not None:
+            return bucket
+        if now >= self._next_sweep:
+            self._sweep(now)
+        if len(self._buckets) >= self.max_tenants:
+            tenant = OVERFLOW
+            bucket = self._buckets.get(tenant)
+            if bucket is not None:
+                return bucket
+        bucket = self._buckets[tenant] = TokenBucket(self.rate_per_second, self.burst, now)
+        return bucket
+
+    def _sweep(self, now: float):
+        """Drop buckets that have refilled: a new one would start full too."""
+        for tenant in [tenant for tenant, bucket in self._buckets.items() if bucket.full_at() <= now]:
+            del self._buckets[tenant]
+        self._next_sweep = now + self.burst / self.rate_per_second
+
+    def record_drained(self, n: int):
+        """Count jobs handed to workers."""
+        if n:
+            with self._lock:
+                self._drained.append((self._clock(), n))
+
+    def _drain_rate(self, now: float) -> float:
+        while self._drained and self._drained[0][0] < now - self.drain_window:
+            self._drained.popleft()
+        return sum(n for _, n in self._drained) / self.drain_window
+
+    def _retry_after(self, seconds: float) -> int:
+        return int(min(max(math.ceil(seconds), 1), self.max_retry_after))
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self._next_sweep = 0.0
+            self._drained.clear()
+            for key in self.counters:
+                self.counters[key] = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "tenants": len(self._buckets),
+                "drain_rate_per_second": round(self._drain_rate(self._clock()), 3),
+            }
+
+
+_settings = get_settings()
+
+ADMISSION = AdmissionController(
+    rate_per_second=_settings.rate_limit_per_second,
+    burst=_settings.rate_limit_burst,
+    max_queue_depth=_settings.max_queue_depth,
+    max_retry_after=_settings.admission_max_retry_after_seconds,
+    max_tenants=_settings.rate_limit_max_tenants,
+)
@@ -1,48 +1,161 @@
 import subprocess
 import os
+from fastapi.concurrency import run_in_threadpool
+from api.core.config import get_settings
 from api.models.job import JobStatus
+from api.services.job_manager import (
+    coalesce_jobs,
+    complete_from_cache,
+    deadline_timestamp,
+    enqueue_jobs,
+    save_job,
+    save_jobs,
+    set_dispatcher,
+    sync_followers,
+)
 from api.services.aidp_integration import (
-    submit_to_aidp_network,
+    submit_jobs_to_aidp_network,
     create_execution_proof,
     AIDPJobContext,
 )
 
 
-def submit_gpu_job(job: dict) -> dict:
+def build_worker_payload(job: dict, aidp_data: dict) -> dict:
+    """Job description handed to a GPU worker, either as env vars or from the queue."""
+    return {
+        "job_id": job["id"],
+        "aidp_job_id": aidp_data["aidp_job_id"],
+        "prompt": job["prompt"],
+        "negative_prompt": job.get("negative_prompt"),
+        "steps": job["steps"],
+        "sampler": job["sampler"],
+        "model": job["model"],
+        "seed": job.get("seed"),
+        "priority": job.get("priority", "standard"),
+        "output_format": job.get("output_format", "png"),
+        "output_quality": job.get("output_quality"),
+        "png_compression": job.get("png_compression"),
+        "previews": job.get("previews", False),
+        "deadline": deadline_timestamp(job) if job.get("deadline") else None,
+        "node_id": aidp_data["assigned_node"]["node_id"],
+        "node_wallet": aidp_data["assigned_node"]["wallet"],
+        "batch_key": job["batch_key"],
+    }
+
+
+def launch_worker_process(worker_payload: dict):
+    """One-shot mode: spawn a GPU worker process configured through env vars."""
+    env = os.environ.copy()
+    env["JOB_ID"] = worker_payload["job_id"]
+    env["AIDP_JOB_ID"] = worker_payload["aidp_job_id"]
+    env["PROMPT"] = worker_payload["prompt"]
+    env["STEPS"] = str(worker_payload["steps"])
+    env["SAMPLER"] = worker_payload["sampler"]
+    env["MODEL_ID"] = worker_payload["model"]
+    if worker_payload.get("seed") is not None:
+        env["SEED"] = str(worker_payload["seed"])
+    if worker_payload.get("negative_prompt"):
+        env["NEGATIVE_PROMPT"] = worker_payload["negative_prompt"]
+    env["OUTPUT_FORMAT"] = worker_payload["output_format"]
+    if worker_payload.get("output_quality") is not None:
+        env["OUTPUT_QUALITY"] = str(worker_payload["output_quality"])
+    if worker_payload.get("png_compression") is not None:
+        env["PNG_COMPRESSION"] = str(worker_payload["png_compression"])
+    if worker_payload.get("previews"):
+        env["PREVIEWS"] = "true"
+    if worker_payload.get("deadline"):
+        env["DEADLINE"] = str(worker_payload["deadline"])
+    env["AIDP_NODE_ID"] = worker_payload["node_id"]
+    env["AIDP_NODE_WALLET"] = worker_payload["node_wallet"]
+
+    subprocess.Popen(
+        ["python", "gpu_worker/worker.py"],
+        env=env,
+    )
+
+
+def dispatch_jobs(jobs: list, worker_payloads: list):
+    """Start the GPU runs of routed jobs."""
+    # Resident workers pull the jobs from the router queue
+    if get_settings().dispatch_mode == "queue":
+        enqueue_jobs(jobs, worker_payloads)
+    else:
+        # One-shot mode: AIDP network dispatches to GPU worker
+        for worker_payload in worker_payloads:
+            launch_worker_process(worker_payload)
+
+
+def redispatch_jobs(jobs: list):
+    """Start runs for followers that took over a cancelled or timed-out leader, on its node."""
+    # Followers of a leader still being routed have no node yet; they run
+    # out their deadline
+    jobs = [job for job in jobs if job.get("aidp_data")]
+    dispatch_jobs(jobs, [build_worker_payload(job, job["aidp_data"]) for job in jobs])
+
+
+set_dispatcher(redispatch_jobs)
+
+
+async def submit_gpu_jobs(jobs: list) -> list:
     """
-    Submits job to AIDP GPU marketplace.
+    Submits jobs to AIDP GPU marketplace.
     
     Flow:
-    1. Route job through AIDP network (node selection, cost calculation)
-    2. Store AIDP routing data in job
-    3. Launch GPU worker for execution
-    4. Job status remains PENDING until worker actually starts execution.
+    0. Complete jobs already in the result cache without touching a GPU,
+       and attach duplicates of in-flight jobs to them as followers
+    1. Route each job through AIDP network (node selection, cost calculation)
+    2. Store AIDP routing data in the jobs
+    3. Dispatch to GPU workers (resident worker queue or one-shot processes)
+    4. Job status remains PENDING until a worker actually starts execution.
+
+    Store writes and queue inserts happen once for the whole list, in the
+    threadpool (they may hit a database or spawn processes); only the
+    marketplace round trip runs on the event loop.
     
     Returns:
-        dict: AIDP routing information
+        list: AIDP routing information, one per job (None for cache hits)
     """
+    # Step 0: Identical requests that already ran are served from the cache,
+    # identical requests still running share that run
+    to_route = await run_in_threadpool(_serve_or_coalesce, jobs)
+    if not to_route:
+        return [job.get("aidp_data") for job in jobs]
+
     # Step 1: Submit to AIDP network for routing
-    aidp_data = submit_to_aidp_network(job)
-    
-    # Step 2: Store AIDP data in job for later retrieval
-    job["aidp_data"] = aidp_data
-    
-    # Step 3: Set up environment for GPU worker
-    env = os.environ.copy()
-    env["JOB_ID"] = job["id"]
-    env["AIDP_JOB_ID"] = aidp_data["aidp_job_id"]
-    env["PROMPT"] = job["prompt"]
-    env["STEPS"] = str(job["steps"])
-    env["AIDP_NODE_ID"] = aidp_data["assigned_node"]["node_id"]
-    env["AIDP_NODE_WALLET"] = aidp_data["assigned_node"]["wallet"]
-
-    # Step 4: AIDP network dispatches to GPU worker
-    subprocess.Popen(
-        ["python", "gpu_worker/worker.py"],
-        env=env,
-    )
+    routes = await submit_jobs_to_aidp_network(to_route)
+
+    worker_payloads = []
+    for job, aidp_data in zip(to_route, routes):
+        # Step 2: Store AIDP data in job for later retrieval
+        job["aidp_data"] = aidp_data
+        worker_payloads.append(build_worker_payload(job, aidp_data))
+
+    # Step 3: Hand the jobs to GPU workers
+    await run_in_threadpool(_store_and_dispatch, to_route, worker_payloads)
+
+    return [job.get("aidp_data") for job in jobs]
+
+
+def _serve_or_coalesce(jobs: list) -> list:
+    """Jobs left to route once cache hits are completed and duplicates attached."""
+    return coalesce_jobs(complete_from_cache(jobs))
+
+
+def _store_and_dispatch(jobs: list, worker_payloads: list):
+    save_jobs(jobs)
+    for job in jobs:
+        sync_followers(job)
+    dispatch_jobs(jobs, worker_payloads)
+
+
+async def submit_gpu_job(job: dict) -> dict:
+    """
+    Submits a single job to AIDP GPU marketplace.
     
-    return aidp_data
+    Returns:
+        dict: AIDP routing information
+    """
+    return (await submit_gpu_jobs([job]))[0]
 
 
 def complete_aidp_job(job: dict, output_url: str, execution_time: float) -> dict:
@@ -58,7 +171,7 @@ def complete_aidp_job(job: dict, output_url: str, execution_time: float) -> dict
     Returns:
         dict: Proof of execution data
     """
-    aidp_data = job.get("aidp_data", {})
+    aidp_data = job.get("aidp_data") or {}
     
     # Generate cryptographic proof of execution
     proof = create_execution_proof(
@@ -70,5 +183,7 @@ def complete_aidp_job(job: dict, output_url: str, execution_time: float) -> dict
     
     # Store proof in job
     job["proof_of_execution"] = proof
+    save_job(job)
+    sync_followers(job)
     
     return proof
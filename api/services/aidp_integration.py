@@ -10,12 +10,14 @@ Token: AIDP on Solana
 Contract: PLNk8NUTBeptajEX9GzZrxsYPJ1psnw62dPnWkGcyai
 """
 
+import asyncio
 import os
 import json
 import uuid
 import hashlib
 import random
 import logging
+import time
 from datetime import datetime
 from typing import Dict, Optional, Tuple
 
@@ -25,6 +27,12 @@ try:
 except ImportError:
     HTTPX_AVAILABLE = False
 
+try:
+    import h2  # type: ignore[import-not-found]  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 try:
     from solders.keypair import Keypair  # type: ignore[import-not-found]
     from solders.pubkey import Pubkey  # type: ignore[import-not-found]
@@ -32,6 +40,10 @@ try:
 except ImportError:
     SOLANA_AVAILABLE = False
 
+from api.core.metrics import AIDP_API_SECONDS
+from api.services.circuit_breaker import CircuitBreaker
+from api.services.node_scheduler import NodeScheduler
+
 logger = logging.getLogger(__name__)
 
 
@@ -46,8 +58,35 @@ AIDP_CONFIG = {
     "api_key": os.getenv("AIDP_API_KEY", ""),
     "use_real_api": os.getenv("AIDP_USE_REAL_API", "false").lower() == "true",
     "use_devnet": os.getenv("AIDP_USE_DEVNET", "true").lower() == "true",
+    # Marketplace HTTP client (one pooled client per router process)
+    "http_timeout": float(os.getenv("AIDP_HTTP_TIMEOUT", "10.0")),
+    "http_max_connections": int(os.getenv("AIDP_HTTP_MAX_CONNECTIONS", "100")),
+    "http_max_keepalive": int(os.getenv("AIDP_HTTP_MAX_KEEPALIVE", "20")),
+    "http2": os.getenv("AIDP_HTTP2", "true").lower() == "true",
+    # Circuit breaker around the marketplace API
+    "breaker_failure_rate": float(os.getenv("AIDP_BREAKER_FAILURE_RATE", "0.5")),
+    "breaker_window": int(os.getenv("AIDP_BREAKER_WINDOW", "20")),
+    "breaker_min_calls": int(os.getenv("AIDP_BREAKER_MIN_CALLS", "5")),
+    "breaker_open_seconds": float(os.getenv("AIDP_BREAKER_OPEN_SECONDS", "30")),
+    "breaker_half_open_probes": int(os.getenv("AIDP_BREAKER_HALF_OPEN_PROBES", "1")),
+    # Node selection for simulated routing, see api/services/node_scheduler.py
+    "scheduler_policy": os.getenv("AIDP_SCHEDULER_POLICY", "least_expected_completion"),
+    "scheduler_region_penalty": float(os.getenv("AIDP_SCHEDULER_REGION_PENALTY", "2.0")),
 }
 
+# While open, submissions skip the marketplace and route in simulation
+AIDP_API_BREAKER = CircuitBreaker(
+    "aidp_marketplace",
+    failure_rate_threshold=AIDP_CONFIG["breaker_failure_rate"],
+    window_size=AIDP_CONFIG["breaker_window"],
+    min_calls=AIDP_CONFIG["breaker_min_calls"],
+    open_seconds=AIDP_CONFIG["breaker_open_seconds"],
+    half_open_probes=AIDP_CONFIG["breaker_half_open_probes"],
+)
+
+# App-lifetime marketplace client, see init_aidp_client()
+_http_client = None
+
 # AIDP GPU Node Pool
 AIDP_NODES = [
     {"node_id": "aidp_node_01", "wallet": "AIDPnodeGPU1xKzYZ9AbCdEfGhIjKlMnOpQrStUv", "gpu": "A100", "region": "us-east"},
@@ -56,18 +95,30 @@ AIDP_NODES = [
     {"node_id": "aidp_node_04", "wallet": "AIDPnodeGPU4wXyZ0123456789AbCdEfGhIjKl", "gpu": "RTX4090", "region": "us-west"},
 ]
 
+NODE_SCHEDULER = NodeScheduler(
+    AIDP_NODES,
+    policy=AIDP_CONFIG["scheduler_policy"],
+    region_penalty_seconds=AIDP_CONFIG["scheduler_region_penalty"],
+)
+
 
 def generate_aidp_job_id() -> str:
     """Generate AIDP-style job ID"""
     return f"aidp_{uuid.uuid4().hex[:16]}"
 
 
-def select_gpu_node() -> Dict:
+def select_gpu_node(steps: int = 30, region: Optional[str] = None) -> Dict:
     """
-    Select optimal GPU node from AIDP network based on availability.
+    Select optimal GPU node from AIDP network based on load, speed and region.
     In production, this queries AIDP's node registry for real-time availability.
+    The node counts the job as in flight until release_gpu_node() is called.
     """
-    return random.choice(AIDP_NODES)
+    return NODE_SCHEDULER.select(steps, region)
+
+
+def release_gpu_node(node_id: Optional[str], steps: int = 30, execution_time: Optional[float] = None):
+    """Report that a job routed to node_id has finished."""
+    NODE_SCHEDULER.release(node_id, steps, execution_time)
 
 
 def generate_proof_signature(job_id: str, node_wallet: str, execution_time: float) -> str:
@@ -89,57 +140,170 @@ def generate_execution_hash(job_data: Dict, output_url: str) -> str:
     return f"0x{hashlib.sha256(execution_record.encode()).hexdigest()}"
 
 
+def generate_request_hash(job_data: Dict, model_id: str) -> str:
+    """
+    Canonical hash of everything that determines a job's output. Two jobs
+    with the same request hash render the same image (given a fixed seed).
+    """
+    request_record = json.dumps({
+        "type": getattr(job_data.get("type"), "value", job_data.get("type")),
+        "prompt": job_data.get("prompt"),
+        "negative_prompt": job_data.get("negative_prompt"),
+        "steps": job_data.get("steps"),
+        "seed": job_data.get("seed"),
+        "model_id": model_id,
+        "sampler": getattr(job_data.get("sampler"), "value", job_data.get("sampler")),
+        # Same image, different file: a cached PNG cannot answer a WebP request
+        "output_format": job_data.get("output_format") or "png",
+        "output_quality": job_data.get("output_quality"),
+        "png_compression": job_data.get("png_compression"),
+    }, sort_keys=True)
+    return hashlib.sha256(request_record.encode()).hexdigest()
+
+
 def generate_tx_hash() -> str:
     """Generate Solana-style transaction hash"""
     return f"{uuid.uuid4().hex}{uuid.uuid4().hex[:32]}"
 
 
-def _try_real_aidp_api(job: Dict) -> Tuple[bool, Dict]:
+def init_aidp_client(transport=None):
     """
-    Attempt to submit job to real AIDP API.
-    Returns (success: bool, response: dict)
+    Create the shared marketplace client.
+
+    Keep-alive connections are pooled across jobs (bounded by
+    AIDP_HTTP_MAX_CONNECTIONS) and HTTP/2 is used when the h2 package is
+    installed. `transport` lets tests point the client at a stand-in
+    marketplace app.
     """
+    global _http_client
+
+    if not HTTPX_AVAILABLE:
+        return None
+
+    _http_client = httpx.AsyncClient(
+        base_url=AIDP_CONFIG["api_endpoint"],
+        timeout=AIDP_CONFIG["http_timeout"],
+        limits=httpx.Limits(
+            max_connections=AIDP_CONFIG["http_max_connections"],
+            max_keepalive_connections=AIDP_CONFIG["http_max_keepalive"],
+        ),
+        http2=AIDP_CONFIG["http2"] and HTTP2_AVAILABLE and transport is None,
+        transport=transport,
+    )
+    return _http_client
+
+
+def get_aidp_client():
+    """Shared marketplace client, created on first use if the app did not start it."""
+    if _http_client is None:
+        init_aidp_client()
+    return _http_client
+
+
+async def close_aidp_client():
+    global _http_client
+
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def live_api_enabled() -> bool:
+    """Whether submissions should try the real AIDP marketplace."""
     if not HTTPX_AVAILABLE:
         logger.debug("httpx not available, using simulation")
-        return False, {}
-    
+        return False
+
     if not AIDP_CONFIG["api_key"]:
         logger.debug("No AIDP API key configured, using simulation")
-        return False, {}
-    
+        return False
+
     if not AIDP_CONFIG["use_real_api"]:
         logger.debug("Real API disabled, using simulation")
+        return False
+
+    return True
+
+
+async def _try_real_aidp_api(job: Dict) -> Tuple[bool, Dict]:
+    """
+    Attempt to submit job to real AIDP API.
+    Returns (success: bool, response: dict)
+    """
+    if not live_api_enabled():
+        return False, {}
+
+    # Marketplace known to be down: fail fast instead of waiting for a timeout
+    if not AIDP_API_BREAKER.allow_request():
+        logger.debug("AIDP API circuit open, using simulation")
         return False, {}
     
+    start = time.perf_counter()
+    settled = False
     try:
-        with httpx.Client(timeout=10.0) as client:
-            response = client.post(
-                f"{AIDP_CONFIG['api_endpoint']}/compute/submit",
-                headers={
-                    "Authorization": f"Bearer {AIDP_CONFIG['api_key']}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "type": job.get("type", "TEXT_TO_IMAGE"),
-                    "prompt": job.get("prompt", ""),
-                    "steps": job.get("steps", 30),
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                logger.info(f"AIDP API submission successful: {data.get('job_id')}")
-                return True, data
+        response = await get_aidp_client().post(
+            "/compute/submit",
+            headers={
+                "Authorization": f"Bearer {AIDP_CONFIG['api_key']}",
+                "Content-Type": "application/json",
+            },
+            json={
+                "type": job.get("type", "TEXT_TO_IMAGE"),
+                "prompt": job.get("prompt", ""),
+                "steps": job.get("steps", 30),
+                "sampler": job.get("sampler", "default"),
+            }
+        )
+        AIDP_API_SECONDS.labels("ok" if response.status_code == 200 else "rejected").observe(
+            time.perf_counter() - start
+        )
+        settled = True
+        
+        if response.status_code == 200:
+            AIDP_API_BREAKER.record_success()
+            data = response.json()
+            logger.info(f"AIDP API submission successful: {data.get('job_id')}")
+            return True, data
+        else:
+            # Server errors and throttling count against the marketplace;
+            # other rejections mean it is up and answering
+            if response.status_code >= 500 or response.status_code == 429:
+                AIDP_API_BREAKER.record_failure()
             else:
-                logger.warning(f"AIDP API returned {response.status_code}: {response.text}")
-                return False, {}
+                AIDP_API_BREAKER.record_success()
+            logger.warning(f"AIDP API returned {response.status_code}: {response.text}")
+            return False, {}
                 
     except Exception as e:
+        settled = True
+        AIDP_API_SECONDS.labels("error").observe(time.perf_counter() - start)
+        AIDP_API_BREAKER.record_failure()
         logger.warning(f"AIDP API call failed: {e}, falling back to simulation")
         return False, {}
+    finally:
+        # Cancelled mid-call (client gone, deadline): no outcome, but a
+        # half-open probe slot must not stay taken
+        if not settled:
+            AIDP_API_BREAKER.release()
+
+
+def _simulated_routing(job: Dict) -> Dict:
+    """Route a job locally when the marketplace is not used."""
+    aidp_job_id = generate_aidp_job_id()
+    selected_node = select_gpu_node(job.get("steps", 30), job.get("region"))
+    
+    return {
+        "aidp_job_id": aidp_job_id,
+        "assigned_node": selected_node,
+        "status": "routed",
+        "routed_at": datetime.utcnow().isoformat(),
+        "network": AIDP_CONFIG["network"],
+        "cost_aidp": get_aidp_cost(job.get("steps", 30)),
+        "api_mode": "simulation",
+    }
 
 
-def submit_to_aidp_network(job: Dict) -> Dict:
+async def submit_to_aidp_network(job: Dict) -> Dict:
     """
     Submit a job to the AIDP decentralized GPU network.
     
@@ -151,33 +315,33 @@ def submit_to_aidp_network(job: Dict) -> Dict:
     5. Return routing confirmation
     """
     # Try real AIDP API first
-    success, api_response = _try_real_aidp_api(job)
+    success, api_response = await _try_real_aidp_api(job)
     
     if success and api_response:
         # Use real API response
         return {
             "aidp_job_id": api_response.get("job_id", generate_aidp_job_id()),
-            "assigned_node": api_response.get("node", select_gpu_node()),
+            "assigned_node": api_response.get("node") or select_gpu_node(job.get("steps", 30), job.get("region")),
             "status": "routed",
             "routed_at": datetime.utcnow().isoformat(),
             "network": AIDP_CONFIG["network"],
-            "cost_aidp": api_response.get("cost", round(random.uniform(0.10, 0.20), 2)),
+            "cost_aidp": api_response.get("cost", get_aidp_cost(job.get("steps", 30))),
             "api_mode": "live",
         }
     
     # Fall back to simulation
-    aidp_job_id = generate_aidp_job_id()
-    selected_node = select_gpu_node()
-    
-    return {
-        "aidp_job_id": aidp_job_id,
-        "assigned_node": selected_node,
-        "status": "routed",
-        "routed_at": datetime.utcnow().isoformat(),
-        "network": AIDP_CONFIG["network"],
-        "cost_aidp": round(random.uniform(0.10, 0.20), 2),
-        "api_mode": "simulation",
-    }
+    return _simulated_routing(job)
+
+
+async def submit_jobs_to_aidp_network(jobs: list) -> list:
+    """
+    Route many jobs. Marketplace calls run concurrently over the pooled
+    client; without the live API the jobs are routed inline.
+    """
+    if not live_api_enabled():
+        return [_simulated_routing(job) for job in jobs]
+
+    return await asyncio.gather(*(submit_to_aidp_network(job) for job in jobs))
 
 
 def create_execution_proof(job_id: str, aidp_data: Dict, output_url: str, execution_time: float) -> Dict:
@@ -238,7 +402,11 @@ def create_execution_proof(job_id: str, aidp_data: Dict, output_url: str, execut
 
 
 def get_aidp_cost(steps: int) -> float:
-    """Calculate AIDP token cost based on inference steps"""
+    """
+    Calculate AIDP token cost based on inference steps.
+    Routing quotes the requested steps; the final charge uses the steps the
+    worker reports as actually run.
+    """
     base_cost = 0.10
     step_cost = steps * 0.002
     return round(base_cost + step_cost, 2)
@@ -299,10 +467,10 @@ class AIDPJobContext:
         self.start_time = None
         self.end_time = None
     
-    def route_to_aidp(self) -> Dict:
+    async def route_to_aidp(self) -> Dict:
         """Route job to AIDP network"""
         self.start_time = datetime.utcnow()
-        self.aidp_data = submit_to_aidp_network(self.job)
+        self.aidp_data = await submit_to_aidp_network(self.job)
         return self.aidp_data
     
     def complete_execution(self, output_url: str) -> Dict:
@@ -0,0 +1,162 @@
+"""
+Storage for finished outputs.
+
+Workers upload encoded images to the router (PUT /jobs/{id}/output), which
+puts them in a blob store, and clients download them from
+GET /jobs/{id}/output. LocalBlobStore keeps blobs in OUTPUT_DIR; with
+ENABLE_S3_STORAGE they go to an S3 (or S3-compatible) bucket instead.
+Reads are ranged and chunked so large files are never held in memory.
+"""
+
+import logging
+import mimetypes
+import os
+import tempfile
+from typing import Iterator, Optional
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+    BOTO3_AVAILABLE = True
+except ImportError:
+    BOTO3_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(path: str) -> str:
+    """Validator for a local file from its size and mtime (like nginx)."""
+    stat = os.stat(path)
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def content_type_for(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+
+class BlobStore:
+    """Interface of the output stores. Keys are relative names like <job_id>.png."""
+
+    def new_upload_path(self) -> str:
+        """Temporary file to receive an upload before put_file()."""
+        fd, path = tempfile.mkstemp(prefix="upload-")
+        os.close(fd)
+        return path
+
+    def put_file(self, key: str, path: str, content_type: str) -> dict:
+        """Move the file at path into the store. Returns stat(key)."""
+        raise NotImplementedError
+
+    def stat(self, key: str) -> Optional[dict]:
+        """{"size", "etag", "content_type"} of a blob, or None if it is missing."""
+        raise NotImplementedError
+
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Bytes start..end (inclusive) of a blob, in chunks."""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path of a blob, when the store keeps it on this machine."""
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files in one directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.incoming = os.path.join(directory, ".incoming")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, os.path.basename(key))
+
+    def new_upload_path(self) -> str:
+        # Same filesystem as the blobs, so put_file() is a rename
+        os.makedirs(self.incoming, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix="upload-", dir=self.incoming)
+        os.close(fd)
+        return path
+
+    def put_file(self, key: str, path: str, content_type: str) -> dict:
+        os.replace(path, self._path(key))
+        return self.stat(key)
+
+    def stat(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        return {"size": os.path.getsize(path), "etag": file_etag(path), "content_type": content_type_for(key)}
+
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        return read_file(self._path(key), start, end)
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self._path(key)
+
+
+def read_file(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """Chunks of bytes start..end (inclusive) of a local file."""
+    remaining = (end if end is not None else os.path.getsize(path) - 1) - start + 1
+    with open(path, "rb") as f:
+        f.seek(start)
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class S3BlobStore(BlobStore):
+    """Blobs as objects under a prefix of an S3 bucket."""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = ""):
+        if not BOTO3_AVAILABLE:
+            raise RuntimeError("boto3 is required for ENABLE_S3_STORAGE")
+        if not bucket:
+            raise ValueError("S3_BUCKET must be set when ENABLE_S3_STORAGE is on")
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{os.path.basename(key)}"
+
+    def put_file(self, key: str, path: str, content_type: str) -> dict:
+        try:
+            # upload_file switches to multipart for large files
+            self.client.upload_file(path, self.bucket, self._key(key), ExtraArgs={"ContentType": content_type})
+        finally:
+            os.remove(path)
+        return self.stat(key)
+
+    def stat(self, key: str) -> Optional[dict]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return {"size": head["ContentLength"], "etag": head["ETag"], "content_type": head.get("ContentType")}
+
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        byte_range = f"bytes={start}-{end if end is not None else ''}"
+        response = self.client.get_object(Bucket=self.bucket, Key=self._key(key), Range=byte_range)
+        return response["Body"].iter_chunks(CHUNK_SIZE)
+
+
+def create_blob_store(
+    enable_s3: bool,
+    output_dir: str,
+    s3_bucket: str = "",
+    s3_prefix: str = "",
+    s3_endpoint_url: str = "",
+) -> BlobStore:
+    """Build the output store selected by ENABLE_S3_STORAGE."""
+    if enable_s3:
+        logger.info(f"Storing outputs in s3://{s3_bucket}/{s3_prefix}")
+        return S3BlobStore(s3_bucket, s3_prefix, s3_endpoint_url)
+    return LocalBlobStore(output_dir)
@@ -0,0 +1,142 @@
+"""
+Circuit breaker for calls to external services (the AIDP marketplace).
+
+CLOSED     calls go through; the outcome of the last `window_size` calls is
+           tracked. Once at least `min_calls` are recorded and the failure
+           rate reaches `failure_rate_threshold`, the breaker opens.
+OPEN       calls are rejected immediately so callers fall back without
+           paying a timeout. After `open_seconds` the breaker half-opens.
+HALF_OPEN  up to `half_open_probes` probe calls are let through at a time.
+           A successful probe closes the breaker, a failed one reopens it.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker with half-open probing."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        window_size: int = 20,
+        min_calls: int = 5,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._outcomes: Deque[bool] = deque(maxlen=window_size)  # True = failure
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self.counters = {
+            "rejected": 0,
+            "opened": 0,
+            "successes": 0,
+            "failures": 0,
+        }
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._probes_in_flight = 0
+        self.counters["opened"] += 1
+
+    def allow_request(self) -> bool:
+        """
+        Whether a call may be attempted now. Callers must record its outcome,
+        or release() it if it ends without one.
+        """
+        with self._lock:
+            self._maybe_half_open()
+
+            if self._state == CLOSED:
+                return True
+
+            if self._state == HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+
+            self.counters["rejected"] += 1
+            return False
+
+    def release(self):
+        """End a call allowed by allow_request() that has no outcome, e.g. one that was cancelled."""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes_in_flight:
+                self._probes_in_flight -= 1
+
+    def record_success(self):
+        with self._lock:
+            self.counters["successes"] += 1
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+                self._outcomes.clear()
+                self._probes_in_flight = 0
+            elif self._state == CLOSED:
+                self._outcomes.append(False)
+
+    def record_failure(self):
+        with self._lock:
+            self.counters["failures"] += 1
+            if self._state == HALF_OPEN:
+                self._open()
+            elif self._state == CLOSED:
+                self._outcomes.append(True)
+                if len(self._outcomes) >= self.min_calls and self._failure_rate() >= self.failure_rate_threshold:
+                    self._open()
+
+    def _failure_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(self._outcomes) / len(self._outcomes)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._maybe_half_open()
+            retry_in = None
+            if self._state == OPEN:
+                retry_in = round(max(self.open_seconds - (self._clock() - self._opened_at), 0.0), 1)
+            return {
+                "name": self.name,
+                "state": self._state,
+                "failure_rate": round(self._failure_rate(), 3),
+                "window_calls": len(self._outcomes),
+                "retry_in_seconds": retry_in,
+                **self.counters,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._state = CLOSED
+            self._outcomes.clear()
+            self._probes_in_flight = 0
+            for key in self.counters:
+                self.counters[key] = 0
@@ -0,0 +1,82 @@
+"""
+Append-only archive for jobs evicted from the in-memory job store.
+
+Each evicted job is written as one compact JSON line. Only an offset index
+(job_id -> (offset, length)) stays in memory, so an archived job costs a few
+dozen bytes of RSS instead of the full record, and GET /jobs/{id} can still
+serve it with a single seek + read.
+"""
+
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class JobArchive:
+    """Append-only JSONL file of evicted job records."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._file = None
+        self.bytes_written = 0
+
+        if os.path.exists(path):
+            self._load_index()
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a+b")
+        return self._file
+
+    def _load_index(self):
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                # Lines start with {"id":"<job_id>" because ids serialize first
+                end = line.find(b'"', 7)
+                if line.startswith(b'{"id":"') and end > 0:
+                    self._index[line[7:end].decode()] = (offset, len(line))
+                offset += len(line)
+        self.bytes_written = offset
+        logger.info(f"Loaded job archive index: {len(self._index)} jobs")
+
+    def append(self, job_id: str, record: str):
+        data = (record + "\n").encode("utf-8")
+        with self._lock:
+            f = self._open()
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            self._index[job_id] = (offset, len(data))
+            self.bytes_written = offset + len(data)
+
+    def load(self, job_id: str) -> Optional[str]:
+        with self._lock:
+            location = self._index.get(job_id)
+            if location is None:
+                return None
+            f = self._open()
+            f.seek(location[0])
+            return f.read(location[1]).decode("utf-8")
+
+    def __contains__(self, job_id: str) -> bool:
+        return job_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def clear(self):
+        with self._lock:
+            self._index.clear()
+            if self._file is not None:
+                self._file.truncate(0)
+            elif os.path.exists(self.path):
+                open(self.path, "wb").close()
+            self.bytes_written = 0
@@ -0,0 +1,86 @@
+"""
+In-process pub/sub for job state changes.
+
+job_manager publishes a compact event every time a job is saved, and a
+"progress" event for each denoising step a worker reports; the SSE and
+WebSocket endpoints subscribe per job and forward events to clients as they
+happen. Publishers may run on any thread (sync routes execute in the
+threadpool), so events are handed to each subscriber's event loop with
+call_soon_threadsafe. Publishing to a job nobody watches costs one dict
+lookup.
+"""
+
+import asyncio
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+from api.models.job import JobStatus
+
+
+def job_event(job: dict, live: Optional[dict] = None, event: str = "status") -> dict:
+    """
+    Compact snapshot sent to stream subscribers. live carries the job's
+    in-memory progress and preview_url; event is "status" for state changes
+    and "progress" for step updates.
+    """
+    return {
+        "event": event,
+        "job_id": job["id"],
+        "status": JobStatus(job["status"]).value,
+        "output_url": job.get("output_url"),
+        "compute_cost": job.get("compute_cost"),
+        "error": job.get("error"),
+        **(live or {}),
+    }
+
+
+class JobEventBus:
+    """Fan-out of job events to asyncio.Queue subscribers."""
+
+    def __init__(self, max_queue_size: int = 100):
+        self.max_queue_size = max_queue_size
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        """Register a queue for job_id. Must be called from inside an event loop."""
+        queue: asyncio.Queue = asyncio.Queue(self.max_queue_size)
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id)
+            if not subscribers:
+                return
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def has_subscribers(self, job_id: str) -> bool:
+        return job_id in self._subscribers
+
+    def publish(self, job_id: str, event: dict):
+        with self._lock:
+            subscribers = list(self._subscribers.get(job_id, ()))
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                pass  # subscriber's loop already closed
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+
+def _offer(queue: asyncio.Queue, event: dict):
+    # A stalled client only ever needs the latest state
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+JOB_EVENTS = JobEventBus()
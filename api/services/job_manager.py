@@ -1,24 +1,167 @@
+import heapq
+import mimetypes
+import os
+import shutil
+import threading
+import time
 import uuid
-from datetime import datetime
-from typing import Dict, Optional
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
 
-from api.models.job import JobStatus, JobCreateRequest
+from api.core.config import get_settings
+from api.core.metrics import JOB_STATE_SECONDS, JOBS_FINISHED, REGISTRY, WORKER_PHASE_SECONDS
+from api.services.admission import ADMISSION, parse_tenant_weights
+from api.models.job import JobStatus, JobCreateRequest, Priority, PRIORITY_RANK
+from api.services.aidp_integration import (
+    NODE_SCHEDULER,
+    generate_request_hash,
+    get_aidp_cost,
+    release_gpu_node,
+)
+from api.services.blob_store import BlobStore, LocalBlobStore, content_type_for, create_blob_store
+from api.services.job_events import JOB_EVENTS, job_event
+from api.services.job_queue import JobQueue
+from api.services.job_store import JobStore, TERMINAL_STATUSES, create_job_store
+from api.services.result_cache import ResultCache
 
 
-# Temporary in-memory store (acceptable for hackathon)
-JOBS: Dict[str, dict] = {}
+_settings = get_settings()
 
+# Backing dict of the in-memory job store (JOB_STORE_BACKEND=memory), in LRU order
+JOBS: Dict[str, dict] = OrderedDict()
 
-def create_job(payload: JobCreateRequest) -> dict:
+JOB_STORE: JobStore = create_job_store(
+    _settings.job_store_backend,
+    database_url=_settings.database_url,
+    write_batch_size=_settings.job_store_write_batch_size,
+    flush_interval=_settings.job_store_flush_interval_ms / 1000,
+    jobs=JOBS,
+    max_live_jobs=_settings.max_live_jobs,
+    terminal_ttl=_settings.terminal_job_ttl_seconds,
+    archive_path=_settings.job_archive_path,
+)
+
+# Jobs waiting for resident workers to lease them (dispatch_mode="queue")
+JOB_QUEUE = JobQueue(
+    visibility_timeout=_settings.queue_visibility_timeout_seconds,
+    max_attempts=_settings.queue_max_attempts,
+    journal_path=_settings.queue_journal_path,
+    affinity_max_wait=_settings.queue_affinity_max_wait_seconds,
+    tenant_weights=parse_tenant_weights(_settings.tenant_weights),
+)
+
+# Finished images by request hash, so repeated requests skip the GPU
+RESULT_CACHE = ResultCache(
+    _settings.result_cache_dir,
+    max_bytes=_settings.result_cache_max_mb * 1024 * 1024,
+)
+
+# Images uploaded by workers (PUT /jobs/{id}/output)
+BLOB_STORE: BlobStore = create_blob_store(
+    _settings.enable_s3_storage,
+    _settings.output_dir,
+    s3_bucket=_settings.s3_bucket,
+    s3_prefix=_settings.s3_prefix,
+    s3_endpoint_url=_settings.s3_endpoint_url,
+)
+# Local files a job's output_url may point at (shared-disk workers, cache hits)
+OUTPUT_ROOTS = tuple(os.path.realpath(d) for d in (_settings.output_dir, _settings.result_cache_dir))
+
+# Single-flight: cache_key -> {"leader_id", "followers", "priority"} for jobs
+# still in flight. Duplicates submitted meanwhile follow the leader instead of
+# running; the leader is queued at the most urgent class among them.
+IN_FLIGHT_JOBS: Dict[str, dict] = {}
+_in_flight_lock = threading.Lock()
+COALESCE_COUNTERS = {"leaders": 0, "followers": 0}
+
+# Starts GPU runs for followers that took over from a leader ended early;
+# registered by api.services.aidp_client, which routes and dispatches jobs
+_dispatch: Optional[Callable[[List[dict]], None]] = None
+
+# Leader state mirrored onto its followers
+FOLLOWER_FIELDS = (
+    "status", "aidp_data", "started_at", "completed_at", "output_url", "output_key", "error", "proof_of_execution",
+)
+
+# Submit-to-completion seconds of recent GPU-completed jobs, per priority class
+LATENCIES: Dict[str, deque] = {priority.value: deque(maxlen=1000) for priority in Priority}
+
+# (deadline timestamp, job_id) of every job, earliest first; entries of jobs
+# that finished in time are skipped when they come due
+DEADLINES: List[tuple] = []
+_deadline_lock = threading.Lock()
+
+# Jobs ended early: cancelled by clients, failed at their deadline, and how
+# many of those were dropped from the queue before a worker started them
+TERMINATIONS = {"cancelled": 0, "timed_out": 0, "dequeued": 0}
+
+# Latest counters reported by each resident worker with its lease requests
+WORKER_STATS: Dict[str, dict] = {}
+
+# (lease time, seconds queued) of recent jobs; stats only count the last
+# queue_wait_window_seconds, so an old burst does not keep the p95 up
+QUEUE_WAITS: deque = deque(maxlen=1000)
+
+
+# Step progress of running jobs (POST /jobs/progress), kept in memory and
+# written to the job once it finishes
+JOB_PROGRESS: Dict[str, dict] = {}
+
+# Latest latent preview of running jobs: job_id -> {"data", "content_type", "step"}
+PREVIEWS: Dict[str, dict] = {}
+
+# Mean milliseconds per denoising step of recent completed jobs, per model
+STEP_TIMES: Dict[str, deque] = {}
+
+
+# Worker-reported execution details kept on the job
+EXECUTION_FIELDS = (
+    "execution_time", "batch_size", "batch_wait_ms", "steps_run", "model_load_ms",
+    "output_bytes", "encode_ms", "preemptions", "preempted_ms", "avg_step_ms",
+)
+
+# Time-in-state histograms, observed on every transition (see api/core/metrics.py)
+_PENDING_SECONDS = JOB_STATE_SECONDS.labels("pending")
+_RUNNING_SECONDS = JOB_STATE_SECONDS.labels("running")
+
+
+def available_models() -> List[str]:
+    """Checkpoints jobs may request; the first is the default."""
+    extra = [model.strip() for model in _settings.available_models.split(",") if model.strip()]
+    return list(dict.fromkeys([_settings.model_id] + extra))
+
+
+def compute_batch_key(job: dict) -> str:
+    """Jobs with equal keys can share one batched diffusion call."""
+    return f"{job['type'].value}:{job['model']}:{job['sampler']}:{job['steps']}"
+
+
+def _new_job(payload: JobCreateRequest, tenant: Optional[str] = None) -> dict:
     job_id = f"acr_{uuid.uuid4().hex[:10]}"
+    created_at = datetime.utcnow()
+    timeout = payload.timeout_seconds or _settings.job_timeout_seconds
 
     job = {
         "id": job_id,
         "type": payload.type,
         "prompt": payload.prompt,
+        "negative_prompt": payload.negative_prompt,
         "steps": payload.steps,
+        "sampler": payload.sampler.value,
+        "model": payload.model or _settings.model_id,
+        "seed": payload.seed,
+        "region": payload.region,
+        "priority": payload.priority.value,
+        "tenant": tenant,
+        "output_format": payload.output_format.value,
+        "output_quality": payload.output_quality,
+        "png_compression": payload.png_compression,
+        "previews": payload.previews,
         "status": JobStatus.PENDING,
-        "created_at": datetime.utcnow(),
+        "created_at": created_at,
+        "timeout_seconds": timeout,
+        "deadline": created_at + timedelta(seconds=timeout),
         "output_url": None,
         "compute_cost": None,
         "error": None,
@@ -27,22 +170,772 @@ def create_job(payload: JobCreateRequest) -> dict:
         "proof_of_execution": None,
     }
 
-    JOBS[job_id] = job
+    job["batch_key"] = compute_batch_key(job)
+    job["cache_key"] = generate_request_hash(job, job["model"])
+    return job
+
+
+def deadline_timestamp(job: dict) -> float:
+    """A job's deadline as a Unix timestamp (workers check it between steps)."""
+    return job["deadline"].replace(tzinfo=timezone.utc).timestamp()
+
+
+def _track_deadlines(jobs: List[dict]):
+    with _deadline_lock:
+        for job in jobs:
+            heapq.heappush(DEADLINES, (deadline_timestamp(job), job["id"]))
+
+
+def create_job(payload: JobCreateRequest, tenant: Optional[str] = None) -> dict:
+    job = _new_job(payload, tenant)
+    JOB_STORE.add(job)
+    _track_deadlines([job])
     return job
 
 
+def create_jobs(payloads: List[JobCreateRequest], tenant: Optional[str] = None) -> List[dict]:
+    """Create many jobs with a single store write."""
+    jobs = [_new_job(payload, tenant) for payload in payloads]
+    JOB_STORE.add_many(jobs)
+    _track_deadlines(jobs)
+    return jobs
+
+
 def get_job(job_id: str) -> Optional[dict]:
-    return JOBS.get(job_id)
+    return JOB_STORE.get(job_id)
+
+
+def get_jobs(job_ids: List[str]) -> Dict[str, dict]:
+    """Look up many jobs at once. Unknown ids are left out."""
+    return JOB_STORE.get_many(job_ids)
+
+
+def save_job(job: dict):
+    """
+    Persist changes made to a job dict obtained from create_job/get_job,
+    and push the new state to anyone streaming this job.
+    """
+    JOB_STORE.save(job)
+
+    if JOB_EVENTS.has_subscribers(job["id"]):
+        JOB_EVENTS.publish(job["id"], job_event(job, live_progress(job)))
+
+
+def save_jobs(jobs: List[dict]):
+    """save_job for many jobs, with a single store write."""
+    JOB_STORE.save_many(jobs)
+
+    for job in jobs:
+        if JOB_EVENTS.has_subscribers(job["id"]):
+            JOB_EVENTS.publish(job["id"], job_event(job, live_progress(job)))
+
+
+def live_progress(job: dict) -> dict:
+    """progress and preview_url of a job; coalesced followers show their leader's."""
+    job_id = job["id"]
+    if job_id not in JOB_PROGRESS and job.get("coalesced_with") in JOB_PROGRESS:
+        job_id = job["coalesced_with"]
+    return {
+        "progress": JOB_PROGRESS.get(job_id) or job.get("progress"),
+        "preview_url": f"/jobs/{job_id}/preview" if job_id in PREVIEWS else None,
+    }
+
+
+def _publish_progress(job: dict):
+    if JOB_EVENTS.has_subscribers(job["id"]):
+        JOB_EVENTS.publish(job["id"], job_event(job, live_progress(job), event="progress"))
+
+
+def record_progress(updates: List[dict]) -> List[dict]:
+    """
+    Record the denoising step each job is at, as reported by its worker.
+    The first report marks a job RUNNING if nothing else has (one-shot
+    workers never lease). Returns one result per update; "finished" tells
+    the worker the job no longer needs its steps.
+    """
+    found = get_jobs([update["job_id"] for update in updates if update.get("job_id")])
+
+    results, started = [], []
+    for update in updates:
+        job = found.get(update.get("job_id"))
+        if not job:
+            results.append({"job_id": update.get("job_id"), "status": "not_found"})
+            continue
+        if job["status"] in TERMINAL_STATUSES:
+            results.append({"job_id": job["id"], "status": "finished"})
+            continue
+
+        total = update.get("total_steps") or job["steps"]
+        step = min(int(update.get("step", 0)), total)
+        JOB_PROGRESS[job["id"]] = {
+            "step": step,
+            "total_steps": total,
+            "fraction": round(step / total, 3) if total else 0.0,
+            "step_ms": update.get("step_ms"),
+            "avg_step_ms": update.get("avg_step_ms"),
+            "preview_step": (JOB_PROGRESS.get(job["id"]) or {}).get("preview_step"),
+        }
+
+        if job["status"] != JobStatus.RUNNING:
+            job["status"] = JobStatus.RUNNING
+            job["started_at"] = datetime.utcnow()
+            _observe_started(job)
+            started.append(job)
+        else:
+            _publish_progress(job)
+        results.append({"job_id": job["id"], "status": "acknowledged"})
+
+    if started:
+        save_jobs(started)
+        for job in started:
+            sync_followers(job)
+
+    return results
+
+
+def store_preview(job: dict, data: bytes, content_type: str, step: Optional[int] = None):
+    """Keep a running job's latest preview image in memory until it finishes."""
+    PREVIEWS[job["id"]] = {"data": data, "content_type": content_type, "step": step}
+    if job["id"] in JOB_PROGRESS:
+        JOB_PROGRESS[job["id"]]["preview_step"] = step
+    _publish_progress(job)
+
+
+def _finish_progress(job: dict):
+    """Move a finished job's last progress onto the job and drop its preview."""
+    PREVIEWS.pop(job["id"], None)
+    progress = JOB_PROGRESS.pop(job["id"], None)
+    if progress is None:
+        return
+    if job["status"] == JobStatus.COMPLETED:
+        progress = {**progress, "step": progress["total_steps"], "fraction": 1.0}
+    job["progress"] = {**progress, "preview_step": None}
+
+
+def _observe_started(job: dict):
+    _PENDING_SECONDS.observe((job["started_at"] - job["created_at"]).total_seconds())
+
+
+def _observe_finished(job: dict, data: Optional[dict] = None):
+    """
+    Count a job that just reached a terminal status and time the state it
+    left. For completed GPU runs, also time the phases the worker reported.
+    """
+    status = JobStatus(job["status"])
+    JOBS_FINISHED.labels(status.value).inc()
+    if job.get("started_at"):
+        _RUNNING_SECONDS.observe((job["completed_at"] - job["started_at"]).total_seconds())
+    else:
+        # Cancelled or timed out before a worker picked it up
+        _PENDING_SECONDS.observe((job["completed_at"] - job["created_at"]).total_seconds())
+
+    if status != JobStatus.COMPLETED or not data:
+        return
+    load_seconds = (data.get("model_load_ms") or 0.0) / 1000
+    if "model_load_ms" in data:
+        WORKER_PHASE_SECONDS.labels("model_load").observe(load_seconds)
+    if data.get("execution_time") is not None:
+        WORKER_PHASE_SECONDS.labels("inference").observe(max(data["execution_time"] - load_seconds, 0.0))
+    if data.get("encode_ms") is not None:
+        WORKER_PHASE_SECONDS.labels("encode").observe(data["encode_ms"] / 1000)
+    if data.get("reported_at"):
+        # From the result leaving the worker to it landing here, outbox retries included
+        WORKER_PHASE_SECONDS.labels("callback").observe(max(time.time() - data["reported_at"], 0.0))
+
+
+def _collect_metrics():
+    """Gauges and counters kept elsewhere, read at scrape time for GET /metrics."""
+    queue = JOB_QUEUE.stats()
+    rank_names = {rank: priority.value for priority, rank in PRIORITY_RANK.items()}
+    yield "acr_queue_ready_jobs", "gauge", "Jobs waiting for a worker, per priority class", [
+        ({"priority": rank_names.get(rank, rank)}, count) for rank, count in sorted(queue["ready_by_priority"].items())
+    ]
+    yield "acr_queue_leased_jobs", "gauge", "Jobs leased to workers and not yet finished", [({}, queue["leased"])]
+    yield "acr_jobs_in_flight", "gauge", "Coalescing leaders still running", [({}, len(IN_FLIGHT_JOBS))]
+
+    yield "acr_result_cache_lookups_total", "counter", "Result cache lookups", [
+        ({"result": "hit"}, RESULT_CACHE.counters["hits"]),
+        ({"result": "miss"}, RESULT_CACHE.counters["misses"]),
+    ]
+    yield "acr_coalesced_jobs_total", "counter", "Duplicate submissions sharing one GPU run", [
+        ({"role": role}, count) for role, count in COALESCE_COUNTERS.items()
+    ]
+    yield "acr_job_terminations_total", "counter", "Jobs ended early", [
+        ({"reason": reason}, count) for reason, count in TERMINATIONS.items()
+    ]
+    yield "acr_admission_total", "counter", "Admission decisions (admitted counts jobs, refusals count requests)", [
+        ({"decision": decision}, count) for decision, count in ADMISSION.counters.items()
+    ]
+
+    workers = list(WORKER_STATS.items())
+    yield "acr_worker_utilization", "gauge", "Share of uptime each worker spent rendering", [
+        ({"worker": worker_id}, stats.get("utilization")) for worker_id, stats in workers
+    ]
+    yield "acr_worker_prompt_cache_lookups_total", "counter", "Prompt embedding cache lookups on each worker", [
+        ({"worker": worker_id, "result": result}, (stats.get("prompt_cache") or {}).get(key))
+        for worker_id, stats in workers
+        for result, key in (("hit", "hits"), ("miss", "misses"))
+    ]
+    yield "acr_worker_model_requests_total", "counter", "Model lookups on each worker: resident, restored from CPU RAM, loaded", [
+        ({"worker": worker_id, "result": result}, (stats.get("models") or {}).get(key))
+        for worker_id, stats in workers
+        for result, key in (("resident", "hits"), ("restored", "restores"), ("loaded", "loads"))
+    ]
+
+
+REGISTRY.collector(_collect_metrics)
+
+
+def _release_node(job: dict, execution_time: Optional[float] = None):
+    """Free the job's slot on its AIDP node once it reaches a terminal state."""
+    node = (job.get("aidp_data") or {}).get("assigned_node") or {}
+    release_gpu_node(node.get("node_id"), job["steps"], execution_time)
+
+
+def complete_from_cache(jobs: List[dict]) -> List[dict]:
+    """
+    Complete jobs whose result is already in the result cache. Each hit gets
+    its own copy of the image in the blob store, so it stays downloadable
+    from /jobs/{id}/output after the cache evicts it. Jobs without a seed
+    always render afresh. Returns the jobs that still need a GPU run.
+    """
+    if not _settings.result_cache_enabled:
+        return jobs
+
+    remaining, hits = [], []
+    for job in jobs:
+        if not _reproducible(job):
+            remaining.append(job)
+            continue
+        cached_path = RESULT_CACHE.lookup(job["cache_key"])
+        key = _store_cached_output(job, cached_path) if cached_path else None
+        if key is None:
+            remaining.append(job)
+            continue
+
+        job["status"] = JobStatus.COMPLETED
+        job["completed_at"] = datetime.utcnow()
+        job["output_key"] = key
+        job["output_url"] = f"/jobs/{job['id']}/output"
+        job["compute_cost"] = 0.0
+        job["execution"] = {"execution_time": 0.0, "cache_hit": True}
+        JOBS_FINISHED.labels(JobStatus.COMPLETED.value).inc()
+        hits.append(job)
+
+    if hits:
+        save_jobs(hits)
+    return remaining
+
+
+def _reproducible(job: dict) -> bool:
+    """Only a fixed seed makes identical requests render the same image."""
+    return job.get("seed") is not None
+
+
+def _store_cached_output(job: dict, cached_path: str) -> Optional[str]:
+    """Copy a cached image into the blob store as the job's output. Returns its key."""
+    key = f"{job['id']}{os.path.splitext(cached_path)[1]}"
+    path = BLOB_STORE.new_upload_path()
+    try:
+        # A copy rather than a hard link: cache lookups touch the cached
+        # file's mtime, which would change the ETag of every linked output
+        shutil.copyfile(cached_path, path)
+        BLOB_STORE.put_file(key, path, content_type_for(key))
+    except OSError:
+        # Evicted since the lookup
+        return None
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return key
+
+
+def coalesce_jobs(jobs: List[dict]) -> List[dict]:
+    """
+    Attach jobs identical to one already in flight to that job as followers.
+    Returns the jobs that need their own GPU run; each becomes the leader
+    for its request hash. A follower more urgent than its leader raises the
+    leader's queue priority to its own class. Jobs without a seed are never
+    coalesced, since each renders a different image.
+    """
+    if not _settings.coalesce_duplicate_jobs:
+        return jobs
 
+    leaders, followers, promoted = [], [], {}
+    with _in_flight_lock:
+        for job in jobs:
+            if not _reproducible(job):
+                leaders.append(job)
+                continue
+            entry = IN_FLIGHT_JOBS.get(job["cache_key"])
+            if entry is None:
+                IN_FLIGHT_JOBS[job["cache_key"]] = {
+                    "leader_id": job["id"], "followers": [], "priority": job.get("priority", Priority.STANDARD.value),
+                }
+                COALESCE_COUNTERS["leaders"] += 1
+                leaders.append(job)
+            else:
+                entry["followers"].append(job["id"])
+                job["coalesced_with"] = entry["leader_id"]
+                COALESCE_COUNTERS["followers"] += 1
+                followers.append(job)
+                priority = _more_urgent(entry["priority"], job.get("priority", Priority.STANDARD.value))
+                if priority != entry["priority"]:
+                    entry["priority"] = promoted[entry["leader_id"]] = priority
 
-def update_job(job: dict, data: dict):
-    """Update job status from GPU worker callback."""
+    # Leaders created above are queued at their entry's priority by enqueue_jobs()
+    for leader_id, priority in promoted.items():
+        JOB_QUEUE.promote(leader_id, PRIORITY_RANK[Priority(priority)], {"priority": priority})
+
+    if followers:
+        # Followers of leaders in this list are updated once those are routed
+        new_leader_ids = {job["id"] for job in leaders}
+        existing = get_jobs([job["coalesced_with"] for job in followers if job["coalesced_with"] not in new_leader_ids])
+        for job in followers:
+            if job["coalesced_with"] in existing:
+                _mirror_leader(existing[job["coalesced_with"]], job)
+        save_jobs(followers)
+
+    return leaders
+
+
+def _more_urgent(a: str, b: str) -> str:
+    return min(a, b, key=lambda priority: PRIORITY_RANK[Priority(priority)])
+
+
+def _queue_priority(job: dict) -> str:
+    """Class a job is queued at: its own, or a more urgent follower's if it leads."""
+    priority = job.get("priority", Priority.STANDARD.value)
+    with _in_flight_lock:
+        entry = IN_FLIGHT_JOBS.get(job.get("cache_key"))
+        if entry is not None and entry["leader_id"] == job["id"]:
+            priority = _more_urgent(priority, entry["priority"])
+    return priority
+
+
+def sync_followers(leader: dict, final: bool = False):
+    """
+    Copy the leader's state onto its followers. With final=True the leader
+    stops accepting followers and remembers them for the proof fan-out.
+    """
+    retired = False
+    with _in_flight_lock:
+        entry = IN_FLIGHT_JOBS.get(leader.get("cache_key"))
+        if entry is not None and entry["leader_id"] == leader["id"]:
+            follower_ids = list(entry["followers"])
+            if final:
+                del IN_FLIGHT_JOBS[leader["cache_key"]]
+                retired = True
+        else:
+            follower_ids = leader.get("followers") or []
+
+    if not follower_ids:
+        return
+
+    if retired:
+        leader["followers"] = follower_ids
+        save_job(leader)
+
+    followers = list(get_jobs(follower_ids).values())
+    for follower in followers:
+        _mirror_leader(leader, follower)
+    save_jobs(followers)
+
+
+def _mirror_leader(leader: dict, follower: dict):
+    for field in FOLLOWER_FIELDS:
+        follower[field] = leader.get(field)
+    # The GPU run is paid for once, by the leader
+    follower["compute_cost"] = 0.0 if leader["status"] == JobStatus.COMPLETED else None
+    follower["execution"] = {**(leader.get("execution") or {}), "coalesced_with": leader["id"]}
+
+
+def update_job(job: dict, data: dict) -> bool:
+    """
+    Update job status from GPU worker callback. Terminal states are final: a
+    result for a job that already ended (cancelled, failed at its deadline or
+    after its last attempt) is not applied, and False is returned.
+    """
+    if job["status"] in TERMINAL_STATUSES:
+        return False
     # Handle both uppercase and lowercase status values
     status_value = data["status"].upper() if isinstance(data["status"], str) else data["status"]
     job["status"] = JobStatus(status_value)
     job["completed_at"] = datetime.utcnow()
     job["output_url"] = data.get("output_url")
     job["compute_cost"] = data.get("compute_cost")
+    if data.get("steps_run"):
+        # Bill the steps the worker actually ran, so fast samplers cost less
+        job["compute_cost"] = get_aidp_cost(data["steps_run"])
     if "error" in data:
         job["error"] = data["error"]
-    
\ No newline at end of file
+
+    execution = {key: data[key] for key in EXECUTION_FIELDS if key in data}
+    if execution:
+        job["execution"] = {**(job.get("execution") or {}), **execution}
+
+    if job["status"] in TERMINAL_STATUSES:
+        _finish_progress(job)
+        if data.get("timed_out"):
+            # The worker noticed the deadline before the router did
+            TERMINATIONS["timed_out"] += 1
+
+    save_job(job)
+
+    # A terminal result means the job's queue lease is done with
+    if job["status"] in TERMINAL_STATUSES:
+        JOB_QUEUE.ack_job(job["id"])
+        _release_node(job, data.get("execution_time"))
+        _observe_finished(job, data)
+        if job["status"] == JobStatus.COMPLETED:
+            latency = (job["completed_at"] - job["created_at"]).total_seconds()
+            LATENCIES[job.get("priority", Priority.STANDARD.value)].append(latency)
+            if data.get("avg_step_ms"):
+                STEP_TIMES.setdefault(job["model"], deque(maxlen=1000)).append(data["avg_step_ms"])
+
+    if (
+        job["status"] == JobStatus.COMPLETED and job["output_url"] and _settings.result_cache_enabled
+        and _reproducible(job)
+    ):
+        source = BLOB_STORE.local_path(job["output_key"]) if job.get("output_key") else job["output_url"]
+        if source:
+            RESULT_CACHE.store(job["cache_key"], source)
+
+    # One GPU run completes every coalesced duplicate
+    sync_followers(job, final=job["status"] in TERMINAL_STATUSES)
+    return True
+
+
+def store_output(job: dict, path: str, content_type: str) -> dict:
+    """Move an uploaded output into the blob store and point the job at it."""
+    extension = mimetypes.guess_extension(content_type) or ""
+    key = f"{job['id']}{extension}"
+    info = BLOB_STORE.put_file(key, path, content_type)
+    job["output_key"] = key
+    save_job(job)
+    return info
+
+
+def job_output(job: dict) -> Optional[tuple]:
+    """(store, key) holding a job's output image, or None if it has none."""
+    if job.get("output_key"):
+        return BLOB_STORE, job["output_key"]
+
+    # Shared-disk workers and result cache hits report a local path
+    path = job.get("output_url")
+    if path and os.path.isfile(path):
+        path = os.path.realpath(path)
+        for root in OUTPUT_ROOTS:
+            if path.startswith(root + os.sep):
+                return LocalBlobStore(root), os.path.relpath(path, root)
+    return None
+
+
+def enqueue_jobs(jobs: List[dict], worker_payloads: List[dict]):
+    """Queue jobs for the next resident workers that ask for work."""
+    items = []
+    for job, worker_payload in zip(jobs, worker_payloads):
+        priority = _queue_priority(job)
+        if priority != worker_payload.get("priority"):
+            # Workers preempt by the class the job runs at
+            worker_payload = {**worker_payload, "priority": priority}
+        items.append((
+            job["id"], worker_payload, job.get("batch_key"), job.get("model"),
+            PRIORITY_RANK[Priority(priority)], job.get("tenant"),
+        ))
+    JOB_QUEUE.enqueue_many(items)
+
+
+def _fail_job(job_id: str, error: str):
+    job = get_job(job_id)
+    if job:
+        was_terminal = job["status"] in TERMINAL_STATUSES
+        job["status"] = JobStatus.FAILED
+        job["completed_at"] = datetime.utcnow()
+        job["error"] = error
+        _finish_progress(job)
+        save_job(job)
+        if not was_terminal:
+            _release_node(job)
+            _observe_finished(job)
+        sync_followers(job, final=True)
+
+
+def _detach_follower(job: dict):
+    """Stop a coalesced follower from receiving its leader's result."""
+    if not job.get("coalesced_with"):
+        return
+    with _in_flight_lock:
+        entry = IN_FLIGHT_JOBS.get(job["cache_key"])
+        if entry is not None and job["id"] in entry["followers"]:
+            entry["followers"].remove(job["id"])
+
+
+def _hand_over(job: dict) -> Optional[dict]:
+    """
+    Make the follower with the latest deadline the leader of a leader that
+    is ending early, so the other duplicates keep waiting on one GPU run
+    instead of ending with it. Returns the new leader, or None.
+    """
+    with _in_flight_lock:
+        entry = IN_FLIGHT_JOBS.get(job.get("cache_key"))
+        if entry is None or entry["leader_id"] != job["id"] or not entry["followers"]:
+            return None
+        followers = get_jobs(entry["followers"])
+        if not followers:
+            return None
+        successor = max(followers.values(), key=deadline_timestamp)
+        del followers[successor["id"]]
+        entry["leader_id"] = successor["id"]
+        entry["followers"] = list(followers)
+        entry["priority"] = successor.get("priority", Priority.STANDARD.value)
+        for follower in followers.values():
+            entry["priority"] = _more_urgent(entry["priority"], follower.get("priority", Priority.STANDARD.value))
+            follower["coalesced_with"] = successor["id"]
+
+    successor["coalesced_with"] = None
+    successor["status"] = JobStatus.PENDING
+    successor["started_at"] = None
+    successor["execution"] = None
+    save_job(successor)
+    sync_followers(successor)
+    return successor
+
+
+def _terminate(job: dict, status: JobStatus, error: str) -> Optional[dict]:
+    """
+    End an unfinished job early: drop it from the queue (a worker holding
+    its lease is told through heartbeats and progress reports and stops
+    between steps) and free its node. Followers of a leader are handed to
+    one of them, which is returned and needs its own GPU run.
+    """
+    _detach_follower(job)
+    successor = _hand_over(job)
+    if JOB_QUEUE.cancel(job["id"]) == "ready":
+        TERMINATIONS["dequeued"] += 1
+
+    job["status"] = status
+    job["completed_at"] = datetime.utcnow()
+    job["error"] = error
+    _finish_progress(job)
+    save_job(job)
+    _observe_finished(job)
+
+    # A follower's node is its leader's, and a successor keeps its leader's
+    if not job.get("coalesced_with") and successor is None:
+        _release_node(job)
+    sync_followers(job, final=True)
+    return successor
+
+
+def _dispatch_successors(successors: List[dict]):
+    if successors and _dispatch is not None:
+        _dispatch(successors)
+
+
+def set_dispatcher(dispatch: Callable[[List[dict]], None]):
+    """Register the function starting GPU runs for followers that took over a leader's run."""
+    global _dispatch
+    _dispatch = dispatch
+
+
+def cancel_job(job: dict) -> str:
+    """
+    Cancel a job that has not finished. Returns "cancelled", or "finished"
+    if it already had. Coalesced duplicates waiting on its GPU run get
+    their own run instead.
+    """
+    if job["status"] in TERMINAL_STATUSES:
+        return "finished"
+
+    successor = _terminate(job, JobStatus.CANCELLED, "Cancelled by client")
+    TERMINATIONS["cancelled"] += 1
+    _dispatch_successors([successor] if successor else [])
+    return "cancelled"
+
+
+def reap_deadlines() -> List[str]:
+    """Fail jobs still unfinished at their deadline. Returns their ids."""
+    now = time.time()
+    due = []
+    with _deadline_lock:
+        while DEADLINES and DEADLINES[0][0] <= now:
+            due.append(heapq.heappop(DEADLINES)[1])
+    if not due:
+        return []
+
+    timed_out = [job for job in get_jobs(due).values() if job["status"] not in TERMINAL_STATUSES]
+    successors = {}
+    for job in timed_out:
+        # A successor due as well is ended in its up-to-date form
+        job = successors.pop(job["id"], job)
+        successor = _terminate(job, JobStatus.FAILED, f"Deadline exceeded: not finished within {job['timeout_seconds']}s")
+        TERMINATIONS["timed_out"] += 1
+        if successor is not None:
+            successors[successor["id"]] = successor
+    _dispatch_successors(list(successors.values()))
+    return [job["id"] for job in timed_out]
+
+
+def _requeue_job(job_id: str):
+    job = get_job(job_id)
+    if job:
+        job["status"] = JobStatus.PENDING
+        save_job(job)
+        sync_followers(job)
+
+
+def reap_expired_leases():
+    """Requeue jobs whose worker stopped heartbeating; fail jobs out of attempts."""
+    requeued, dead = JOB_QUEUE.reap_expired()
+
+    for job_id in requeued:
+        _requeue_job(job_id)
+
+    for job_id in dead:
+        _fail_job(job_id, f"Worker lease expired {JOB_QUEUE.max_attempts} times")
+
+
+def lease_jobs(
+    worker_id: str,
+    max_jobs: int = 1,
+    visibility_timeout: Optional[float] = None,
+    batch_key: Optional[str] = None,
+    stats: Optional[dict] = None,
+    warm_models: Optional[List[str]] = None,
+    more_urgent_than: Optional[Priority] = None,
+) -> List[dict]:
+    """
+    Lease a batch of compatible queued jobs to a worker and mark them RUNNING.
+    More urgent priority classes go first; within a class, jobs for the
+    worker's warm models are handed out first.
+    """
+    WORKER_STATS[worker_id] = {"last_seen": time.time(), "warm_models": warm_models, **(stats or {})}
+
+    reap_expired_leases()
+    # Never hand out a job that is already past its deadline
+    reap_deadlines()
+
+    max_priority = None
+    if more_urgent_than is not None:
+        max_priority = PRIORITY_RANK[more_urgent_than] - 1
+        if max_priority < 0:
+            return []  # nothing is more urgent than interactive
+
+    leases = JOB_QUEUE.lease(worker_id, max_jobs, visibility_timeout, batch_key, warm_models, max_priority)
+    ADMISSION.record_drained(len(leases))
+
+    for lease in leases:
+        job = get_job(lease["job_id"])
+        if job:
+            job["status"] = JobStatus.RUNNING
+            job["started_at"] = datetime.utcnow()
+            job["worker_id"] = worker_id
+            save_job(job)
+            sync_followers(job)
+            QUEUE_WAITS.append((time.time(), (job["started_at"] - job["created_at"]).total_seconds()))
+            _observe_started(job)
+
+    return leases
+
+
+def list_workers() -> List[dict]:
+    """Resident workers seen by this router, with health and reported counters."""
+    now = time.time()
+    leases = JOB_QUEUE.leases_by_worker()
+
+    workers = []
+    for worker_id, stats in WORKER_STATS.items():
+        idle_for = now - stats["last_seen"]
+        active = leases.get(worker_id, 0)
+        workers.append({
+            **stats,
+            "worker_id": worker_id,
+            # A busy worker stops polling, but its leases are still heartbeated
+            "status": "stale" if idle_for > _settings.worker_stale_seconds and not active else "healthy",
+            "last_seen_seconds": round(idle_for, 1),
+            "active_leases": active,
+        })
+    return workers
+
+
+def _percentile(values, pct: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * pct / 100), len(values) - 1)], 3)
+
+
+def heartbeat_lease(lease_id: str, visibility_timeout: Optional[float] = None) -> Optional[dict]:
+    return JOB_QUEUE.heartbeat(lease_id, visibility_timeout)
+
+
+def ack_lease(lease_id: str) -> Optional[str]:
+    return JOB_QUEUE.ack(lease_id)
+
+
+def nack_lease(lease_id: str, requeue: bool = True, error: Optional[str] = None) -> Optional[dict]:
+    """Return a leased job to the queue, or fail it when it cannot be retried."""
+    result = JOB_QUEUE.nack(lease_id, requeue)
+    if result is None:
+        return None
+
+    if result["requeued"]:
+        _requeue_job(result["job_id"])
+    else:
+        _fail_job(result["job_id"], error or "Job rejected by worker")
+
+    return result
+
+
+def _process_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return None
+
+
+def get_stats() -> dict:
+    """Job store retention counters, queue depth, node load, cache hits and process memory."""
+    since = time.time() - _settings.queue_wait_window_seconds
+    recent_waits = [wait for leased_at, wait in list(QUEUE_WAITS) if leased_at >= since]
+    return {
+        "job_store": JOB_STORE.stats(),
+        "queue": {
+            **JOB_QUEUE.stats(),
+            "wait_p50_seconds": _percentile(recent_waits, 50),
+            "wait_p95_seconds": _percentile(recent_waits, 95),
+        },
+        "latency_by_priority": {
+            priority: {
+                "count": len(latencies),
+                "p50_seconds": _percentile(latencies, 50),
+                "p95_seconds": _percentile(latencies, 95),
+                "p99_seconds": _percentile(latencies, 99),
+            }
+            for priority, latencies in LATENCIES.items()
+        },
+        # Denoising speed per checkpoint, for capacity planning
+        "step_ms_by_model": {
+            model: {
+                "count": len(step_times),
+                "p50_ms": _percentile(step_times, 50),
+                "p95_ms": _percentile(step_times, 95),
+            }
+            for model, step_times in STEP_TIMES.items()
+        },
+        "scheduler": NODE_SCHEDULER.stats(),
+        "result_cache": RESULT_CACHE.stats(),
+        "coalescing": {"in_flight": len(IN_FLIGHT_JOBS), **COALESCE_COUNTERS},
+        "terminations": dict(TERMINATIONS),
+        "admission": ADMISSION.stats(),
+        "workers": WORKER_STATS,
+        "process": {"rss_bytes": _process_rss_bytes()},
+    }
@@ -0,0 +1,589 @@
+"""
+Durable job queue for resident GPU workers.
+
+Workers pull jobs at their own pace by taking a lease. A lease that is neither
+heartbeated nor acked before its visibility timeout puts the job back on the
+queue, so a crashed worker never loses a job. After max_attempts deliveries a
+job is dead-lettered instead of being retried forever.
+
+Jobs may carry a batch key. A multi-job lease only ever contains jobs with
+the same key and priority, so a worker can run them as one batched pipeline
+call without pulling less urgent work in with the job picked first.
+
+Jobs have a priority (lower is more urgent, default 0). Leases always come
+from the most urgent level that has ready jobs, FIFO within a level; a
+worker may also ask only for jobs more urgent than a given level, which is
+how a busy worker checks whether it should preempt its current batch.
+
+Within a level, tenants (API keys) share the queue by weighted fair queuing:
+each job gets a virtual finish tag, max(virtual clock, the tenant's last
+tag) + 1 / weight, and jobs are leased in tag order. A tenant that floods the
+queue only pushes its own later jobs back; a tenant with weight 2 gets twice
+the share of one with weight 1 when both have work waiting. With a single
+tenant this is plain FIFO.
+
+Jobs may also carry an affinity (the model they need). A worker that names
+the affinities it can serve cheaply (models it has warm) is handed matching
+jobs first (within the most urgent level), unless the oldest ready job of
+that level has already waited longer than affinity_max_wait, in which case
+plain FIFO order wins so cold work is not starved.
+
+When a journal path is configured, enqueue/ack/dead-letter operations are
+appended to a JSONL journal and replayed on startup. Leases are deliberately
+not journaled: after a router restart every unacknowledged job is simply
+redelivered.
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """In-process lease queue with an optional append-only journal."""
+
+    def __init__(
+        self,
+        visibility_timeout: float = 120.0,
+        max_attempts: int = 3,
+        journal_path: str = "",
+        affinity_max_wait: float = 5.0,
+        tenant_weights: Optional[Dict[str, float]] = None,
+    ):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.journal_path = journal_path
+        self.affinity_max_wait = affinity_max_wait
+        self.tenant_weights = tenant_weights or {}
+
+        self._lock = threading.Lock()
+        # Fair-order heaps of (tag, seq, job_id) per priority and per
+        # (batch key, priority), and one FIFO per (affinity, priority). All may
+        # hold stale ids (already leased, acked or moved to another level);
+        # _pop_fair / _pop_ready skip those lazily.
+        self._ready: Dict[int, List[Tuple[float, int, str]]] = {}
+        self._ready_by_key: Dict[Tuple[str, int], List[Tuple[float, int, str]]] = {}
+        self._ready_by_affinity: Dict[Tuple[str, int], Deque[str]] = {}
+        self._ready_count = 0
+        # Weighted fair queuing state: virtual clock and last tag per tenant.
+        # Tags the clock has passed count as absent and are pruned once the
+        # dict has doubled in size since the last pass.
+        self._virtual_time = 0.0
+        self._tenant_tags: Dict[str, float] = {}
+        self._tenant_tags_pruned = 0
+        self._seq = itertools.count()
+        # job_id -> {"payload", "batch_key", "affinity", "priority", "tenant", "tag",
+        #            "attempts", "enqueued_at", "ready", "seq" (of its live ready entries)}
+        self._messages: Dict[str, dict] = {}
+        # lease_id -> {"job_id", "worker_id", "expires_at"}
+        self._leases: Dict[str, dict] = {}
+        self._job_leases: Dict[str, str] = {}
+        # (expires_at, lease_id); stale entries are skipped when popped
+        self._expiry_heap: List[Tuple[float, str]] = []
+
+        self._journal = None
+        self._journal_ops = 0
+        if journal_path:
+            os.makedirs(os.path.dirname(journal_path) or ".", exist_ok=True)
+            self._replay_journal()
+            self._journal = open(journal_path, "a", encoding="utf-8")
+
+    # ------------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------------
+
+    def enqueue(
+        self,
+        job_id: str,
+        payload: dict,
+        batch_key: Optional[str] = None,
+        affinity: Optional[str] = None,
+        priority: int = 0,
+        tenant: Optional[str] = None,
+    ):
+        self.enqueue_many([(job_id, payload, batch_key, affinity, priority, tenant)])
+
+    def enqueue_many(self, items: List[tuple]):
+        """
+        Enqueue (job_id, payload, batch_key[, affinity[, priority[, tenant]]])
+        tuples under one lock acquisition.
+        """
+        now = time.time()
+        with self._lock:
+            for job_id, payload, batch_key, *rest in items:
+                if job_id in self._messages:
+                    continue
+                affinity = rest[0] if rest else None
+                priority = rest[1] if len(rest) > 1 else 0
+                tenant = rest[2] if len(rest) > 2 else None
+                self._messages[job_id] = {
+                    "payload": payload,
+                    "batch_key": batch_key,
+                    "affinity": affinity,
+                    "priority": priority,
+                    "tenant": tenant,
+                    "tag": self._fair_tag(tenant),
+                    "attempts": 0,
+                    "enqueued_at": now,
+                    "ready": False,
+                }
+                self._push_ready(job_id)
+                self._write_journal(
+                    {
+                        "op": "enqueue",
+                        "job_id": job_id,
+                        "payload": payload,
+                        "batch_key": batch_key,
+                        "affinity": affinity,
+                        "priority": priority,
+                        "tenant": tenant,
+                    },
+                    flush=False,
+                )
+            if self._journal is not None:
+                self._journal.flush()
+
+    # ------------------------------------------------------------------
+    # Worker side
+    # ------------------------------------------------------------------
+
+    def lease(
+        self,
+        worker_id: str,
+        max_jobs: int = 1,
+        visibility_timeout: Optional[float] = None,
+        batch_key: Optional[str] = None,
+        prefer_affinities: Optional[List[str]] = None,
+        max_priority: Optional[int] = None,
+    ) -> List[dict]:
+        """
+        Hand out up to max_jobs ready jobs, each under its own lease.
+
+        All returned jobs share one batch key and priority level: batch_key
+        if given, otherwise the key of the first job picked, which is the
+        oldest ready job of the most urgent level with one of
+        prefer_affinities, or else the next job of that level in fair order.
+        The rest of the batch is filled from that level in fair order. Jobs
+        without a key are leased alone. With max_priority, only jobs at that
+        level or more urgent are handed out.
+        """
+        timeout = visibility_timeout or self.visibility_timeout
+        now = time.time()
+        leases = []
+        level = None
+
+        with self._lock:
+            if batch_key is not None:
+                level = self._top_priority(max_priority, batch_key)
+
+            while len(leases) < max_jobs:
+                if batch_key is None:
+                    if leases:
+                        break  # unbatchable job, lease it on its own
+                    level = self._top_priority(max_priority)
+                    if level is None:
+                        break
+                    job_id = self._pop_preferred(prefer_affinities, level, now) or self._pop_fair(level)
+                elif level is None:
+                    break
+                else:
+                    job_id = self._pop_keyed(batch_key, level)
+                if job_id is None:
+                    break
+
+                message = self._messages[job_id]
+                batch_key = message["batch_key"]
+                # The virtual clock follows the tags of the jobs handed out
+                self._virtual_time = max(self._virtual_time, message["tag"])
+                message["attempts"] += 1
+                lease_id = f"lease_{uuid.uuid4().hex[:16]}"
+                expires_at = now + timeout
+                self._leases[lease_id] = {
+                    "job_id": job_id,
+                    "worker_id": worker_id,
+                    "expires_at": expires_at,
+                }
+                self._job_leases[job_id] = lease_id
+                heapq.heappush(self._expiry_heap, (expires_at, lease_id))
+
+                leases.append({
+                    "lease_id": lease_id,
+                    "job_id": job_id,
+                    "payload": message["payload"],
+                    "attempt": message["attempts"],
+                    "expires_at": expires_at,
+                })
+
+        return leases
+
+    def heartbeat(self, lease_id: str, visibility_timeout: Optional[float] = None) -> Optional[dict]:
+        """Extend a live lease. Returns None if the lease has expired or is unknown."""
+        timeout = visibility_timeout or self.visibility_timeout
+
+        with self._lock:
+            lease = self._leases.get(lease_id)
+            if lease is None or lease["expires_at"] < time.time():
+                return None
+
+            lease["expires_at"] = time.time() + timeout
+            heapq.heappush(self._expiry_heap, (lease["expires_at"], lease_id))
+            return {"lease_id": lease_id, "job_id": lease["job_id"], "expires_at": lease["expires_at"]}
+
+    def ack(self, lease_id: str) -> Optional[str]:
+        """Remove a leased job from the queue for good. Returns its job_id."""
+        with self._lock:
+            lease = self._leases.pop(lease_id, None)
+            if lease is None:
+                return None
+            self._remove_message(lease["job_id"], "ack")
+            return lease["job_id"]
+
+    def ack_job(self, job_id: str) -> bool:
+        """Ack by job id, used when a worker reports a terminal result via callback."""
+        with self._lock:
+            if job_id not in self._messages:
+                return False
+            lease_id = self._job_leases.get(job_id)
+            if lease_id:
+                self._leases.pop(lease_id, None)
+            self._remove_message(job_id, "ack")
+            return True
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """
+        Drop a job whether it is waiting or leased. Returns "ready" or
+        "leased" (what it was), or None if the queue does not hold it.
+        """
+        with self._lock:
+            message = self._messages.get(job_id)
+            if message is None:
+                return None
+            state = "ready" if message["ready"] else "leased"
+            lease_id = self._job_leases.get(job_id)
+            if lease_id:
+                self._leases.pop(lease_id, None)
+            # Its ids in the ready lists go stale and are skipped
+            self._remove_message(job_id, "cancel")
+            return state
+
+    def promote(self, job_id: str, priority: int, payload_fields: Optional[dict] = None) -> bool:
+        """
+        Move a job to a more urgent priority level, merging payload_fields
+        into its payload. A leased job is promoted for any redelivery. Returns
+        False if the queue does not hold the job or it is already as urgent.
+        """
+        with self._lock:
+            message = self._messages.get(job_id)
+            if message is None or priority >= message["priority"]:
+                return False
+            message["priority"] = priority
+            if payload_fields:
+                message["payload"] = {**message["payload"], **payload_fields}
+            if message["ready"]:
+                # Its entries at the old level go stale
+                message["ready"] = False
+                self._ready_count -= 1
+                self._push_ready(job_id)
+            self._write_journal({"op": "promote", "job_id": job_id, "priority": priority, "payload_fields": payload_fields})
+            return True
+
+    def nack(self, lease_id: str, requeue: bool = True) -> Optional[dict]:
+        """
+        Give a leased job back.
+
+        With requeue=True the job goes back to the front of the queue (or is
+        dead-lettered once it has used up max_attempts). Returns
+        {"job_id", "requeued"} or None for an unknown lease.
+        """
+        with self._lock:
+            lease = self._leases.pop(lease_id, None)
+            if lease is None:
+                return None
+
+            job_id = lease["job_id"]
+            self._job_leases.pop(job_id, None)
+            message = self._messages.get(job_id)
+
+            if requeue and message and message["attempts"] < self.max_attempts:
+                self._push_ready(job_id, front=True)
+                return {"job_id": job_id, "requeued": True}
+
+            self._remove_message(job_id, "dead")
+            return {"job_id": job_id, "requeued": False}
+
+    def reap_expired(self) -> Tuple[List[str], List[str]]:
+        """
+        Return jobs whose lease ran out to the queue.
+
+        Returns (requeued_job_ids, dead_lettered_job_ids).
+        """
+        now = time.time()
+        requeued, dead = [], []
+
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires_at, lease_id = heapq.heappop(self._expiry_heap)
+                lease = self._leases.get(lease_id)
+                if lease is None or lease["expires_at"] > now:
+                    continue  # acked, or extended by a heartbeat
+
+                del self._leases[lease_id]
+                job_id = lease["job_id"]
+                self._job_leases.pop(job_id, None)
+                message = self._messages.get(job_id)
+                if message is None:
+                    continue
+
+                logger.warning(f"Lease {lease_id} for {job_id} expired (worker {lease['worker_id']})")
+                if message["attempts"] < self.max_attempts:
+                    self._push_ready(job_id, front=True)
+                    requeued.append(job_id)
+                else:
+                    self._remove_message(job_id, "dead")
+                    dead.append(job_id)
+
+        return requeued, dead
+
+    # ------------------------------------------------------------------
+    # Introspection
+    # ------------------------------------------------------------------
+
+    def stats(self) -> dict:
+        with self._lock:
+            ready_by_priority: Dict[int, int] = {}
+            for message in self._messages.values():
+                if message["ready"]:
+                    ready_by_priority[message["priority"]] = ready_by_priority.get(message["priority"], 0) + 1
+            return {
+                "ready": self._ready_count,
+                "ready_by_priority": ready_by_priority,
+                "leased": len(self._leases),
+                "total": len(self._messages),
+            }
+
+    def ready_count(self) -> int:
+        """Jobs waiting for a worker; cheap enough to check on every submission."""
+        return self._ready_count
+
+    def leases_by_worker(self) -> Dict[str, int]:
+        """Number of live leases held by each worker."""
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for lease in self._leases.values():
+                counts[lease["worker_id"]] = counts.get(lease["worker_id"], 0) + 1
+        return counts
+
+    def clear(self):
+        with self._lock:
+            self._ready.clear()
+            self._ready_by_key.clear()
+            self._ready_by_affinity.clear()
+            self._ready_count = 0
+            self._virtual_time = 0.0
+            self._tenant_tags.clear()
+            self._tenant_tags_pruned = 0
+            self._messages.clear()
+            self._leases.clear()
+            self._job_leases.clear()
+            self._expiry_heap.clear()
+
+    # ------------------------------------------------------------------
+    # Ready lists
+    # ------------------------------------------------------------------
+
+    def _fair_tag(self, tenant: Optional[str]) -> float:
+        """Virtual finish tag of a tenant's next job."""
+        weight = self.tenant_weights.get(tenant, 1.0) if tenant is not None else 1.0
+        tag = max(self._virtual_time, self._tenant_tags.get(tenant, 0.0)) + 1.0 / weight
+        self._tenant_tags[tenant] = tag
+        if len(self._tenant_tags) > max(2 * self._tenant_tags_pruned, 1024):
+            self._tenant_tags = {
+                name: last for name, last in self._tenant_tags.items() if last > self._virtual_time
+            }
+            self._tenant_tags_pruned = len(self._tenant_tags)
+        return tag
+
+    def _push_ready(self, job_id: str, front: bool = False):
+        message = self._messages[job_id]
+        message["ready"] = True
+        self._ready_count += 1
+
+        priority = message.get("priority", 0)
+        # A redelivered job keeps its original tag, which puts it at the front
+        message["seq"] = next(self._seq)
+        entry = (message["tag"], message["seq"], job_id)
+        heapq.heappush(self._ready.setdefault(priority, []), entry)
+        if message["batch_key"] is not None:
+            heapq.heappush(self._ready_by_key.setdefault((message["batch_key"], priority), []), entry)
+
+        if message.get("affinity") is not None:
+            queue = self._ready_by_affinity.setdefault((message["affinity"], priority), deque())
+            if front:
+                queue.appendleft(job_id)
+            else:
+                queue.append(job_id)
+
+    def _pop_ready(self, affinity_key: Tuple[str, int]) -> Optional[str]:
+        """Oldest ready job of an (affinity, priority) FIFO."""
+        queue = self._ready_by_affinity.get(affinity_key)
+        while queue:
+            job_id = queue.popleft()
+            message = self._messages.get(job_id)
+            # A promoted job's id at its old level is stale
+            if message and message["ready"] and message["priority"] == affinity_key[1]:
+                message["ready"] = False
+                self._ready_count -= 1
+                if not queue:
+                    del self._ready_by_affinity[affinity_key]
+                return job_id
+        return None
+
+    def _pop_heap(self, heap: Optional[List[Tuple[float, int, str]]]) -> Optional[str]:
+        while heap:
+            _, seq, job_id = heapq.heappop(heap)
+            message = self._messages.get(job_id)
+            if message and message["ready"] and message["seq"] == seq:
+                message["ready"] = False
+                self._ready_count -= 1
+                return job_id
+        return None
+
+    def _peek_heap(self, heap: Optional[List[Tuple[float, int, str]]]) -> Optional[str]:
+        # Stale entries at the top can be dropped for good
+        while heap:
+            _, seq, job_id = heap[0]
+            message = self._messages.get(job_id)
+            if message and message["ready"] and message["seq"] == seq:
+                return job_id
+            heapq.heappop(heap)
+        return None
+
+    def _pop_fair(self, level: int) -> Optional[str]:
+        """Ready job with the lowest fair-queuing tag at a priority level."""
+        return self._pop_heap(self._ready.get(level))
+
+    def _peek_fair(self, level: int) -> Optional[str]:
+        return self._peek_heap(self._ready.get(level))
+
+    def _pop_keyed(self, batch_key: str, level: int) -> Optional[str]:
+        """Ready job with the lowest tag among a batch key's jobs at a level."""
+        key = (batch_key, level)
+        job_id = self._pop_heap(self._ready_by_key.get(key))
+        if not self._ready_by_key.get(key, True):
+            del self._ready_by_key[key]
+        return job_id
+
+    def _top_priority(self, max_priority: Optional[int], batch_key: Optional[str] = None) -> Optional[int]:
+        """
+        Most urgent level with a ready job (with batch_key, if given), not
+        beyond max_priority.
+        """
+        for level in sorted(self._ready):
+            if max_priority is not None and level > max_priority:
+                return None
+            heap = self._ready.get(level) if batch_key is None else self._ready_by_key.get((batch_key, level))
+            if self._peek_heap(heap) is not None:
+                return level
+        return None
+
+    def _pop_preferred(self, affinities: Optional[List[str]], level: int, now: float) -> Optional[str]:
+        if not affinities:
+            return None
+
+        # The job next in fair order stands in for the oldest one
+        oldest = self._peek_fair(level)
+        if oldest is None or now - self._messages[oldest]["enqueued_at"] > self.affinity_max_wait:
+            return None
+
+        for affinity in affinities:
+            job_id = self._pop_ready((affinity, level))
+            if job_id is not None:
+                return job_id
+        return None
+
+    # ------------------------------------------------------------------
+    # Journal
+    # ------------------------------------------------------------------
+
+    def _remove_message(self, job_id: str, op: str):
+        message = self._messages.pop(job_id, None)
+        if message and message["ready"]:
+            self._ready_count -= 1
+        self._job_leases.pop(job_id, None)
+        self._write_journal({"op": op, "job_id": job_id})
+
+    def _write_journal(self, record: dict, flush: bool = True):
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(record) + "\n")
+        if flush:
+            self._journal.flush()
+        self._journal_ops += 1
+
+        # Rewrite the journal once it is mostly acked history
+        if self._journal_ops > 1000 and self._journal_ops > 4 * len(self._messages):
+            self._compact_journal()
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping torn journal line")
+                    continue
+                self._journal_ops += 1
+                if record["op"] == "enqueue":
+                    self._messages[record["job_id"]] = {
+                        "payload": record["payload"],
+                        "batch_key": record.get("batch_key"),
+                        "affinity": record.get("affinity"),
+                        "priority": record.get("priority", 0),
+                        "tenant": record.get("tenant"),
+                        "tag": self._fair_tag(record.get("tenant")),
+                        "attempts": 0,
+                        "enqueued_at": time.time(),
+                        "ready": False,
+                    }
+                elif record["op"] == "promote":
+                    message = self._messages.get(record["job_id"])
+                    if message is not None:
+                        message["priority"] = record["priority"]
+                        message["payload"] = {**message["payload"], **(record.get("payload_fields") or {})}
+                else:
+                    self._messages.pop(record["job_id"], None)
+
+        for job_id in self._messages:
+            self._push_ready(job_id)
+        logger.info(f"Replayed job queue journal: {len(self._messages)} pending jobs")
+
+    def _compact_journal(self):
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for job_id, message in self._messages.items():
+                f.write(json.dumps({
+                    "op": "enqueue",
+                    "job_id": job_id,
+                    "payload": message["payload"],
+                    "batch_key": message["batch_key"],
+                    "affinity": message.get("affinity"),
+                    "priority": message.get("priority", 0),
+                    "tenant": message.get("tenant"),
+                }) + "\n")
+
+        self._journal.close()
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._journal_ops = len(self._messages)
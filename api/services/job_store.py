@@ -0,0 +1,483 @@
+"""
+Job persistence backends.
+
+MemoryJobStore keeps jobs in a process-local dict (the original behaviour).
+SQLJobStore keeps them in any SQLAlchemy database, so history survives
+restarts and is not bounded by memory. It assumes one router process owns
+the table: each process writes whole-job snapshots from its own buffer, and
+the queue, in-flight coalescing, deadlines and progress are per process
+anyway, so the router must run as a single process (no uvicorn --workers).
+
+Callers mutate the job dict they got from get() and hand it back through
+save(). The SQL backend buffers those saves and writes them in batches from
+a background thread; reads in the same process see buffered changes
+immediately.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from enum import Enum
+from typing import Deque, Dict, List, Optional, Tuple
+
+from api.models.job import JobStatus, JobType
+from api.services.job_archive import JobArchive
+
+try:
+    from sqlalchemy import (
+        Column,
+        DateTime,
+        Index,
+        MetaData,
+        String,
+        Table,
+        Text,
+        create_engine,
+        delete,
+        event,
+        func,
+        select,
+    )
+    from sqlalchemy.engine import make_url
+    SQLALCHEMY_AVAILABLE = True
+except ImportError:
+    SQLALCHEMY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
+class JobStore:
+    """Interface shared by all job store backends."""
+
+    def add(self, job: dict):
+        """Persist a newly created job."""
+        raise NotImplementedError
+
+    def add_many(self, jobs: List[dict]):
+        for job in jobs:
+            self.add(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def get_many(self, job_ids: List[str]) -> Dict[str, dict]:
+        """Look up several jobs; unknown ids are left out."""
+        found = {}
+        for job_id in job_ids:
+            job = self.get(job_id)
+            if job is not None:
+                found[job_id] = job
+        return found
+
+    def save(self, job: dict):
+        """Persist changes made to a job returned by get()."""
+        raise NotImplementedError
+
+    def save_many(self, jobs: List[dict]):
+        for job in jobs:
+            self.save(job)
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+    def close(self):
+        pass
+
+
+class MemoryJobStore(JobStore):
+    """
+    Process-local dict backend with bounded retention.
+
+    Terminal jobs are kept in least-recently-used order. When more than
+    max_live_jobs are held, the least recently used terminal job is evicted;
+    unfinished jobs are never evicted, so the bound is exceeded while they
+    alone fill it. Terminal jobs are also evicted terminal_ttl seconds after
+    they finished. Evicted jobs go to the archive (when configured), and get()
+    falls back to it. 0 disables a bound.
+    """
+
+    def __init__(
+        self,
+        jobs: Optional[Dict[str, dict]] = None,
+        max_live_jobs: int = 0,
+        terminal_ttl: float = 0,
+        archive: Optional[JobArchive] = None,
+    ):
+        self.jobs = jobs if jobs is not None else {}
+        self.max_live_jobs = max_live_jobs
+        self.terminal_ttl = terminal_ttl
+        self.archive = archive
+
+        self._lock = threading.RLock()
+        # Ids of terminal jobs, least recently used first: the LRU candidates
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        # (finished_at, job_id) in finishing order, checked lazily against the job
+        self._terminal: Deque[Tuple[float, str]] = deque()
+        self.counters = {
+            "evicted_lru": 0,
+            "evicted_ttl": 0,
+            "archived": 0,
+            "archive_hits": 0,
+        }
+        for job in self.jobs.values():
+            self._track(job)
+
+    def add(self, job: dict):
+        self.add_many([job])
+
+    def add_many(self, jobs: List[dict]):
+        with self._lock:
+            for job in jobs:
+                self.jobs[job["id"]] = job
+                self._track(job)
+            self._enforce_retention()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                self._touch(job_id)
+                return job
+
+        return self._load_archived(job_id)
+
+    def get_many(self, job_ids: List[str]) -> Dict[str, dict]:
+        found, missing = {}, []
+        with self._lock:
+            for job_id in job_ids:
+                job = self.jobs.get(job_id)
+                if job is not None:
+                    self._touch(job_id)
+                    found[job_id] = job
+                else:
+                    missing.append(job_id)
+
+        for job_id in missing:
+            job = self._load_archived(job_id)
+            if job is not None:
+                found[job_id] = job
+        return found
+
+    def _load_archived(self, job_id: str) -> Optional[dict]:
+        if self.archive is not None:
+            record = self.archive.load(job_id)
+            if record is not None:
+                self.counters["archive_hits"] += 1
+                return deserialize_job(record)
+        return None
+
+    def save(self, job: dict):
+        self.save_many([job])
+
+    def save_many(self, jobs: List[dict]):
+        # Live jobs are shared by reference; this refreshes LRU order,
+        # re-admits archived jobs and starts the TTL clock of finished ones
+        now = time.time()
+        with self._lock:
+            for job in jobs:
+                self.jobs[job["id"]] = job
+                if self._track(job):
+                    self._terminal.append((now, job["id"]))
+            self._enforce_retention()
+
+    def _track(self, job: dict) -> bool:
+        """Put a terminal job last in LRU order. Returns whether it is terminal."""
+        if job["status"] in TERMINAL_STATUSES:
+            self._finished[job["id"]] = None
+            self._finished.move_to_end(job["id"])
+            return True
+        self._finished.pop(job["id"], None)
+        return False
+
+    def _touch(self, job_id: str):
+        if job_id in self._finished:
+            self._finished.move_to_end(job_id)
+
+    def _evict(self, job_id: str, reason: str):
+        job = self.jobs.pop(job_id)
+        self._finished.pop(job_id, None)
+        self.counters[reason] += 1
+        if self.archive is not None:
+            self.archive.append(job_id, serialize_job(job))
+            self.counters["archived"] += 1
+
+    def _enforce_retention(self):
+        if self.terminal_ttl:
+            cutoff = time.time() - self.terminal_ttl
+            while self._terminal and self._terminal[0][0] <= cutoff:
+                _, job_id = self._terminal.popleft()
+                job = self.jobs.get(job_id)
+                if job is not None and job["status"] in TERMINAL_STATUSES:
+                    self._evict(job_id, "evicted_ttl")
+
+        if self.max_live_jobs:
+            while len(self.jobs) > self.max_live_jobs and self._finished:
+                self._evict(next(iter(self._finished)), "evicted_lru")
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "live_jobs": len(self.jobs),
+            "max_live_jobs": self.max_live_jobs,
+            "terminal_ttl_seconds": self.terminal_ttl,
+            "archived_jobs": len(self.archive) if self.archive is not None else 0,
+            "archive_bytes": self.archive.bytes_written if self.archive is not None else 0,
+            **self.counters,
+        }
+
+    def clear(self):
+        with self._lock:
+            self.jobs.clear()
+            self._finished.clear()
+            self._terminal.clear()
+            for key in self.counters:
+                self.counters[key] = 0
+        if self.archive is not None:
+            self.archive.clear()
+
+    def __len__(self):
+        return len(self.jobs)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _decode_object(obj: dict):
+    if len(obj) == 1 and "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+def serialize_job(job: dict) -> str:
+    return json.dumps(job, default=_encode_value, separators=(",", ":"))
+
+
+def deserialize_job(data: str) -> dict:
+    job = json.loads(data, object_hook=_decode_object)
+    job["status"] = JobStatus(job["status"])
+    job["type"] = JobType(job["type"])
+    return job
+
+
+class SQLJobStore(JobStore):
+    """
+    SQLAlchemy backend.
+
+    The table keeps the indexed columns (id, status, created_at) next to the
+    full job document as JSON. New jobs are inserted synchronously; updates
+    are coalesced per job and flushed every flush_interval seconds or once
+    write_batch_size jobs are waiting, in a single transaction. Flushes
+    replace whole documents, so only one process may write the table.
+    """
+
+    def __init__(
+        self,
+        database_url: str,
+        write_batch_size: int = 500,
+        flush_interval: float = 0.05,
+    ):
+        if not SQLALCHEMY_AVAILABLE:
+            raise RuntimeError("sqlalchemy is required for JOB_STORE_BACKEND=sql")
+
+        self.write_batch_size = write_batch_size
+        self.flush_interval = flush_interval
+
+        url = make_url(database_url)
+        if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+            os.makedirs(os.path.dirname(url.database) or ".", exist_ok=True)
+
+        self.engine = create_engine(database_url, future=True)
+        if self.engine.dialect.name == "sqlite":
+            event.listen(self.engine, "connect", _configure_sqlite)
+
+        self.metadata = MetaData()
+        self.table = Table(
+            "jobs",
+            self.metadata,
+            Column("id", String(32), primary_key=True),
+            Column("status", String(24), nullable=False, index=True),
+            Column("created_at", DateTime, nullable=False, index=True),
+            Column("updated_at", DateTime, nullable=False),
+            Column("data", Text, nullable=False),
+            Index("ix_jobs_status_created_at", "status", "created_at"),
+        )
+        self.metadata.create_all(self.engine)
+
+        self._lock = threading.Lock()
+        # job_id -> latest unsaved version of the job
+        self._pending: Dict[str, dict] = {}
+        # batch currently being written, still served to readers
+        self._flushing: Dict[str, dict] = {}
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="job-store-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _row(self, job: dict) -> dict:
+        return {
+            "id": job["id"],
+            "status": JobStatus(job["status"]).value,
+            "created_at": job["created_at"],
+            "updated_at": datetime.utcnow(),
+            "data": serialize_job(job),
+        }
+
+    def add(self, job: dict):
+        self.add_many([job])
+
+    def add_many(self, jobs: List[dict]):
+        if not jobs:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert(), [self._row(job) for job in jobs])
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            pending = self._pending.get(job_id) or self._flushing.get(job_id)
+        if pending is not None:
+            return pending
+
+        with self.engine.connect() as conn:
+            data = conn.execute(
+                select(self.table.c.data).where(self.table.c.id == job_id)
+            ).scalar_one_or_none()
+
+        return deserialize_job(data) if data is not None else None
+
+    def get_many(self, job_ids: List[str]) -> Dict[str, dict]:
+        found, missing = {}, []
+        with self._lock:
+            for job_id in job_ids:
+                job = self._pending.get(job_id) or self._flushing.get(job_id)
+                if job is not None:
+                    found[job_id] = job
+                else:
+                    missing.append(job_id)
+
+        # Chunked IN lookups stay on the primary key index
+        with self.engine.connect() as conn:
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = conn.execute(
+                    select(self.table.c.id, self.table.c.data).where(self.table.c.id.in_(chunk))
+                )
+                for job_id, data in rows:
+                    found[job_id] = deserialize_job(data)
+
+        return found
+
+    def save(self, job: dict):
+        self.save_many([job])
+
+    def save_many(self, jobs: List[dict]):
+        with self._lock:
+            for job in jobs:
+                self._pending[job["id"]] = job
+            backlog = len(self._pending)
+
+        if backlog >= self.write_batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write all buffered updates in one transaction."""
+        with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+
+        rows = [self._row(job) for job in batch.values()]
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(delete(self.table).where(self.table.c.id.in_(list(batch))))
+                conn.execute(self.table.insert(), rows)
+        except Exception as e:
+            logger.error(f"Job store flush of {len(rows)} jobs failed: {e}")
+            # Put the batch back unless a newer version arrived meanwhile
+            with self._lock:
+                for job_id, job in batch.items():
+                    self._pending.setdefault(job_id, job)
+        finally:
+            with self._lock:
+                self._flushing = {}
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "backend": "sql",
+            "dialect": self.engine.dialect.name,
+            "pending_writes": pending,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table))
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+        self.engine.dispose()
+
+    def __len__(self):
+        self.flush()
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(self.table)).scalar_one()
+
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    # WAL lets readers (reporting tools, backups) run while the router writes
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def create_job_store(
+    backend: str,
+    database_url: str = "",
+    write_batch_size: int = 500,
+    flush_interval: float = 0.05,
+    jobs: Optional[Dict[str, dict]] = None,
+    max_live_jobs: int = 0,
+    terminal_ttl: float = 0,
+    archive_path: str = "",
+) -> JobStore:
+    """Build the job store selected by JOB_STORE_BACKEND ("memory" or "sql")."""
+    if backend == "sql":
+        return SQLJobStore(database_url, write_batch_size, flush_interval)
+    if backend != "memory":
+        raise ValueError(f"Unknown job store backend: {backend}")
+    return MemoryJobStore(
+        jobs,
+        max_live_jobs=max_live_jobs,
+        terminal_ttl=terminal_ttl,
+        archive=JobArchive(archive_path) if archive_path else None,
+    )
@@ -0,0 +1,168 @@
+"""
+GPU node scheduler for simulated AIDP routing.
+
+Keeps a live view of every node in the pool: jobs currently in flight, the
+steps they still have to run, and an EWMA of seconds per diffusion step fed
+by the execution_time workers report in their callbacks. Until a node has
+reported, its speed is estimated from its GPU class.
+
+Policies:
+    random                     uniform choice (the old behaviour)
+    least_loaded               fewest jobs in flight, faster GPU on ties
+    power_of_two               two random nodes, keep the one finishing first
+    weighted                   random, weighted by GPU throughput / (1 + in flight)
+    least_expected_completion  node expected to finish the new job first
+
+A job that asks for a region prefers nodes there; other nodes are only picked
+when they would still finish `region_penalty_seconds` earlier.
+"""
+
+import random
+import threading
+from typing import Dict, List, Optional
+
+# Relative diffusion throughput per GPU class (A100 = 1.0)
+GPU_THROUGHPUT = {
+    "A100": 1.0,
+    "H100": 1.6,
+    "RTX4090": 0.75,
+}
+
+# Seconds per step on a GPU with throughput 1.0, before any node has reported
+BASE_SECONDS_PER_STEP = 0.05
+
+SCHEDULER_POLICIES = (
+    "random",
+    "least_loaded",
+    "power_of_two",
+    "weighted",
+    "least_expected_completion",
+)
+
+
+class NodeScheduler:
+    """Load- and locality-aware node selection with pluggable policies."""
+
+    def __init__(
+        self,
+        nodes: List[Dict],
+        policy: str = "least_expected_completion",
+        ewma_alpha: float = 0.3,
+        region_penalty_seconds: float = 2.0,
+        rng: Optional[random.Random] = None,
+    ):
+        if policy not in SCHEDULER_POLICIES:
+            raise ValueError(f"Unknown scheduler policy {policy!r}, expected one of {SCHEDULER_POLICIES}")
+
+        self.nodes = nodes
+        self.policy = policy
+        self.ewma_alpha = ewma_alpha
+        self.region_penalty_seconds = region_penalty_seconds
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._state = {node["node_id"]: self._initial_state(node) for node in nodes}
+
+    @staticmethod
+    def _initial_state(node: Dict) -> dict:
+        throughput = GPU_THROUGHPUT.get(node.get("gpu"), 1.0)
+        return {
+            "throughput": throughput,
+            "seconds_per_step": BASE_SECONDS_PER_STEP / throughput,
+            "in_flight": 0,
+            "in_flight_steps": 0,
+            "assigned": 0,
+            "completed": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Scoring
+    # ------------------------------------------------------------------
+
+    def expected_completion(self, node: Dict, steps: int, region: Optional[str] = None) -> float:
+        """Seconds until `node` would finish a new job of `steps`, queued behind its in-flight work."""
+        state = self._state[node["node_id"]]
+        seconds = (state["in_flight_steps"] + steps) * state["seconds_per_step"]
+        if region and node.get("region") != region:
+            seconds += self.region_penalty_seconds
+        return seconds
+
+    def _least_loaded(self, candidates: List[Dict]) -> Dict:
+        return min(
+            candidates,
+            key=lambda n: (self._state[n["node_id"]]["in_flight"], -self._state[n["node_id"]]["throughput"]),
+        )
+
+    def _weighted(self, candidates: List[Dict]) -> Dict:
+        weights = [
+            self._state[n["node_id"]]["throughput"] / (1 + self._state[n["node_id"]]["in_flight"])
+            for n in candidates
+        ]
+        return self._rng.choices(candidates, weights=weights)[0]
+
+    def _pick(self, steps: int, region: Optional[str]) -> Dict:
+        candidates = self.nodes
+        if region and self.policy in ("random", "least_loaded", "weighted"):
+            # Policies without a cost model just stay inside the region
+            candidates = [n for n in self.nodes if n.get("region") == region] or self.nodes
+
+        if self.policy == "random":
+            return self._rng.choice(candidates)
+        if self.policy == "least_loaded":
+            return self._least_loaded(candidates)
+        if self.policy == "weighted":
+            return self._weighted(candidates)
+        if self.policy == "power_of_two":
+            candidates = self._rng.sample(candidates, min(2, len(candidates)))
+        return min(candidates, key=lambda n: self.expected_completion(n, steps, region))
+
+    # ------------------------------------------------------------------
+    # Bookkeeping
+    # ------------------------------------------------------------------
+
+    def select(self, steps: int = 30, region: Optional[str] = None) -> Dict:
+        """Pick a node for a job and count it as in flight there until release()."""
+        with self._lock:
+            node = self._pick(steps, region)
+            state = self._state[node["node_id"]]
+            state["in_flight"] += 1
+            state["in_flight_steps"] += steps
+            state["assigned"] += 1
+            return node
+
+    def release(self, node_id: Optional[str], steps: int = 30, execution_time: Optional[float] = None):
+        """
+        A job assigned by select() finished (or failed). A reported
+        execution_time updates the node's seconds-per-step estimate.
+        Unknown node ids (e.g. assigned by the live marketplace) are ignored.
+        """
+        with self._lock:
+            state = self._state.get(node_id)
+            if state is None:
+                return
+
+            state["in_flight"] = max(state["in_flight"] - 1, 0)
+            state["in_flight_steps"] = max(state["in_flight_steps"] - steps, 0)
+            state["completed"] += 1
+
+            if execution_time and steps:
+                observed = execution_time / steps
+                state["seconds_per_step"] += self.ewma_alpha * (observed - state["seconds_per_step"])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "nodes": {
+                    node_id: {
+                        "in_flight": state["in_flight"],
+                        "seconds_per_step": round(state["seconds_per_step"], 4),
+                        "assigned": state["assigned"],
+                        "completed": state["completed"],
+                    }
+                    for node_id, state in self._state.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self._state = {node["node_id"]: self._initial_state(node) for node in self.nodes}
@@ -0,0 +1,139 @@
+"""
+Content-addressed cache of finished images.
+
+Keys are the canonical request hash from generate_request_hash (prompt,
+steps, seed, model, sampler), so a resubmitted request can be completed
+without a GPU run. Images are copied into a cache directory as
+<key><ext> and evicted least-recently-used once the directory grows past
+max_bytes. File mtimes record recency, so LRU order survives restarts.
+"""
+
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Size-bounded on-disk LRU of output images keyed by request hash."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> {"path", "size"}, least recently used first
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._bytes = 0
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+        if os.path.isdir(directory):
+            self._load_index()
+
+    def _load_index(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, os.path.splitext(name)[0], path, stat.st_size))
+
+        for _, key, path, size in sorted(files):
+            self._entries[key] = {"path": path, "size": size}
+            self._bytes += size
+        logger.info(f"Loaded result cache index: {len(self._entries)} images, {self._bytes} bytes")
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Path of the cached image for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not os.path.exists(entry["path"]):
+                self._drop(key)
+                entry = None
+
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+
+        try:
+            os.utime(entry["path"])
+        except OSError:
+            pass
+        return entry["path"]
+
+    def store(self, key: str, source_path: str) -> Optional[str]:
+        """
+        Copy a finished image into the cache. Returns the cached path, or
+        None if the source is not a local file or is larger than the cache.
+        """
+        if not os.path.isfile(source_path):
+            return None
+
+        size = os.path.getsize(source_path)
+        if size > self.max_bytes:
+            return None
+
+        path = os.path.join(self.directory, key + os.path.splitext(source_path)[1])
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]["path"]
+
+            os.makedirs(self.directory, exist_ok=True)
+            shutil.copyfile(source_path, path)
+            self._entries[key] = {"path": path, "size": size}
+            self._bytes += size
+            self.counters["stores"] += 1
+
+            while self._bytes > self.max_bytes and self._entries:
+                self._evict_oldest()
+
+        return path
+
+    def _evict_oldest(self):
+        key = next(iter(self._entries))
+        path = self._entries[key]["path"]
+        self._drop(key)
+        self.counters["evictions"] += 1
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_ratio": round(self.counters["hits"] / lookups, 3) if lookups else None,
+                **self.counters,
+            }
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                try:
+                    os.remove(entry["path"])
+                except OSError:
+                    pass
+            self._entries.clear()
+            self._bytes = 0
+            for key in self.counters:
+                self.counters[key] = 0
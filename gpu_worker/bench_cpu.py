@@ -0,0 +1,66 @@
+"""
+Measure CPU seconds per denoising step for each tuning combination.
+
+Every combination loads a fresh pipeline (weights come from the local
+Hugging Face cache after the first run), warms it up, then times a short and
+a long run; the difference divided by the extra steps is the per-step cost,
+free of text-encoder and VAE overhead.
+
+Run from the gpu_worker directory:
+    python bench_cpu.py --short 2 --long 6
+"""
+
+import argparse
+import itertools
+import time
+
+import torch
+from diffusers import StableDiffusionPipeline
+
+from cpu_tuning import bf16_supported, configure_threads, cpu_autocast, optimize_cpu_pipeline
+from sd_runner import MODEL_ID
+
+
+def time_run(pipe, steps: int, bf16: bool) -> float:
+    start = time.perf_counter()
+    with cpu_autocast(bf16):
+        pipe("a lighthouse on a cliff at dusk", num_inference_steps=steps, output_type="latent")
+    return time.perf_counter() - start
+
+
+def bench(channels_last: bool, bf16: bool, compile_unet: bool, attention_slicing: bool, short: int, long: int) -> float:
+    pipe = StableDiffusionPipeline.from_pretrained(MODEL_ID, torch_dtype=torch.float32)
+    pipe.set_progress_bar_config(disable=True)
+    pipe = optimize_cpu_pipeline(
+        pipe,
+        channels_last=channels_last,
+        attention_slicing=attention_slicing,
+        compile_unet=compile_unet,
+    )
+
+    time_run(pipe, 1, bf16)  # warm-up (and compile)
+    return (time_run(pipe, long, bf16) - time_run(pipe, short, bf16)) / (long - short)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU seconds/step per tuning combination")
+    parser.add_argument("--short", type=int, default=2)
+    parser.add_argument("--long", type=int, default=6)
+    parser.add_argument("--no-compile", action="store_true", help="skip torch.compile combinations")
+    args = parser.parse_args()
+
+    print(f"threads: {configure_threads()}, native bf16: {bf16_supported()}")
+    print(f"{'channels_last':<15}{'bf16':<6}{'compile':<9}{'slicing':<9}{'s/step':>8}")
+
+    bf16_options = [False, True] if bf16_supported() else [False]
+    compile_options = [False] if args.no_compile or not hasattr(torch, "compile") else [False, True]
+
+    for channels_last, bf16, compile_unet, slicing in itertools.product(
+        [False, True], bf16_options, compile_options, [False, True]
+    ):
+        seconds = bench(channels_last, bf16, compile_unet, slicing, args.short, args.long)
+        print(f"{str(channels_last):<15}{str(bf16):<6}{str(compile_unet):<9}{str(slicing):<9}{seconds:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
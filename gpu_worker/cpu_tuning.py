@@ -0,0 +1,116 @@
+"""
+CPU execution mode for workers on boxes without a GPU.
+
+On CPU the pipeline runs in float32 by default with torch's default thread
+pool. This module applies the usual CPU inference tuning:
+
+- explicit intra-/inter-op thread counts and CPU / NUMA node pinning, so a
+  worker does not oversubscribe cores or bounce memory across sockets
+- channels-last memory format for the UNet and VAE convolutions
+- bfloat16 autocast when the CPU has native bf16 (AVX512-BF16 / AMX)
+- attention slicing to bound peak memory on small boxes
+- optional torch.compile of the UNet, paid for once during warm-up
+
+Settings are CPU_* variables in the worker's own environment (the worker
+does not load .env); a supervisor passes its environment on to its workers.
+"""
+
+import contextlib
+import os
+
+import torch
+
+CPU_THREADS = int(os.getenv("CPU_THREADS", "0"))  # 0 = one per pinned core
+CPU_INTEROP_THREADS = int(os.getenv("CPU_INTEROP_THREADS", "0"))  # 0 = torch default
+CPU_AFFINITY = os.getenv("CPU_AFFINITY", "")  # e.g. "0-15,32-47"
+CPU_NUMA_NODE = os.getenv("CPU_NUMA_NODE", "")  # pin to the cores of this node
+CPU_CHANNELS_LAST = os.getenv("CPU_CHANNELS_LAST", "true").lower() == "true"
+CPU_BF16 = os.getenv("CPU_BF16", "auto").lower()  # auto | true | false
+CPU_ATTENTION_SLICING = os.getenv("CPU_ATTENTION_SLICING", "false").lower() == "true"
+CPU_COMPILE = os.getenv("CPU_COMPILE", "false").lower() == "true"
+
+
+def parse_cpu_list(value: str) -> set:
+    """'0-3,8' -> {0, 1, 2, 3, 8} (Linux cpulist format)."""
+    cpus = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def numa_node_cpus(node: str) -> set:
+    with open(f"/sys/devices/system/node/node{node}/cpulist") as f:
+        return parse_cpu_list(f.read())
+
+
+def configure_threads() -> dict:
+    """Pin the process and size torch's thread pools. Returns what was applied."""
+    cpus = set()
+    if CPU_NUMA_NODE:
+        cpus = numa_node_cpus(CPU_NUMA_NODE)
+    elif CPU_AFFINITY:
+        cpus = parse_cpu_list(CPU_AFFINITY)
+
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    threads = CPU_THREADS or len(cpus) or torch.get_num_threads()
+    torch.set_num_threads(threads)
+    if CPU_INTEROP_THREADS:
+        torch.set_num_interop_threads(CPU_INTEROP_THREADS)
+
+    return {"threads": threads, "cpus": sorted(cpus) or None}
+
+
+def bf16_supported() -> bool:
+    """Whether this CPU runs bfloat16 matmuls natively."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        pass
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+        return "avx512_bf16" in flags or "amx_bf16" in flags
+    except OSError:
+        return False
+
+
+def use_bf16(setting: str = CPU_BF16) -> bool:
+    if setting == "auto":
+        return bf16_supported()
+    return setting == "true"
+
+
+def optimize_cpu_pipeline(
+    pipe,
+    channels_last: bool = CPU_CHANNELS_LAST,
+    attention_slicing: bool = CPU_ATTENTION_SLICING,
+    compile_unet: bool = CPU_COMPILE,
+):
+    """Apply CPU-side memory-format, attention and compile options in place."""
+    if channels_last:
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+
+    if attention_slicing:
+        pipe.enable_attention_slicing()
+
+    if compile_unet and hasattr(torch, "compile"):
+        pipe.unet = torch.compile(pipe.unet)
+
+    return pipe
+
+
+def cpu_autocast(enabled: bool):
+    """bfloat16 autocast context for CPU inference, or a no-op."""
+    if not enabled:
+        return contextlib.nullcontext()
+    return torch.autocast("cpu", dtype=torch.bfloat16)
@@ -0,0 +1,95 @@
+"""
+Output image encoding off the diffusion loop.
+
+Jobs choose the output format: PNG with a tunable zlib compression level,
+WebP, or JPEG with a quality setting. PIL's default PNG save (level 6) is a
+noticeable slice of a short job's time, and the result is large to upload.
+Encoding and writing run on a small thread pool (PIL releases the GIL while
+compressing), so the worker can start the next pipeline call right away.
+Each result reports its size in bytes and encode time.
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+OUTPUT_DIR = "outputs"
+ENCODE_THREADS = int(os.getenv("WORKER_ENCODE_THREADS", "2"))
+# Images waiting for or in encoding; submit() blocks beyond this so they cannot pile up in RAM
+ENCODE_MAX_PENDING = int(os.getenv("WORKER_ENCODE_MAX_PENDING", "16"))
+# Used when a job leaves png_compression / output_quality unset
+DEFAULT_PNG_COMPRESSION = int(os.getenv("WORKER_PNG_COMPRESSION", "1"))
+DEFAULT_QUALITY = int(os.getenv("WORKER_OUTPUT_QUALITY", "90"))
+WEBP_METHOD = int(os.getenv("WORKER_WEBP_METHOD", "4"))  # 0 = fastest, 6 = smallest
+
+EXTENSIONS = {"png": ".png", "webp": ".webp", "jpeg": ".jpg"}
+
+
+def save_options(output_format: str, quality: Optional[int] = None, png_compression: Optional[int] = None) -> dict:
+    """PIL Image.save() arguments for an output format."""
+    if output_format == "png":
+        level = DEFAULT_PNG_COMPRESSION if png_compression is None else png_compression
+        return {"format": "PNG", "compress_level": level}
+    if output_format == "webp":
+        return {"format": "WEBP", "quality": quality or DEFAULT_QUALITY, "method": WEBP_METHOD}
+    if output_format == "jpeg":
+        return {"format": "JPEG", "quality": quality or DEFAULT_QUALITY}
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+def encode_image(
+    image,
+    output_format: str = "png",
+    quality: Optional[int] = None,
+    png_compression: Optional[int] = None,
+) -> dict:
+    """Write image to OUTPUT_DIR. Returns {"path", "output_bytes", "encode_ms"}."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(OUTPUT_DIR, f"{uuid.uuid4().hex}{EXTENSIONS[output_format]}")
+
+    start = time.perf_counter()
+    image.save(path, **save_options(output_format, quality, png_compression))
+    encode_ms = (time.perf_counter() - start) * 1000
+
+    return {"path": path, "output_bytes": os.path.getsize(path), "encode_ms": round(encode_ms, 1)}
+
+
+class ImageEncoder:
+    """Thread pool that encodes images and hands each result to a callback."""
+
+    def __init__(self, threads: int = ENCODE_THREADS, max_pending: int = ENCODE_MAX_PENDING):
+        self._pool = ThreadPoolExecutor(max_workers=max(threads, 1), thread_name_prefix="encode")
+        self._slots = threading.Semaphore(max(max_pending, 1))
+
+    def submit(self, image, job_payload: dict, on_done: Callable[[dict, Optional[Exception]], None]) -> Future:
+        """
+        Encode image with the job's output options in the background, then
+        call on_done(result, None), or on_done(None, error) if it failed.
+        """
+        def encode():
+            try:
+                result = encode_image(
+                    image,
+                    job_payload.get("output_format") or "png",
+                    job_payload.get("output_quality"),
+                    job_payload.get("png_compression"),
+                )
+            except Exception as e:
+                on_done(None, e)
+                return
+            finally:
+                self._slots.release()
+            on_done(result, None)
+
+        self._slots.acquire()
+        return self._pool.submit(encode)
+
+    def shutdown(self):
+        """Wait for every queued encode to finish."""
+        self._pool.shutdown(wait=True)
+
+
+IMAGE_ENCODER = ImageEncoder()
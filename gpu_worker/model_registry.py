@@ -0,0 +1,150 @@
+"""
+Resident pipelines for several checkpoints in one worker.
+
+Up to WORKER_MAX_RESIDENT_MODELS pipelines stay on the device, within an
+optional WORKER_MODEL_MEMORY_MB budget. When a job needs a model that does
+not fit, the least recently used pipeline is evicted: on a GPU worker with
+WORKER_MODEL_OFFLOAD=cpu it is parked in CPU RAM (up to
+WORKER_MAX_OFFLOADED_MODELS of them), which is much faster to bring back
+than a reload; otherwise it is dropped and reloaded from disk (the local
+Hugging Face cache) when needed again. Models with a pipeline call in
+progress (including one parked by preemption) are never evicted.
+"""
+
+import contextlib
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, List, Optional
+
+import torch
+
+WORKER_MAX_RESIDENT_MODELS = int(os.getenv("WORKER_MAX_RESIDENT_MODELS", "2"))
+WORKER_MODEL_MEMORY_MB = float(os.getenv("WORKER_MODEL_MEMORY_MB", "0"))  # 0 = count limit only
+WORKER_MODEL_OFFLOAD = os.getenv("WORKER_MODEL_OFFLOAD", "cpu").lower()  # cpu | disk
+WORKER_MAX_OFFLOADED_MODELS = int(os.getenv("WORKER_MAX_OFFLOADED_MODELS", "2"))
+
+
+def pipeline_bytes(pipe) -> int:
+    """Parameter memory of a diffusion pipeline's torch modules."""
+    total = 0
+    for component in pipe.components.values():
+        if isinstance(component, torch.nn.Module):
+            total += sum(p.numel() * p.element_size() for p in component.parameters())
+    return total
+
+
+class ModelRegistry:
+    """LRU set of resident pipelines with CPU-RAM or disk eviction."""
+
+    def __init__(
+        self,
+        loader: Callable[[str], object],
+        device: str,
+        max_resident: int = WORKER_MAX_RESIDENT_MODELS,
+        memory_budget_mb: float = WORKER_MODEL_MEMORY_MB,
+        offload: str = WORKER_MODEL_OFFLOAD,
+        max_offloaded: int = WORKER_MAX_OFFLOADED_MODELS,
+        on_evict: Optional[Callable[[str, bool], None]] = None,
+    ):
+        self.loader = loader
+        self.device = device
+        self.max_resident = max(max_resident, 1)
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        # Parking in CPU RAM only helps when the pipelines run elsewhere
+        self.offload_to_cpu = offload == "cpu" and device != "cpu"
+        self.max_offloaded = max_offloaded
+        self.on_evict = on_evict
+
+        self._lock = threading.Lock()
+        # model_id -> {"pipe", "bytes"}, least recently used first
+        self._resident = OrderedDict()
+        self._offloaded = OrderedDict()
+        # model_id -> pipeline calls in progress
+        self._pinned = Counter()
+        self.counters = {"hits": 0, "restores": 0, "loads": 0, "evictions": 0}
+        # model_id -> milliseconds the latest get() took to make it resident (0 when it was)
+        self.last_load_ms = {}
+
+    def get(self, model_id: str):
+        """Pipeline for model_id on the device, loading or restoring it if needed."""
+        with self._lock:
+            entry = self._resident.get(model_id)
+            if entry is not None:
+                self._resident.move_to_end(model_id)
+                self.counters["hits"] += 1
+                self.last_load_ms[model_id] = 0.0
+                return entry["pipe"]
+
+            start = time.perf_counter()
+            entry = self._offloaded.pop(model_id, None)
+            if entry is not None:
+                self.counters["restores"] += 1
+            else:
+                pipe = self.loader(model_id)
+                entry = {"pipe": pipe, "bytes": pipeline_bytes(pipe)}
+                self.counters["loads"] += 1
+
+            self._make_room(entry["bytes"])
+            entry["pipe"] = entry["pipe"].to(self.device)
+            self._resident[model_id] = entry
+            self.last_load_ms[model_id] = round((time.perf_counter() - start) * 1000, 1)
+            return entry["pipe"]
+
+    @contextlib.contextmanager
+    def in_use(self, model_id: str):
+        """get(model_id) for the duration of a pipeline call, safe from eviction."""
+        pipe = self.get(model_id)
+        with self._lock:
+            self._pinned[model_id] += 1
+        try:
+            yield pipe
+        finally:
+            with self._lock:
+                self._pinned[model_id] -= 1
+                if not self._pinned[model_id]:
+                    del self._pinned[model_id]
+
+    def _resident_bytes(self) -> int:
+        return sum(entry["bytes"] for entry in self._resident.values())
+
+    def _make_room(self, incoming_bytes: int):
+        while self._resident and (
+            len(self._resident) >= self.max_resident
+            or (self.memory_budget and self._resident_bytes() + incoming_bytes > self.memory_budget)
+        ):
+            # Least recently used model that is not running; if all are, go over the limit
+            model_id = next((m for m in self._resident if m not in self._pinned), None)
+            if model_id is None:
+                break
+            entry = self._resident.pop(model_id)
+            self.counters["evictions"] += 1
+
+            dropped = not self.offload_to_cpu
+            if not dropped:
+                entry["pipe"] = entry["pipe"].to("cpu")
+                self._offloaded[model_id] = entry
+                while len(self._offloaded) > self.max_offloaded:
+                    dropped_id, _ = self._offloaded.popitem(last=False)
+                    if self.on_evict:
+                        self.on_evict(dropped_id, True)
+
+            if self.on_evict:
+                self.on_evict(model_id, dropped)
+
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+
+    def resident_models(self) -> List[str]:
+        with self._lock:
+            return list(self._resident)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "resident": list(self._resident),
+                "offloaded": list(self._offloaded),
+                "resident_mb": round(self._resident_bytes() / (1024 * 1024), 1),
+                **self.counters,
+            }
@@ -0,0 +1,227 @@
+"""
+Persistent outbox for job results.
+
+A finished job's callback is written to disk before anything is sent, then a
+background thread delivers it to the router. Callbacks that finish close
+together go out as one POST /jobs/callbacks request. Failed deliveries are
+retried with exponential backoff, and anything still undelivered when the
+worker dies is sent by the next worker started with the same outbox
+directory. The diffusion loop never waits on the router.
+
+Entries may carry the path of the job's output image. It is streamed to
+PUT /jobs/{id}/output before the callback goes out, and the callback then
+reports the router's output URL instead of a path on this machine.
+"""
+
+import json
+import mimetypes
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Callable, List, Optional
+
+import requests
+
+OUTBOX_DIR = os.getenv("WORKER_OUTBOX_DIR", "./data/worker_outbox")
+OUTBOX_BATCH_SIZE = int(os.getenv("WORKER_OUTBOX_BATCH_SIZE", "32"))
+OUTBOX_BATCH_WINDOW_MS = float(os.getenv("WORKER_OUTBOX_BATCH_WINDOW_MS", "20"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("WORKER_OUTBOX_RETRY_BASE_SECONDS", "0.5"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("WORKER_OUTBOX_RETRY_MAX_SECONDS", "60"))
+# Remove local images once the router has them
+OUTBOX_DELETE_UPLOADED = os.getenv("WORKER_DELETE_UPLOADED_OUTPUTS", "true").lower() == "true"
+
+# Per-item router answers after which a callback is done with
+DELIVERED_STATUSES = {"acknowledged", "duplicate", "not_found", "cancelled", "finished"}
+
+
+class CallbackOutbox(threading.Thread):
+    """Disk-backed queue of callbacks delivered in batches by a daemon thread."""
+
+    def __init__(
+        self,
+        api_base_url: str,
+        directory: str = OUTBOX_DIR,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        batch_window_ms: float = OUTBOX_BATCH_WINDOW_MS,
+        on_delivered: Optional[Callable[[str], None]] = None,
+    ):
+        super().__init__(daemon=True)
+        self.api_base_url = api_base_url
+        self.url = f"{api_base_url}/jobs/callbacks"
+        self.directory = directory
+        self.batch_size = max(batch_size, 1)
+        self.batch_window = batch_window_ms / 1000
+        self.on_delivered = on_delivered
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        # entry_id -> {"job_id", "payload", "upload"?}, oldest first
+        self._pending = {}
+        self._failures = 0
+        self._retry_at = 0.0
+        self.counters = {"delivered": 0, "uploaded": 0, "requests": 0, "retries": 0}
+
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    def _path(self, entry_id: str) -> str:
+        return os.path.join(self.directory, f"{entry_id}.json")
+
+    def _recover(self):
+        """Reload callbacks a previous worker persisted but never delivered."""
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    self._pending[name[:-5]] = json.load(f)
+            except (OSError, ValueError):
+                os.remove(os.path.join(self.directory, name))
+        if self._pending:
+            print(f"[outbox] recovered {len(self._pending)} undelivered callbacks")
+            self._wakeup.set()
+
+    def _write(self, entry_id: str, entry: dict):
+        tmp_path = self._path(entry_id) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._path(entry_id))
+
+    def _remove(self, entry_id: str):
+        with self._lock:
+            self._pending.pop(entry_id, None)
+        try:
+            os.remove(self._path(entry_id))
+        except FileNotFoundError:
+            pass
+
+    def put(self, job_id: str, payload: dict, upload: Optional[str] = None):
+        """
+        Persist a callback and hand it to the delivery thread. With upload,
+        the image at that path is sent to the router first.
+        """
+        # Time-ordered ids keep recovery in completion order
+        entry_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        entry = {"job_id": job_id, "payload": payload}
+        if upload:
+            entry["upload"] = upload
+        self._write(entry_id, entry)
+
+        with self._lock:
+            self._pending[entry_id] = entry
+        self._wakeup.set()
+
+    def pending_job_ids(self) -> List[str]:
+        with self._lock:
+            return [entry["job_id"] for entry in self._pending.values()]
+
+    def run(self):
+        while not self._stopped.is_set():
+            backoff = self._retry_at - time.time()
+            self._wakeup.wait(backoff if backoff > 0 else None)
+            if self._stopped.is_set():
+                return
+            if time.time() < self._retry_at:
+                # New callbacks wait for the retry too
+                self._wakeup.clear()
+                continue
+
+            # Let callbacks of the rest of a batch catch up
+            time.sleep(self.batch_window)
+            self._wakeup.clear()
+            self._deliver_batch()
+
+    def _deliver_batch(self):
+        with self._lock:
+            batch = list(self._pending.items())[: self.batch_size]
+        if not batch:
+            return
+
+        try:
+            for entry_id, entry in batch:
+                if "upload" in entry:
+                    self._upload(entry_id, entry)
+            batch = [(entry_id, entry) for entry_id, entry in batch if entry_id in self._pending]
+            if not batch:
+                return
+
+            self.counters["requests"] += 1
+            response = requests.post(
+                self.url,
+                json=[{"job_id": entry["job_id"], **entry["payload"]} for _, entry in batch],
+                timeout=10,
+            )
+            response.raise_for_status()
+            results = response.json()["results"]
+        except (requests.RequestException, OSError, ValueError, KeyError) as e:
+            self._failures += 1
+            self.counters["retries"] += 1
+            delay = min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (self._failures - 1), OUTBOX_RETRY_MAX_SECONDS)
+            self._retry_at = time.time() + delay * random.uniform(0.5, 1.0)
+            print(f"[outbox] delivering {len(batch)} callbacks failed ({e}), retrying in {delay:.1f}s")
+            return
+
+        self._failures = 0
+        self._retry_at = 0.0
+        for (entry_id, entry), result in zip(batch, results):
+            if result.get("status") not in DELIVERED_STATUSES:
+                continue
+            self._remove(entry_id)
+            self.counters["delivered"] += 1
+            if self.on_delivered:
+                self.on_delivered(entry["job_id"])
+
+        with self._lock:
+            if self._pending:
+                self._wakeup.set()
+
+    def _upload(self, entry_id: str, entry: dict):
+        """Stream an entry's image to the router and point its callback at the upload."""
+        path = entry["upload"]
+        if not os.path.exists(path):
+            # Nothing left to send (e.g. removed after an upload whose entry was not rewritten)
+            del entry["upload"]
+            return
+
+        with open(path, "rb") as f:
+            response = requests.put(
+                f"{self.api_base_url}/jobs/{entry['job_id']}/output",
+                data=f,
+                headers={"Content-Type": mimetypes.guess_type(path)[0] or "application/octet-stream"},
+                timeout=60,
+            )
+        if response.status_code == 404:
+            # The router no longer knows the job; nothing to deliver
+            self._remove(entry_id)
+            if self.on_delivered:
+                self.on_delivered(entry["job_id"])
+            return
+        response.raise_for_status()
+
+        entry["payload"]["output_url"] = response.json()["output_url"]
+        del entry["upload"]
+        self._write(entry_id, entry)
+        self.counters["uploaded"] += 1
+        if OUTBOX_DELETE_UPLOADED:
+            os.remove(path)
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Wait until everything is delivered. Returns False on timeout."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._lock:
+                if not self._pending:
+                    return True
+            self._wakeup.set()
+            time.sleep(0.05)
+        return False
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"pending": len(self._pending), **self.counters}
@@ -0,0 +1,190 @@
+"""
+Per-step progress and latent previews of running jobs.
+
+The diffusion step callback records each job's step and step timing, and
+every WORKER_PREVIEW_EVERY_STEPS steps (for jobs that asked for previews)
+a copy of its latents. A background thread sends the latest of these to the
+router: step updates for all jobs in one POST /jobs/progress request, and
+previews as small JPEGs to PUT /jobs/{id}/preview. Reports are throttled to
+one round per WORKER_PROGRESS_INTERVAL_MS, and only the newest state of a
+job is sent. Progress is best effort: failed sends are dropped, not retried.
+
+Previews are not VAE decodes. The four SD latent channels are mapped to RGB
+with a fixed linear approximation, which costs next to nothing and is close
+enough to show composition and colours as they form.
+"""
+
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+import torch
+from PIL import Image
+
+PROGRESS_INTERVAL_MS = float(os.getenv("WORKER_PROGRESS_INTERVAL_MS", "250"))
+PREVIEW_EVERY_STEPS = int(os.getenv("WORKER_PREVIEW_EVERY_STEPS", "5"))  # 0 = no previews
+PREVIEW_SIZE = int(os.getenv("WORKER_PREVIEW_SIZE", "128"))
+PREVIEW_QUALITY = 70
+# Finished job ids remembered for is-it-still-wanted checks; far more than a
+# worker has in flight, so only ids of long-gone jobs are forgotten
+FINISHED_MEMORY = 1024
+
+# Latent channel -> RGB contribution for Stable Diffusion 1.x latents
+LATENT_RGB_FACTORS = torch.tensor([
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+])
+
+
+def latents_to_rgb(latent) -> Image.Image:
+    """Approximate image of one (4, h, w) latent, scaled to PREVIEW_SIZE on its long side."""
+    rgb = torch.einsum("chw,cr->hwr", latent.float().cpu(), LATENT_RGB_FACTORS)
+    pixels = ((rgb + 1) / 2).clamp(0, 1).mul(255).byte().numpy()
+    image = Image.fromarray(pixels)
+
+    scale = PREVIEW_SIZE / max(image.size)
+    return image.resize((round(image.width * scale), round(image.height * scale)), Image.BILINEAR)
+
+
+def encode_preview(latent) -> bytes:
+    buffer = io.BytesIO()
+    latents_to_rgb(latent).save(buffer, format="JPEG", quality=PREVIEW_QUALITY)
+    return buffer.getvalue()
+
+
+class ProgressReporter(threading.Thread):
+    """Daemon thread that sends the latest step progress and previews to the router."""
+
+    def __init__(self, api_base_url: str, interval_ms: float = PROGRESS_INTERVAL_MS):
+        super().__init__(daemon=True)
+        self.api_base_url = api_base_url
+        self.interval = interval_ms / 1000
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        # job_id -> latest update / (step, latent), replaced until sent
+        self._updates = {}
+        self._previews = {}
+        # Jobs the router has finished with (e.g. failed elsewhere), oldest
+        # first; bounded so a long-running worker does not accumulate them
+        self.finished: "OrderedDict[str, None]" = OrderedDict()
+        self.counters = {"updates": 0, "previews": 0, "errors": 0}
+
+    def report(self, job_id: str, update: dict):
+        with self._lock:
+            self._updates[job_id] = update
+        self._wakeup.set()
+
+    def preview(self, job_id: str, step: int, latent):
+        with self._lock:
+            self._previews[job_id] = (step, latent)
+        self._wakeup.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait()
+            if self._stopped.is_set():
+                return
+            # At most one round per interval; later steps replace earlier ones meanwhile
+            time.sleep(self.interval)
+            self._wakeup.clear()
+            self._send()
+
+    def _send(self):
+        with self._lock:
+            updates, self._updates = self._updates, {}
+            previews, self._previews = self._previews, {}
+
+        try:
+            if updates:
+                response = requests.post(
+                    f"{self.api_base_url}/jobs/progress",
+                    json=[{"job_id": job_id, **update} for job_id, update in updates.items()],
+                    timeout=5,
+                )
+                response.raise_for_status()
+                self.counters["updates"] += len(updates)
+                for result in response.json()["results"]:
+                    if result.get("status") in ("finished", "not_found"):
+                        self._mark_finished(result["job_id"])
+
+            for job_id, (step, latent) in previews.items():
+                requests.put(
+                    f"{self.api_base_url}/jobs/{job_id}/preview",
+                    params={"step": step},
+                    data=encode_preview(latent),
+                    headers={"Content-Type": "image/jpeg"},
+                    timeout=5,
+                ).raise_for_status()
+                self.counters["previews"] += 1
+        except (requests.RequestException, ValueError, KeyError) as e:
+            self.counters["errors"] += 1
+            print(f"[progress] report failed: {e}")
+
+    def _mark_finished(self, job_id: str):
+        self.finished[job_id] = None
+        self.finished.move_to_end(job_id)
+        while len(self.finished) > FINISHED_MEMORY:
+            self.finished.popitem(last=False)
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        return dict(self.counters)
+
+
+class BatchProgress:
+    """
+    Step callback that reports a batch's progress for each of its jobs and
+    keeps per-step timings. Time spent outside the batch's own steps (see
+    resume()) is not counted.
+    """
+
+    def __init__(self, reporter: ProgressReporter, job_payloads: list, total_steps: int):
+        self.reporter = reporter
+        self.job_ids = [job_payload["job_id"] for job_payload in job_payloads]
+        # Batch rows of the jobs that asked for previews
+        self.preview_rows = [i for i, job_payload in enumerate(job_payloads) if job_payload.get("previews")]
+        self.total_steps = total_steps
+        self.steps = 0
+        self.step_seconds = 0.0
+        self.last_step_at = time.perf_counter()
+
+    @property
+    def avg_step_ms(self):
+        return round(self.step_seconds / self.steps * 1000, 1) if self.steps else None
+
+    def __call__(self, steps_done: int, latents=None):
+        now = time.perf_counter()
+        step_ms = (now - self.last_step_at) * 1000
+        self.step_seconds += now - self.last_step_at
+        self.steps = steps_done
+
+        update = {
+            # Some schedulers run a step more than requested
+            "step": min(steps_done, self.total_steps),
+            "total_steps": self.total_steps,
+            "step_ms": round(step_ms, 1),
+            "avg_step_ms": self.avg_step_ms,
+        }
+        for job_id in self.job_ids:
+            self.reporter.report(job_id, update)
+
+        if latents is not None and self.preview_rows and PREVIEW_EVERY_STEPS and steps_done % PREVIEW_EVERY_STEPS == 0:
+            for row in self.preview_rows:
+                # Copied now, encoded on the reporter thread
+                self.reporter.preview(self.job_ids[row], steps_done, latents[row].detach().float().cpu())
+
+        self.last_step_at = time.perf_counter()
+
+    def resume(self):
+        """Restart the step clock after time spent on other work (preemption)."""
+        self.last_step_at = time.perf_counter()
@@ -0,0 +1,75 @@
+"""
+LRU cache of CLIP text-encoder outputs.
+
+Every pipeline call would otherwise re-run the tokenizer and text encoder for
+each prompt, and again for the unconditional ("" or negative) prompt used by
+classifier-free guidance. Prompts and especially negative prompts repeat a
+lot, so embeddings are cached per (model, text) and handed to the pipeline
+as prompt_embeds / negative_prompt_embeds.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+PROMPT_CACHE_MB = float(os.getenv("WORKER_PROMPT_CACHE_MB", "256"))
+
+
+def tensor_bytes(tensor) -> int:
+    return tensor.element_size() * tensor.nelement()
+
+
+class PromptEmbeddingCache:
+    """Size-bounded LRU of prompt embedding tensors keyed by (model_id, text)."""
+
+    def __init__(self, max_mb: float = PROMPT_CACHE_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_encode(self, model_id: str, text: str, encode):
+        """Embedding for text, computed with encode(text) on a miss."""
+        key = (model_id, text)
+        with self._lock:
+            embeds = self._entries.get(key)
+            if embeds is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embeds
+            self.misses += 1
+
+        embeds = encode(text)
+        size = tensor_bytes(embeds)
+
+        with self._lock:
+            if size <= self.max_bytes and key not in self._entries:
+                self._entries[key] = embeds
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= tensor_bytes(evicted)
+        return embeds
+
+    def drop_model(self, model_id: str):
+        """Forget embeddings of a model that is no longer resident."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == model_id]:
+                self._bytes -= tensor_bytes(self._entries.pop(key))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_mb": round(self._bytes / (1024 * 1024), 2),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+PROMPT_CACHE = PromptEmbeddingCache()
@@ -1,31 +1,254 @@
 import torch
-from diffusers import StableDiffusionPipeline
-import uuid
+from diffusers import (
+    StableDiffusionPipeline,
+    DDIMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    EulerDiscreteScheduler,
+    UniPCMultistepScheduler,
+)
+import copy
+import inspect
 import os
+import random
+from cpu_tuning import configure_threads, cpu_autocast, optimize_cpu_pipeline, use_bf16
+from image_encoder import encode_image
+from model_registry import ModelRegistry
+from prompt_cache import PROMPT_CACHE
 
-MODEL_ID = "runwayml/stable-diffusion-v1-5"
-OUTPUT_DIR = "outputs"
+# Default checkpoint, same setting as the router's Settings.model_id
+MODEL_ID = os.getenv("MODEL_ID", "runwayml/stable-diffusion-v1-5")
 
+# Resident pipelines, one per checkpoint; see model_registry.py
+_REGISTRY = None
+# bfloat16 autocast around pipeline calls (CPU mode on bf16-capable CPUs)
+_AUTOCAST_BF16 = False
 
-def run_stable_diffusion(prompt: str, steps: int = 30) -> str:
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Samplers selectable per job (api.models.job.Sampler), built from the
+# model's own scheduler config. "default" is the scheduler the model ships with.
+SAMPLER_CLASSES = {
+    "ddim": (DDIMScheduler, {}),
+    "euler": (EulerDiscreteScheduler, {}),
+    "euler_a": (EulerAncestralDiscreteScheduler, {}),
+    "dpm_solver_pp": (DPMSolverMultistepScheduler, {"algorithm_type": "dpmsolver++"}),
+    "unipc": (UniPCMultistepScheduler, {}),
+}
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+# Pre-instantiated schedulers per model, swapped onto its pipeline per batch
+_SCHEDULERS = {}
+# Pipeline calls in progress per model. A call made from inside another's
+# step callback (preemption) gets its own scheduler copy, so the parked
+# call's scheduler state is intact when it resumes.
+_RUNNING = {}
+# Denoising steps of the most recent completed call per model
+_LAST_STEPS = {}
+
+
+def get_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def _load_checkpoint(model_id: str) -> StableDiffusionPipeline:
+    global _AUTOCAST_BF16
+
+    device = get_device()
 
     pipe = StableDiffusionPipeline.from_pretrained(
-        MODEL_ID,
+        model_id,
         torch_dtype=torch.float16 if device == "cuda" else torch.float32,
     )
 
-    pipe = pipe.to(device)
+    if device == "cpu":
+        # Overflow capacity is CPU-only boxes; see cpu_tuning.py
+        pipe = optimize_cpu_pipeline(pipe)
+        _AUTOCAST_BF16 = use_bf16()
+
+    _SCHEDULERS[model_id] = build_schedulers(pipe)
+    return pipe
+
+
+def _on_evict(model_id: str, dropped: bool):
+    # Cached embeddings live on the device the model just left
+    PROMPT_CACHE.drop_model(model_id)
+    if dropped:
+        _SCHEDULERS.pop(model_id, None)
+
+
+def get_registry() -> ModelRegistry:
+    global _REGISTRY
+
+    if _REGISTRY is None:
+        device = get_device()
+        if device == "cpu":
+            print(f"CPU mode: {configure_threads()}")
+        _REGISTRY = ModelRegistry(_load_checkpoint, device, on_evict=_on_evict)
+
+    return _REGISTRY
+
+
+def load_pipeline(model_id: str = None) -> StableDiffusionPipeline:
+    """Pipeline for model_id (default MODEL_ID) on the device, kept resident between jobs."""
+    return get_registry().get(model_id or MODEL_ID)
+
+
+def warm_models() -> list:
+    """Models this worker can run without loading weights."""
+    return get_registry().resident_models()
+
+
+def build_schedulers(pipe) -> dict:
+    schedulers = {"default": pipe.scheduler}
+    for name, (scheduler_class, options) in SAMPLER_CLASSES.items():
+        schedulers[name] = scheduler_class.from_config(pipe.scheduler.config, **options)
+    return schedulers
+
+
+def use_sampler(pipe, model_id: str, sampler: str = "default", private: bool = False):
+    """
+    Swap a pre-built scheduler onto the pipeline; the weights stay where
+    they are. With private, a copy is used and the shared one is left alone.
+    """
+    schedulers = _SCHEDULERS[model_id]
+    scheduler = schedulers.get(sampler) or schedulers["default"]
+    pipe.scheduler = copy.deepcopy(scheduler) if private else scheduler
+
+
+def last_steps_run(model_id: str = None) -> int:
+    """Denoising steps (UNet evaluations) of the most recent call on model_id."""
+    return _LAST_STEPS.get(model_id or MODEL_ID, 0)
+
+
+def last_load_ms(model_id: str = None) -> float:
+    """Milliseconds the most recent call on model_id spent loading or restoring it."""
+    return get_registry().last_load_ms.get(model_id or MODEL_ID, 0.0)
+
+
+def step_callback(pipe, on_step) -> dict:
+    """
+    Pipeline call arguments that invoke on_step(steps_done, latents) after
+    every denoising step, for both the legacy (callback) and current
+    (callback_on_step_end) diffusers APIs.
+    """
+    if on_step is None:
+        return {}
+
+    if "callback_on_step_end" in inspect.signature(pipe.__call__).parameters:
+        def on_step_end(pipeline, step, timestep, callback_kwargs):
+            on_step(step + 1, callback_kwargs["latents"])
+            return callback_kwargs
+        return {"callback_on_step_end": on_step_end}
+
+    return {"callback": lambda step, timestep, latents: on_step(step + 1, latents), "callback_steps": 1}
+
+
+def warm_up_pipeline():
+    """
+    Run a single-step denoise so kernels and allocator pools are ready before
+    the first job (and, with CPU_COMPILE, so the compiled UNet is built).
+    """
+    pipe = load_pipeline()
+    with cpu_autocast(_AUTOCAST_BF16):
+        pipe("", num_inference_steps=1, output_type="latent")
+
+
+def make_generators(seeds: list):
+    """One torch.Generator per image; None seeds get a fresh random one."""
+    if not seeds or all(seed is None for seed in seeds):
+        return None
+
+    device = get_device()
+    return [
+        torch.Generator(device=device).manual_seed(seed if seed is not None else random.randrange(2**32))
+        for seed in seeds
+    ]
+
+
+def encode_prompt(pipe, model_id: str, text: str):
+    """CLIP text-encoder output for one prompt, served from PROMPT_CACHE when possible."""
+    def encode(value):
+        with torch.no_grad():
+            prompt_embeds, _ = pipe.encode_prompt(value, pipe.device, 1, False)
+        return prompt_embeds
+
+    return PROMPT_CACHE.get_or_encode(model_id, text, encode)
+
+
+def render_batch(
+    prompts: list,
+    steps: int = 30,
+    seeds: list = None,
+    negative_prompts: list = None,
+    sampler: str = "default",
+    model_id: str = None,
+    on_step=None,
+) -> list:
+    """
+    Render several prompts in one batched pipeline call on model_id
+    (default MODEL_ID).
+
+    on_step(steps_done, latents) runs after every denoising step. It may run another
+    render_batch() (preemption): the latents of this call wait in its frame
+    and denoising resumes where it stopped once the inner call returns.
+
+    All prompts share the same step count; `seeds` (one per prompt, may
+    contain None) makes the output reproducible. Prompt and negative prompt
+    embeddings come from the embedding cache, so the text encoder only runs
+    for text it has not seen. Returns one PIL image per prompt, in order,
+    not yet encoded (see image_encoder.py).
+    """
+    model_id = model_id or MODEL_ID
+    negative_prompts = negative_prompts or [None] * len(prompts)
+
+    with get_registry().in_use(model_id) as pipe:
+        parked_scheduler = pipe.scheduler
+        nested = _RUNNING.get(model_id, 0) > 0
+        use_sampler(pipe, model_id, sampler, private=nested)
+        _RUNNING[model_id] = _RUNNING.get(model_id, 0) + 1
+        try:
+            images = _denoise(pipe, model_id, prompts, negative_prompts, steps, seeds, on_step)
+            _LAST_STEPS[model_id] = len(pipe.scheduler.timesteps)
+        finally:
+            _RUNNING[model_id] -= 1
+            if nested:
+                # Hand the parked call its own scheduler back
+                pipe.scheduler = parked_scheduler
+
+    return images
+
+
+def _denoise(pipe, model_id: str, prompts: list, negative_prompts: list, steps: int, seeds: list, on_step) -> list:
+    with cpu_autocast(_AUTOCAST_BF16):
+        return pipe(
+            prompt_embeds=torch.cat([encode_prompt(pipe, model_id, prompt) for prompt in prompts]),
+            # The unconditional embedding for classifier-free guidance is the empty prompt
+            negative_prompt_embeds=torch.cat([
+                encode_prompt(pipe, model_id, negative or "") for negative in negative_prompts
+            ]),
+            num_inference_steps=steps,
+            generator=make_generators(seeds),
+            **step_callback(pipe, on_step),
+        ).images
+
 
-    image = pipe(
-        prompt,
-        num_inference_steps=steps,
-    ).images[0]
+def run_stable_diffusion_batch(
+    prompts: list,
+    steps: int = 30,
+    seeds: list = None,
+    negative_prompts: list = None,
+    sampler: str = "default",
+    model_id: str = None,
+) -> list:
+    """render_batch() saved as default-format files. Returns one output path per prompt."""
+    images = render_batch(prompts, steps, seeds, negative_prompts, sampler, model_id)
+    return [encode_image(image)["path"] for image in images]
 
-    filename = f"{uuid.uuid4().hex}.png"
-    output_path = os.path.join(OUTPUT_DIR, filename)
-    image.save(output_path)
 
-    return output_path
+def run_stable_diffusion(
+    prompt: str,
+    steps: int = 30,
+    seed: int = None,
+    negative_prompt: str = None,
+    sampler: str = "default",
+    model_id: str = None,
+) -> str:
+    return run_stable_diffusion_batch([prompt], steps, [seed], [negative_prompt], sampler, model_id)[0]
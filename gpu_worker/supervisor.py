@@ -0,0 +1,230 @@
+"""
+Supervisor for a pool of resident workers on one box.
+
+Runs one `worker.py --resident` process per slot: a GPU (pinned with
+CUDA_VISIBLE_DEVICES) or, on CPU-only boxes, a NUMA node / socket (pinned
+with CPU_NUMA_NODE). Crashed workers are restarted with exponential backoff.
+The pool is scaled between SUPERVISOR_MIN_WORKERS and SUPERVISOR_MAX_WORKERS
+from the router's queue depth and recent queue wait (GET /system/stats);
+workers retired by a scale-down finish their current batch first. Health,
+utilization and restart counts of each worker are visible on the router at
+GET /workers.
+
+    python gpu_worker/supervisor.py
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import requests
+
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+SUPERVISOR_INTERVAL = float(os.getenv("SUPERVISOR_INTERVAL", "5"))
+SUPERVISOR_MIN_WORKERS = int(os.getenv("SUPERVISOR_MIN_WORKERS", "1"))
+SUPERVISOR_MAX_WORKERS = int(os.getenv("SUPERVISOR_MAX_WORKERS", "0"))  # 0 = one per slot
+# Scale up when more jobs than this wait per running worker, or jobs wait longer than the target
+SUPERVISOR_BACKLOG_PER_WORKER = float(os.getenv("SUPERVISOR_BACKLOG_PER_WORKER", "8"))
+SUPERVISOR_TARGET_WAIT_SECONDS = float(os.getenv("SUPERVISOR_TARGET_WAIT_SECONDS", "10"))
+# Scale down after the queue has been empty this long
+SUPERVISOR_IDLE_SECONDS = float(os.getenv("SUPERVISOR_IDLE_SECONDS", "120"))
+SUPERVISOR_COOLDOWN_SECONDS = float(os.getenv("SUPERVISOR_COOLDOWN_SECONDS", "30"))
+SUPERVISOR_DEVICES = os.getenv("SUPERVISOR_DEVICES", "")  # e.g. "0,1,2,3"; empty = detect
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+MAX_RESTART_BACKOFF = 60.0
+# A worker up this long is healthy again: its next crash restarts it without delay
+RESTART_BACKOFF_RESET_SECONDS = 300.0
+
+
+def detect_slots() -> list:
+    """[(kind, index)] for every GPU, else every NUMA node, else one CPU slot."""
+    if SUPERVISOR_DEVICES:
+        return [("cuda", device.strip()) for device in SUPERVISOR_DEVICES.split(",") if device.strip()]
+
+    try:
+        output = subprocess.run(
+            ["nvidia-smi", "--query-gpu=index", "--format=csv,noheader"],
+            capture_output=True, text=True, timeout=10,
+        ).stdout
+        gpus = [line.strip() for line in output.splitlines() if line.strip()]
+        if gpus:
+            return [("cuda", gpu) for gpu in gpus]
+    except (OSError, subprocess.SubprocessError):
+        pass
+
+    try:
+        nodes = sorted(
+            name[4:] for name in os.listdir("/sys/devices/system/node")
+            if name.startswith("node") and name[4:].isdigit()
+        )
+        if nodes:
+            return [("cpu", node) for node in nodes]
+    except OSError:
+        pass
+
+    return [("cpu", None)]
+
+
+class WorkerSlot:
+    """One device or socket and the worker process bound to it."""
+
+    def __init__(self, hostname: str, kind: str, index):
+        self.kind = kind
+        self.index = index
+        self.name = f"{kind}{index if index is not None else ''}"
+        self.worker_id = f"{hostname}-{self.name}"
+        self.process = None
+        # Retired process still handing its leases back
+        self.exiting = None
+        self.wanted = False
+        self.restarts = 0
+        # Crashes since the worker was last healthy, for the backoff
+        self.crashes = 0
+        self.started_at = 0.0
+        self.next_start = 0.0
+
+    def env(self) -> dict:
+        env = os.environ.copy()
+        env["WORKER_ID"] = self.worker_id
+        env["WORKER_SLOT"] = self.name
+        env["WORKER_RESTARTS"] = str(self.restarts)
+        if self.kind == "cuda":
+            env["CUDA_VISIBLE_DEVICES"] = self.index
+        elif self.index is not None:
+            env["CUDA_VISIBLE_DEVICES"] = ""
+            env.setdefault("CPU_NUMA_NODE", self.index)
+        return env
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, WORKER_SCRIPT, "--resident"], env=self.env())
+        self.started_at = time.time()
+        print(f"[supervisor] started {self.worker_id} (pid {self.process.pid}, restarts {self.restarts})")
+
+    def stop(self, drain: bool = True):
+        """
+        Retire the worker. Draining (SIGTERM) lets it finish and deliver its
+        current batch first; otherwise it is interrupted (SIGINT) and hands
+        its leases back unfinished.
+        """
+        if self.running:
+            self.process.send_signal(signal.SIGTERM if drain else signal.SIGINT)
+        if self.process is not None:
+            # Retired, not crashed: check() will not count it as a restart
+            self.exiting, self.process = self.process, None
+
+    def check(self, now: float):
+        """Restart the worker if it died while wanted, with backoff."""
+        if self.running:
+            if self.crashes and now - self.started_at > RESTART_BACKOFF_RESET_SECONDS:
+                self.crashes = 0
+            return
+        if not self.wanted:
+            return
+        if self.exiting is not None:
+            if self.exiting.poll() is None:
+                return  # wanted again; start once the retired process is gone
+            self.exiting = None
+
+        if self.process is not None:
+            code = self.process.returncode
+            self.process = None
+            self.restarts += 1
+            self.crashes += 1
+            self.next_start = now + min(2 ** self.crashes, MAX_RESTART_BACKOFF)
+            print(f"[supervisor] {self.worker_id} exited with {code}, restarting in {self.next_start - now:.0f}s")
+
+        if now >= self.next_start:
+            self.start()
+
+
+def fetch_queue_stats() -> dict:
+    response = requests.get(f"{API_BASE_URL}/system/stats", timeout=10)
+    response.raise_for_status()
+    return response.json()["queue"]
+
+
+def desired_workers(current: int, queue: dict, idle_since: float, now: float, min_workers: int, max_workers: int) -> int:
+    """Pool size for the next interval, one step at a time."""
+    ready = queue.get("ready", 0)
+    wait = queue.get("wait_p95_seconds") or 0.0
+
+    # Slow recent waits only call for more workers while jobs are still waiting
+    if current < max_workers and ready and (
+        ready > SUPERVISOR_BACKLOG_PER_WORKER * max(current, 1) or wait > SUPERVISOR_TARGET_WAIT_SECONDS
+    ):
+        return current + 1
+    if current > min_workers and ready == 0 and now - idle_since > SUPERVISOR_IDLE_SECONDS:
+        return current - 1
+    return current
+
+
+def main():
+    hostname = os.uname().nodename if hasattr(os, "uname") else "worker"
+    slots = [WorkerSlot(hostname, kind, index) for kind, index in detect_slots()]
+    max_workers = min(SUPERVISOR_MAX_WORKERS or len(slots), len(slots))
+    min_workers = min(SUPERVISOR_MIN_WORKERS, max_workers)
+    print(f"[supervisor] {len(slots)} slots, scaling between {min_workers} and {max_workers} workers")
+
+    for slot in slots[:min_workers]:
+        slot.wanted = True
+
+    idle_since = time.time()
+    last_scale = 0.0
+
+    try:
+        while True:
+            now = time.time()
+            for slot in slots:
+                slot.check(now)
+
+            try:
+                queue = fetch_queue_stats()
+            except requests.RequestException as e:
+                print(f"[supervisor] router unreachable: {e}")
+                time.sleep(SUPERVISOR_INTERVAL)
+                continue
+
+            if queue.get("ready", 0) > 0:
+                idle_since = now
+
+            current = sum(slot.wanted for slot in slots)
+            target = desired_workers(current, queue, idle_since, now, min_workers, max_workers)
+            if target != current and now - last_scale >= SUPERVISOR_COOLDOWN_SECONDS:
+                last_scale = now
+                if target > current:
+                    slot = next(slot for slot in slots if not slot.wanted)
+                    slot.wanted = True
+                    slot.check(now)
+                else:
+                    slot = next(slot for slot in reversed(slots) if slot.wanted)
+                    slot.wanted = False
+                    slot.stop()
+                    idle_since = now
+                print(f"[supervisor] scaled to {target} workers (ready={queue.get('ready')}, "
+                      f"wait_p95={queue.get('wait_p95_seconds')})")
+
+            time.sleep(SUPERVISOR_INTERVAL)
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for slot in slots:
+            slot.wanted = False
+            slot.stop(drain=False)
+        for slot in slots:
+            if slot.exiting is not None:
+                try:
+                    slot.exiting.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    slot.exiting.kill()
+
+
+if __name__ == "__main__":
+    main()
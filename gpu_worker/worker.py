@@ -1,9 +1,374 @@
+import argparse
 import requests
 import os
+import signal
+import socket
+import threading
 import time
-from sd_runner import run_stable_diffusion
+from image_encoder import IMAGE_ENCODER
+from outbox import OUTBOX_DIR, CallbackOutbox
+from progress import BatchProgress, ProgressReporter
+from prompt_cache import PROMPT_CACHE
+from sd_runner import (
+    render_batch,
+    load_pipeline,
+    warm_up_pipeline,
+    last_steps_run,
+    last_load_ms,
+    get_registry,
+    warm_models,
+)
 
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1.0"))
+LEASE_TIMEOUT = float(os.getenv("WORKER_LEASE_TIMEOUT", "120"))
+# Micro-batching: wait up to BATCH_WINDOW_MS for up to BATCH_MAX_SIZE compatible jobs
+BATCH_MAX_SIZE = int(os.getenv("WORKER_BATCH_MAX_SIZE", "4"))
+BATCH_WINDOW_MS = float(os.getenv("WORKER_BATCH_WINDOW_MS", "50"))
+# Stream output images to the router (PUT /jobs/{id}/output) instead of
+# reporting a path on this machine; turn off when router and worker share a disk
+UPLOAD_OUTPUTS = os.getenv("WORKER_UPLOAD_OUTPUTS", "true").lower() == "true"
+# Between denoising steps, a busy worker checks this often for queued work of
+# a more urgent priority class and runs it first (0 disables preemption)
+PREEMPT_CHECK_SECONDS = float(os.getenv("WORKER_PREEMPT_CHECK_SECONDS", "0.5"))
+# Priority classes, most urgent first (api.models.job.Priority)
+PRIORITIES = ["interactive", "standard", "batch"]
+# Send per-step progress (and previews for jobs that ask) to the router
+REPORT_PROGRESS = os.getenv("WORKER_REPORT_PROGRESS", "true").lower() == "true"
+# Set by supervisor.py for the worker processes it manages
+WORKER_SLOT = os.getenv("WORKER_SLOT")
+WORKER_RESTARTS = int(os.getenv("WORKER_RESTARTS", "0"))
+
+_STARTED_AT = time.time()
+_COUNTERS = {"jobs_done": 0, "busy_seconds": 0.0, "interrupted": 0}
+
+# Set by SIGTERM (supervisor scale-down): finish the current batch, deliver
+# its results and exit instead of leasing more work
+DRAINING = threading.Event()
+
+
+def _drain(signum, frame):
+    print(f"[{WORKER_ID}] draining: exiting after the current batch")
+    DRAINING.set()
+
+
+def worker_stats() -> dict:
+    """Counters sent to the router with every lease request (GET /workers)."""
+    uptime = time.time() - _STARTED_AT
+    return {
+        "slot": WORKER_SLOT,
+        "restarts": WORKER_RESTARTS,
+        "uptime_seconds": round(uptime, 1),
+        "jobs_done": _COUNTERS["jobs_done"],
+        "interrupted": _COUNTERS["interrupted"],
+        "busy_seconds": round(_COUNTERS["busy_seconds"], 1),
+        "utilization": round(_COUNTERS["busy_seconds"] / uptime, 3) if uptime else 0.0,
+        "prompt_cache": PROMPT_CACHE.stats(),
+        "models": get_registry().stats(),
+        "outbox": OUTBOX.stats() if OUTBOX else None,
+        "progress": PROGRESS.stats() if PROGRESS else None,
+    }
+
+
+# Results go through a persistent outbox; started by main() / run_resident()
+OUTBOX = None
+
+
+def start_outbox(on_delivered=None) -> CallbackOutbox:
+    global OUTBOX
+    # One directory per supervisor slot, so a restarted worker picks up its predecessor's results
+    OUTBOX = CallbackOutbox(
+        API_BASE_URL,
+        os.path.join(OUTBOX_DIR, WORKER_SLOT or "default"),
+        on_delivered=on_delivered,
+    )
+    OUTBOX.start()
+    return OUTBOX
+
+
+# Step progress reporter; started by main() / run_resident() with REPORT_PROGRESS
+PROGRESS = None
+
+
+def start_progress() -> ProgressReporter | None:
+    global PROGRESS
+    if REPORT_PROGRESS:
+        PROGRESS = ProgressReporter(API_BASE_URL)
+        PROGRESS.start()
+    return PROGRESS
+
+
+def send_callback(job_id: str, payload: dict, output_path: str | None = None):
+    """Queue a result (and its image) for delivery; returns as soon as it is on disk."""
+    # The router times delivery from here (outbox retries included)
+    payload = {**payload, "reported_at": time.time()}
+    OUTBOX.put(job_id, payload, upload=output_path if UPLOAD_OUTPUTS else None)
+
+
+class BatchInterrupted(Exception):
+    """Raised from the step callback to stop a batch nobody needs any more."""
+
+    def __init__(self, steps_done: int):
+        super().__init__(f"interrupted after {steps_done} steps")
+        self.steps_done = steps_done
+
+
+def past_deadline(job_payload: dict) -> bool:
+    return bool(job_payload.get("deadline")) and time.time() > job_payload["deadline"]
+
+
+def abandoned(job_payload: dict) -> bool:
+    """
+    Whether a job's result is no longer wanted: it is past its deadline,
+    the router reported it finished (cancelled or failed elsewhere), or its
+    lease is gone.
+    """
+    job_id = job_payload["job_id"]
+    return (
+        past_deadline(job_payload)
+        or (PROGRESS is not None and job_id in PROGRESS.finished)
+        or (KEEPER is not None and job_id in KEEPER.lost)
+    )
+
+
+class StepPreemption:
+    """
+    Step callback that lets more urgent queued work run in the middle of a
+    batch. Every PREEMPT_CHECK_SECONDS it asks the router for jobs of a more
+    urgent class than the running batch; if there are any, they are run to
+    completion right there, while this batch's latents wait, and denoising
+    then resumes from the same step.
+    """
+
+    def __init__(self, job_payloads: list):
+        # A batch is as urgent as its most urgent job
+        self.priority = min(
+            (job_payload.get("priority") or "standard" for job_payload in job_payloads),
+            key=PRIORITIES.index,
+        )
+        self.next_check = time.time() + PREEMPT_CHECK_SECONDS
+        self.preemptions = 0
+        self.preempted_seconds = 0.0
+
+    def __call__(self, steps_done: int):
+        if self.priority == PRIORITIES[0] or time.time() < self.next_check:
+            return
+
+        try:
+            leases = lease_jobs(BATCH_MAX_SIZE, more_urgent_than=self.priority)
+        except requests.RequestException:
+            leases = []
+
+        if leases:
+            start = time.time()
+            print(f"[{WORKER_ID}] {self.priority} batch preempted at step {steps_done} by {len(leases)} job(s)")
+            run_leases(leases)
+            self.preemptions += 1
+            self.preempted_seconds += time.time() - start
+        self.next_check = time.time() + PREEMPT_CHECK_SECONDS
+
+
+def execute_batch(job_payloads: list, batch_wait_ms: float = 0.0, preemptible: bool = False):
+    """
+    Run a batch of compatible jobs as one pipeline call on the (resident)
+    pipeline and report each result to the router under its own job ID.
+
+    Returns once the images are rendered; they are encoded in each job's
+    output format and reported from the encoder threads. With preemptible,
+    more urgent jobs may run between its denoising steps (see StepPreemption).
+    Step progress is reported as it goes (see progress.py). Once every job in
+    the batch is abandoned (cancelled, past its deadline), it stops at the
+    next step.
+    """
+    preemption = StepPreemption(job_payloads) if preemptible and PREEMPT_CHECK_SECONDS > 0 else None
+    progress = BatchProgress(PROGRESS, job_payloads, job_payloads[0]["steps"]) if PROGRESS else None
+
+    def on_step(steps_done: int, latents=None):
+        if progress:
+            progress(steps_done, latents)
+        if all(abandoned(job_payload) for job_payload in job_payloads):
+            raise BatchInterrupted(steps_done)
+        if preemption:
+            preemption(steps_done)
+            if progress:
+                progress.resume()
+
+    try:
+        # Track execution time for proof of execution
+        start_time = time.time()
+        
+        images = render_batch(
+            [job_payload["prompt"] for job_payload in job_payloads],
+            job_payloads[0]["steps"],
+            [job_payload.get("seed") for job_payload in job_payloads],
+            [job_payload.get("negative_prompt") for job_payload in job_payloads],
+            job_payloads[0].get("sampler", "default"),
+            job_payloads[0].get("model"),
+            on_step=on_step,
+        )
+        
+        # Time spent running other jobs is not this batch's execution time
+        preempted_seconds = preemption.preempted_seconds if preemption else 0.0
+        execution_time = time.time() - start_time - preempted_seconds
+        steps_run = last_steps_run(job_payloads[0].get("model"))
+        model_load_ms = last_load_ms(job_payloads[0].get("model"))
+
+    except BatchInterrupted as e:
+        _COUNTERS["interrupted"] += len(job_payloads)
+        print(f"[{WORKER_ID}] batch of {len(job_payloads)} stopped after {e.steps_done} steps")
+        for job_payload in job_payloads:
+            if past_deadline(job_payload):
+                send_callback(job_payload["job_id"], {
+                    "status": "failed",
+                    "error": f"Deadline exceeded after {e.steps_done} steps",
+                    "timed_out": True,
+                })
+            elif KEEPER is not None:
+                # Cancelled or taken over elsewhere: nothing to report
+                KEEPER.release(job_payload["job_id"])
+        return
+
+    except Exception as e:
+        for job_payload in job_payloads:
+            send_callback(job_payload["job_id"], {
+                "status": "failed",
+                "error": str(e),
+                "batch_size": len(job_payloads),
+                "batch_wait_ms": round(batch_wait_ms, 1),
+            })
+        return
+
+    # Callback to ACR API with execution metrics for proof generation
+    for job_payload, image in zip(job_payloads, images):
+        def report(encoded, error, job_payload=job_payload):
+            if error is not None:
+                send_callback(job_payload["job_id"], {"status": "failed", "error": f"encoding failed: {error}"})
+                return
+            send_callback(job_payload["job_id"], {
+                "status": "completed",
+                "output_url": encoded["path"],
+                # The router bills by steps_run
+                "steps_run": steps_run,
+                "execution_time": round(execution_time, 2),
+                "model_load_ms": model_load_ms,
+                "aidp_job_id": job_payload["aidp_job_id"],
+                "node_id": job_payload["node_id"],
+                "batch_size": len(job_payloads),
+                "batch_wait_ms": round(batch_wait_ms, 1),
+                "output_bytes": encoded["output_bytes"],
+                "encode_ms": encoded["encode_ms"],
+                "preemptions": preemption.preemptions if preemption else 0,
+                "preempted_ms": round(preempted_seconds * 1000, 1),
+                "avg_step_ms": progress.avg_step_ms if progress else None,
+            }, encoded["path"])
+
+        IMAGE_ENCODER.submit(image, job_payload, report)
+
+
+def execute_job(job_payload: dict):
+    """Run one job and report the result to the router."""
+    execute_batch([job_payload])
+
+
+class LeaseKeeper(threading.Thread):
+    """Heartbeats the leases of in-flight jobs so the router does not redeliver them."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        # job_id -> lease_id, kept until the job's result reaches the router
+        self.leases = {}
+        # Jobs whose lease the router no longer knows (cancelled, timed out, expired)
+        self.lost = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def hold(self, job_id: str, lease_id: str):
+        with self._lock:
+            self.leases[job_id] = lease_id
+
+    def release(self, job_id: str):
+        with self._lock:
+            self.leases.pop(job_id, None)
+            self.lost.discard(job_id)
+
+    def run(self):
+        while not self._stopped.wait(LEASE_TIMEOUT / 3):
+            with self._lock:
+                leases = list(self.leases.items())
+            for job_id, lease_id in leases:
+                try:
+                    response = requests.post(
+                        f"{API_BASE_URL}/workers/leases/{lease_id}/heartbeat",
+                        json={"visibility_timeout": LEASE_TIMEOUT},
+                        timeout=10,
+                    )
+                    if response.status_code == 404:
+                        with self._lock:
+                            if job_id in self.leases:
+                                self.lost.add(job_id)
+                except requests.RequestException as e:
+                    print(f"[{WORKER_ID}] heartbeat for {lease_id} failed: {e}")
+
+    def stop(self):
+        self._stopped.set()
+
+
+def lease_jobs(max_jobs: int = 1, batch_key: str | None = None, more_urgent_than: str | None = None) -> list:
+    """
+    Lease up to max_jobs compatible jobs from the router, optionally only
+    jobs more urgent than a priority class. Returns [] when the queue is idle.
+    """
+    response = requests.post(
+        f"{API_BASE_URL}/workers/lease",
+        json={
+            "worker_id": WORKER_ID,
+            "max_jobs": max_jobs,
+            "visibility_timeout": LEASE_TIMEOUT,
+            "batch_key": batch_key,
+            "warm_models": warm_models(),
+            "stats": worker_stats(),
+            "more_urgent_than": more_urgent_than,
+        },
+        timeout=10,
+    )
+    response.raise_for_status()
+    return response.json()["leases"]
+
+
+def collect_batch() -> tuple:
+    """
+    Lease a batch of compatible jobs.
+
+    Takes whatever is ready, then keeps asking for jobs with the same batch
+    key until the batch is full or BATCH_WINDOW_MS has passed since the first
+    job arrived. Returns (leases, batch_wait_ms).
+    """
+    leases = lease_jobs(BATCH_MAX_SIZE)
+    if not leases:
+        return [], 0.0
+
+    batch_key = leases[0]["payload"]["batch_key"]
+    window_start = time.time()
+    deadline = window_start + BATCH_WINDOW_MS / 1000
+
+    while len(leases) < BATCH_MAX_SIZE and time.time() < deadline:
+        time.sleep(min(0.01, max(deadline - time.time(), 0)))
+        leases += lease_jobs(BATCH_MAX_SIZE - len(leases), batch_key)
+
+    return leases, (time.time() - window_start) * 1000
+
+
+def nack_lease(lease_id: str):
+    """Hand a job back to the router so another worker picks it up right away."""
+    try:
+        requests.post(
+            f"{API_BASE_URL}/workers/leases/{lease_id}/nack",
+            json={"requeue": True},
+            timeout=10,
+        )
+    except requests.RequestException:
+        pass  # the lease will expire and be redelivered anyway
 
 
 def main():
@@ -24,48 +389,115 @@ def main():
         "aidp_job_id": os.getenv("AIDP_JOB_ID"),
         "prompt": os.getenv("PROMPT"),
         "steps": int(os.getenv("STEPS", 30)),
+        "sampler": os.getenv("SAMPLER", "default"),
+        "model": os.getenv("MODEL_ID"),
+        "seed": int(os.environ["SEED"]) if os.getenv("SEED") else None,
+        "negative_prompt": os.getenv("NEGATIVE_PROMPT") or None,
+        "output_format": os.getenv("OUTPUT_FORMAT", "png"),
+        "output_quality": int(os.environ["OUTPUT_QUALITY"]) if os.getenv("OUTPUT_QUALITY") else None,
+        "png_compression": int(os.environ["PNG_COMPRESSION"]) if os.getenv("PNG_COMPRESSION") else None,
+        "previews": os.getenv("PREVIEWS", "").lower() == "true",
+        "deadline": float(os.environ["DEADLINE"]) if os.getenv("DEADLINE") else None,
         "node_id": os.getenv("AIDP_NODE_ID"),
         "node_wallet": os.getenv("AIDP_NODE_WALLET"),
     }
 
-    job_id = job_payload["job_id"]
-    aidp_job_id = job_payload["aidp_job_id"]
+    outbox = start_outbox()
+    start_progress()
+    execute_job(job_payload)
+    IMAGE_ENCODER.shutdown()
+    if not outbox.flush():
+        print(f"[{WORKER_ID}] result for {job_payload['job_id']} not delivered yet, kept in {outbox.directory}")
+    outbox.stop()
+
+
+# Heartbeats held leases; started by run_resident()
+KEEPER = None
+
+
+def run_leases(leases: list, batch_wait_ms: float = 0.0):
+    """Run leased jobs as one preemptible batch; their leases are held until reported."""
+    for lease in leases:
+        KEEPER.hold(lease["job_id"], lease["lease_id"])
+    execute_batch([lease["payload"] for lease in leases], batch_wait_ms, preemptible=True)
+    _COUNTERS["jobs_done"] += len(leases)
+
+
+def run_resident():
+    """
+    Long-lived worker mode.
+
+    Loads the pipeline once, warms it up, then leases jobs from the router
+    in a loop so model load time never lands on a job's latency. The
+    terminal callback acks the lease on the router side; leases are
+    heartbeated until the outbox has delivered it.
+
+    SIGTERM drains the worker: the batch in progress finishes and is
+    delivered before it exits. SIGINT (Ctrl-C) stops at once and hands
+    unfinished leases back.
+    """
+    start_time = time.time()
+    load_pipeline()
+    warm_up_pipeline()
+    print(f"[{WORKER_ID}] pipeline resident after {time.time() - start_time:.1f}s, polling {API_BASE_URL}")
+
+    global KEEPER
+    keeper = KEEPER = LeaseKeeper()
+    keeper.start()
+    outbox = start_outbox(on_delivered=keeper.release)
+    start_progress()
+    signal.signal(signal.SIGTERM, _drain)
 
     try:
-        # Track execution time for proof of execution
-        start_time = time.time()
-        
-        output_path = run_stable_diffusion(
-            job_payload["prompt"],
-            job_payload["steps"],
-        )
-        
-        execution_time = time.time() - start_time
+        while not DRAINING.is_set():
+            try:
+                leases, batch_wait_ms = collect_batch()
+            except requests.RequestException as e:
+                print(f"[{WORKER_ID}] router unreachable: {e}")
+                time.sleep(POLL_INTERVAL)
+                continue
 
-        # Callback to ACR API with execution metrics for proof generation
-        requests.post(
-            f"{API_BASE_URL}/jobs/{job_id}/callback",
-            json={
-                "status": "completed",
-                "output_url": output_path,
-                "compute_cost": 0.15,
-                "execution_time": round(execution_time, 2),
-                "aidp_job_id": aidp_job_id,
-                "node_id": job_payload["node_id"],
-            },
-            timeout=10,
-        )
+            if not leases:
+                time.sleep(POLL_INTERVAL)
+                continue
 
-    except Exception as e:
-        requests.post(
-            f"{API_BASE_URL}/jobs/{job_id}/callback",
-            json={
-                "status": "failed",
-                "error": str(e),
-            },
-            timeout=10,
-        )
+            batch_start = time.time()
+            run_leases(leases, batch_wait_ms)
+            _COUNTERS["busy_seconds"] += time.time() - batch_start
+
+            cache = PROMPT_CACHE.stats()
+            print(f"[{WORKER_ID}] prompt cache {cache['size_mb']}/{cache['max_mb']} MB, hit ratio {cache['hit_ratio']}")
+
+        IMAGE_ENCODER.shutdown()
+        if not outbox.flush(timeout=60):
+            print(f"[{WORKER_ID}] {outbox.stats()['pending']} results left in the outbox for the next worker")
+
+    except KeyboardInterrupt:
+        IMAGE_ENCODER.shutdown()
+        outbox.flush(timeout=10)
+        # Give unfinished work back instead of waiting for the leases to expire;
+        # finished jobs whose results are still in the outbox stay leased
+        finished = set(outbox.pending_job_ids())
+        for job_id, lease_id in list(keeper.leases.items()):
+            if job_id not in finished:
+                nack_lease(lease_id)
+    finally:
+        keeper.stop()
+        outbox.stop()
+        if PROGRESS:
+            PROGRESS.stop()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="AIDP GPU worker")
+    parser.add_argument(
+        "--resident",
+        action="store_true",
+        help="keep the pipeline loaded and lease jobs from the router in a loop",
+    )
+    args = parser.parse_args()
+
+    if args.resident:
+        run_resident()
+    else:
+        main()
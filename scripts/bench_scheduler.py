@@ -0,0 +1,87 @@
+"""
+Compare node scheduling policies in a discrete-event simulation.
+
+Jobs arrive as a Poisson stream with 10-50 steps and are routed to the
+AIDP_NODES pool. Each node runs one job at a time at the true speed of its
+GPU (with some noise); the scheduler only learns those speeds from the
+execution times reported when jobs finish, like it does from worker callbacks.
+
+Run from the repository root:
+    python scripts/bench_scheduler.py --jobs 20000 --load 0.85
+"""
+
+import argparse
+import heapq
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from api.services.aidp_integration import AIDP_NODES  # noqa: E402
+from api.services.node_scheduler import NodeScheduler, SCHEDULER_POLICIES  # noqa: E402
+
+# Actual seconds per step on each GPU class; the scheduler starts from its own prior
+TRUE_SECONDS_PER_STEP = {"A100": 0.04, "RTX4090": 0.07}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def simulate(policy: str, jobs: int, load: float, seed: int) -> list:
+    rng = random.Random(seed)
+    scheduler = NodeScheduler(AIDP_NODES, policy=policy, rng=random.Random(seed + 1))
+
+    capacity = sum(1 / TRUE_SECONDS_PER_STEP[n["gpu"]] for n in AIDP_NODES)  # steps/s
+    mean_steps = 30
+    arrival_rate = load * capacity / mean_steps
+
+    node_free_at = {n["node_id"]: 0.0 for n in AIDP_NODES}
+    completions = []  # (finish_time, node_id, steps, execution_time)
+    latencies = []
+    now = 0.0
+
+    for _ in range(jobs):
+        now += rng.expovariate(arrival_rate)
+
+        while completions and completions[0][0] <= now:
+            _, node_id, steps, execution_time = heapq.heappop(completions)
+            scheduler.release(node_id, steps, execution_time)
+
+        steps = rng.randint(10, 50)
+        node = scheduler.select(steps)
+        execution_time = steps * TRUE_SECONDS_PER_STEP[node["gpu"]] * rng.uniform(0.9, 1.1)
+        start = max(now, node_free_at[node["node_id"]])
+        finish = start + execution_time
+        node_free_at[node["node_id"]] = finish
+
+        heapq.heappush(completions, (finish, node["node_id"], steps, execution_time))
+        latencies.append(finish - now)
+
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=20000)
+    parser.add_argument("--load", type=float, default=0.85, help="offered load as a fraction of pool capacity")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{args.jobs} jobs at {args.load:.0%} load on {len(AIDP_NODES)} nodes")
+    print(f"{'policy':<28}{'mean s':>10}{'p50 s':>10}{'p99 s':>10}")
+    for policy in SCHEDULER_POLICIES:
+        latencies = simulate(policy, args.jobs, args.load, args.seed)
+        print(
+            f"{policy:<28}"
+            f"{statistics.mean(latencies):>10.2f}"
+            f"{percentile(latencies, 50):>10.2f}"
+            f"{percentile(latencies, 99):>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Stand-in for the AIDP marketplace API, for tests and local load runs.
+
+Run it next to the router:
+
+    uvicorn --app-dir tests stand_in_marketplace:app --port 9000
+    AIDP_API_ENDPOINT=http://localhost:9000/v1 AIDP_API_KEY=test AIDP_USE_REAL_API=true \
+        uvicorn api.main:app
+
+MARKETPLACE_LATENCY_MS and MARKETPLACE_FAIL_RATE inject slowness and errors.
+"""
+
+import asyncio
+import os
+import random
+import uuid
+
+from fastapi import FastAPI, Header, HTTPException
+
+app = FastAPI(title="AIDP marketplace stand-in")
+
+app.state.latency_ms = float(os.getenv("MARKETPLACE_LATENCY_MS", "0"))
+app.state.fail_rate = float(os.getenv("MARKETPLACE_FAIL_RATE", "0"))
+app.state.requests = 0
+
+
+@app.post("/v1/compute/submit")
+async def submit(payload: dict, authorization: str = Header(default="")):
+    app.state.requests += 1
+
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing API key")
+
+    if app.state.latency_ms:
+        await asyncio.sleep(app.state.latency_ms / 1000)
+
+    if random.random() < app.state.fail_rate:
+        raise HTTPException(status_code=503, detail="Marketplace overloaded")
+
+    return {
+        "job_id": f"aidp_live_{uuid.uuid4().hex[:12]}",
+        "node": {
+            "node_id": "aidp_node_live",
+            "wallet": "AIDPnodeLiveWallet",
+            "gpu": "H100",
+            "region": "us-east",
+        },
+        "cost": 0.12,
+    }
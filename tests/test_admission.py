@@ -0,0 +1,77 @@
+"""
+Tests for admission control (token buckets and the queue-depth cap)
+"""
+
+from api.services.admission import AdmissionController, ANONYMOUS, parse_tenant_weights, tenant_id
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAdmission:
+    """Test rate limits, queue-full rejections and Retry-After"""
+
+    def test_token_bucket_refills(self):
+        clock = FakeClock()
+        admission = AdmissionController(rate_per_second=2, burst=3, clock=clock)
+
+        assert all(admission.admit("a", 1, 0) is None for _ in range(3))
+        assert admission.admit("a", 1, 0) == ("rate_limited", 1)
+        assert admission.admit("b", 1, 0) is None  # buckets are per tenant
+
+        clock.now = 0.5
+        assert admission.admit("a", 1, 0) is None
+        assert admission.stats()["rate_limited"] == 1
+
+    def test_large_batch_leaves_bucket_in_debt(self):
+        clock = FakeClock()
+        admission = AdmissionController(rate_per_second=1, burst=5, clock=clock)
+
+        assert admission.admit("a", 20, 0) is None
+        assert admission.admit("a", 1, 0) == ("rate_limited", 16)
+
+    def test_refilled_buckets_are_dropped(self):
+        clock = FakeClock()
+        admission = AdmissionController(rate_per_second=1, burst=2, clock=clock)
+
+        for i in range(5):
+            admission.admit(f"t{i}", 1, 0)
+        assert admission.stats()["tenants"] == 5
+
+        clock.now = 2.0  # every bucket has refilled
+        admission.admit("late", 1, 0)
+        assert admission.stats()["tenants"] == 1
+
+    def test_keys_beyond_cap_share_a_bucket(self):
+        clock = FakeClock()
+        admission = AdmissionController(rate_per_second=1, burst=2, max_tenants=2, clock=clock)
+
+        assert admission.admit("a", 1, 0) is None
+        assert admission.admit("b", 1, 0) is None
+        # Rotating keys draws from one overflow bucket
+        assert admission.admit("c", 1, 0) is None
+        assert admission.admit("d", 1, 0) is None
+        assert admission.admit("e", 1, 0) == ("rate_limited", 1)
+        assert admission.stats()["tenants"] == 3
+
+    def test_queue_full_retry_after_from_drain_rate(self):
+        clock = FakeClock()
+        admission = AdmissionController(max_queue_depth=100, max_retry_after=60, drain_window=10, clock=clock)
+
+        assert admission.admit("a", 1, 99) is None
+        # Nothing drained recently: wait the maximum
+        assert admission.admit("a", 1, 100) == ("queue_full", 60)
+
+        admission.record_drained(20)  # 2 jobs per second
+        assert admission.admit("a", 10, 100) == ("queue_full", 5)
+
+    def test_tenant_ids_hide_keys(self):
+        assert tenant_id(None) == ANONYMOUS
+        assert tenant_id("secret") == tenant_id("secret")
+        assert "secret" not in tenant_id("secret")
+        assert parse_tenant_weights("gold:4, bronze:0.5") == {tenant_id("gold"): 4.0, tenant_id("bronze"): 0.5}
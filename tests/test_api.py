@@ -7,10 +7,45 @@ Install test dependencies:
 pip install pytest pytest-asyncio httpx
 """
 
+import asyncio
+import threading
+import time
+
+import httpx
 import pytest
 from fastapi.testclient import TestClient
+from stand_in_marketplace import app as marketplace_app
 from api.main import app
-from api.services.job_manager import JOBS
+from api.core.config import get_settings
+from api.routes.jobs import job_event_stream
+from api.services.admission import ADMISSION
+from api.services.aidp_integration import (
+    AIDP_CONFIG,
+    AIDP_API_BREAKER,
+    NODE_SCHEDULER,
+    _try_real_aidp_api,
+    init_aidp_client,
+    get_aidp_client,
+    close_aidp_client,
+)
+from api.services.job_manager import (
+    JOBS,
+    JOB_QUEUE,
+    RESULT_CACHE,
+    BLOB_STORE,
+    IN_FLIGHT_JOBS,
+    WORKER_STATS,
+    QUEUE_WAITS,
+    LATENCIES,
+    JOB_PROGRESS,
+    PREVIEWS,
+    STEP_TIMES,
+    DEADLINES,
+    TERMINATIONS,
+    get_job,
+    reap_deadlines,
+    update_job,
+)
 
 client = TestClient(app)
 
@@ -19,8 +54,36 @@ client = TestClient(app)
 def clear_jobs():
     """Clear jobs before each test"""
     JOBS.clear()
+    JOB_QUEUE.clear()
+    NODE_SCHEDULER.reset()
+    RESULT_CACHE.clear()
+    IN_FLIGHT_JOBS.clear()
+    WORKER_STATS.clear()
+    QUEUE_WAITS.clear()
+    for latencies in LATENCIES.values():
+        latencies.clear()
+    JOB_PROGRESS.clear()
+    PREVIEWS.clear()
+    STEP_TIMES.clear()
+    DEADLINES.clear()
+    TERMINATIONS.update(cancelled=0, timed_out=0, dequeued=0)
+    ADMISSION.reset()
     yield
     JOBS.clear()
+    JOB_QUEUE.clear()
+    NODE_SCHEDULER.reset()
+    RESULT_CACHE.clear()
+    IN_FLIGHT_JOBS.clear()
+    WORKER_STATS.clear()
+    QUEUE_WAITS.clear()
+    for latencies in LATENCIES.values():
+        latencies.clear()
+    JOB_PROGRESS.clear()
+    PREVIEWS.clear()
+    STEP_TIMES.clear()
+    DEADLINES.clear()
+    TERMINATIONS.update(cancelled=0, timed_out=0, dequeued=0)
+    ADMISSION.reset()
 
 
 class TestJobSubmission:
@@ -65,6 +128,17 @@ class TestJobSubmission:
         )
         assert response.status_code == 422  # Validation error
 
+    def test_fast_sampler_allows_fewer_steps(self):
+        """Test that the step minimum depends on the sampler"""
+        response = client.post("/jobs", json={"prompt": "Test", "steps": 6, "sampler": "dpm_solver_pp"})
+        assert response.status_code == 200
+
+        response = client.post("/jobs", json={"prompt": "Test", "steps": 6})
+        assert response.status_code == 422
+
+        response = client.post("/jobs", json={"prompt": "Test", "steps": 0, "sampler": "unipc"})
+        assert response.status_code == 422
+
     def test_submit_job_default_steps(self):
         """Test that steps default to 30"""
         response = client.post(
@@ -318,6 +392,1114 @@ class TestAIDPIntegration:
         assert "execution_hash" in proof
         assert proof["verified"] == True
 
+    def test_region_preference(self):
+        """Test that a requested region is honoured while nodes there are idle"""
+        response = client.post("/jobs", json={"prompt": "Test", "region": "eu-west"})
+        assert response.json()["aidp"]["assigned_node"]["region"] == "eu-west"
+
+    def test_node_released_on_completion(self):
+        """Test that the callback frees the node slot and feeds its speed estimate"""
+        job_id = client.post("/jobs", json={"prompt": "Test", "steps": 20}).json()["job_id"]
+        node_id = get_job(job_id)["aidp_data"]["assigned_node"]["node_id"]
+        assert NODE_SCHEDULER.stats()["nodes"][node_id]["in_flight"] == 1
+
+        client.post(f"/jobs/{job_id}/callback", json={"status": "completed", "execution_time": 4.0})
+        # Repeated callbacks must not release twice
+        client.post(f"/jobs/{job_id}/callback", json={"status": "completed", "execution_time": 4.0})
+
+        node = client.get("/system/stats").json()["scheduler"]["nodes"][node_id]
+        assert node["in_flight"] == 0
+        assert node["completed"] == 1
+
+
+class TestResultCache:
+    """Test that identical requests are served from the result cache"""
+
+    @pytest.fixture(autouse=True)
+    def blob_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(BLOB_STORE, "directory", str(tmp_path / "blobs"))
+        monkeypatch.setattr(BLOB_STORE, "incoming", str(tmp_path / "blobs" / ".incoming"))
+
+    def complete_job(self, job_id, output_path):
+        client.post(
+            f"/jobs/{job_id}/callback",
+            json={"status": "completed", "output_url": output_path, "execution_time": 5.0},
+        )
+
+    def test_identical_request_hits_cache(self, tmp_path):
+        output_path = tmp_path / "render.png"
+        output_path.write_bytes(b"png")
+        request = {"prompt": "A lighthouse", "steps": 20, "seed": 42}
+
+        first = client.post("/jobs", json=request).json()
+        self.complete_job(first["job_id"], str(output_path))
+
+        second = client.post("/jobs", json=request).json()
+        assert second["status"] == "COMPLETED"
+        assert second["execution"]["cache_hit"] is True
+        assert second["compute_cost"] == 0.0
+        assert second["aidp"] is None
+        assert second["output_url"] == f"/jobs/{second['job_id']}/output"
+        assert JOB_QUEUE.stats()["total"] == 0
+
+        stats = client.get("/system/stats").json()["result_cache"]
+        assert stats["hits"] == 1
+        assert stats["stores"] == 1
+
+        # The job keeps its own copy once the cache lets go of the image
+        RESULT_CACHE.clear()
+        response = client.get(second["output_url"])
+        assert response.status_code == 200
+        assert response.content == b"png"
+
+    def test_different_seed_misses(self, tmp_path):
+        output_path = tmp_path / "render.png"
+        output_path.write_bytes(b"png")
+
+        first = client.post("/jobs", json={"prompt": "A lighthouse", "seed": 1}).json()
+        self.complete_job(first["job_id"], str(output_path))
+
+        second = client.post("/jobs", json={"prompt": "A lighthouse", "seed": 2}).json()
+        assert second["status"] == "PENDING"
+
+    def test_seedless_requests_not_cached(self, tmp_path):
+        output_path = tmp_path / "render.png"
+        output_path.write_bytes(b"png")
+
+        first = client.post("/jobs", json={"prompt": "A lighthouse"}).json()
+        self.complete_job(first["job_id"], str(output_path))
+
+        second = client.post("/jobs", json={"prompt": "A lighthouse"}).json()
+        assert second["status"] == "PENDING"
+        assert client.get("/system/stats").json()["result_cache"]["entries"] == 0
+
+    def test_different_output_format_misses(self, tmp_path):
+        output_path = tmp_path / "render.png"
+        output_path.write_bytes(b"png")
+
+        first = client.post("/jobs", json={"prompt": "A lighthouse", "seed": 1}).json()
+        self.complete_job(first["job_id"], str(output_path))
+
+        second = client.post("/jobs", json={"prompt": "A lighthouse", "seed": 1, "output_format": "webp"}).json()
+        assert second["status"] == "PENDING"
+
+    def test_batch_mixes_hits_and_misses(self, tmp_path):
+        output_path = tmp_path / "render.png"
+        output_path.write_bytes(b"png")
+
+        first = client.post("/jobs", json={"prompt": "Cached", "seed": 7}).json()
+        self.complete_job(first["job_id"], str(output_path))
+
+        response = client.post("/jobs/batch", json=[
+            {"prompt": "Cached", "seed": 7},
+            {"prompt": "Fresh", "seed": 7},
+        ])
+        statuses = [job["status"] for job in response.json()["jobs"]]
+        assert statuses == ["COMPLETED", "PENDING"]
+
+
+class TestCoalescing:
+    """Test that duplicates of in-flight jobs share one GPU run"""
+
+    def test_seedless_duplicates_run_separately(self):
+        request = {"prompt": "A busy harbor", "steps": 20}
+        job_ids = [client.post("/jobs", json=request).json()["job_id"] for _ in range(2)]
+
+        assert JOB_QUEUE.stats()["total"] == 2
+        assert all(get_job(job_id).get("coalesced_with") is None for job_id in job_ids)
+
+    def test_duplicates_follow_leader(self):
+        request = {"prompt": "A busy harbor", "steps": 20, "seed": 3}
+        followers_before = client.get("/system/stats").json()["coalescing"]["followers"]
+        leader_id = client.post("/jobs", json=request).json()["job_id"]
+        follower_ids = [client.post("/jobs", json=request).json()["job_id"] for _ in range(2)]
+
+        assert len(set(follower_ids + [leader_id])) == 3
+        assert JOB_QUEUE.stats()["total"] == 1
+        follower = client.get(f"/jobs/{follower_ids[0]}").json()
+        assert follower["status"] == "PENDING"
+        assert follower["aidp"] == client.get(f"/jobs/{leader_id}").json()["aidp"]
+
+        client.post(
+            f"/jobs/{leader_id}/callback",
+            json={"status": "completed", "output_url": "outputs/harbor.png", "compute_cost": 0.15, "execution_time": 3.0},
+        )
+
+        for follower_id in follower_ids:
+            data = client.get(f"/jobs/{follower_id}").json()
+            assert data["status"] == "COMPLETED"
+            assert data["output_url"] == "outputs/harbor.png"
+            assert data["compute_cost"] == 0.0
+            assert data["execution"]["coalesced_with"] == leader_id
+            assert data["proof_of_execution"] is not None
+
+        stats = client.get("/system/stats").json()["coalescing"]
+        assert stats["followers"] - followers_before == 2
+        assert stats["in_flight"] == 0
+
+    def test_batch_duplicates_coalesce(self):
+        response = client.post("/jobs/batch", json=[{"prompt": "Same", "seed": 1}] * 3)
+        jobs = response.json()["jobs"]
+
+        assert JOB_QUEUE.stats()["total"] == 1
+        assert all(job["aidp"] is not None for job in jobs)
+
+    def test_failed_leader_fails_followers(self):
+        leader_id = client.post("/jobs", json={"prompt": "Doomed", "seed": 4}).json()["job_id"]
+        follower_id = client.post("/jobs", json={"prompt": "Doomed", "seed": 4}).json()["job_id"]
+
+        client.post(f"/jobs/{leader_id}/callback", json={"status": "failed", "error": "CUDA OOM"})
+
+        data = client.get(f"/jobs/{follower_id}").json()
+        assert data["status"] == "FAILED"
+        assert data["error"] == "CUDA OOM"
+
+    def test_finished_leader_takes_no_followers(self):
+        first_id = client.post("/jobs", json={"prompt": "Once", "seed": 6}).json()["job_id"]
+        client.post(f"/jobs/{first_id}/callback", json={"status": "completed", "output_url": "outputs/missing.png"})
+
+        second = client.post("/jobs", json={"prompt": "Once", "seed": 6}).json()
+        assert second["execution"] is None
+        assert JOB_QUEUE.stats()["total"] == 1
+
+    def test_urgent_follower_promotes_leader(self):
+        request = {"prompt": "Urgent duplicate", "seed": 8}
+        leader_id = client.post("/jobs", json={**request, "priority": "batch"}).json()["job_id"]
+        client.post("/jobs", json={**request, "priority": "interactive"})
+
+        leases = client.post(
+            "/workers/lease", json={"worker_id": "w1", "max_jobs": 1, "more_urgent_than": "standard"}
+        ).json()["leases"]
+        assert [lease["job_id"] for lease in leases] == [leader_id]
+        assert leases[0]["payload"]["priority"] == "interactive"
+        assert get_job(leader_id)["priority"] == "batch"
+
+    def test_urgent_follower_in_same_batch_promotes_leader(self):
+        request = {"prompt": "Urgent batch duplicate", "seed": 9}
+        client.post("/jobs/batch", json=[{**request, "priority": "batch"}, {**request, "priority": "interactive"}])
+
+        assert JOB_QUEUE.stats()["ready_by_priority"] == {0: 1}
+
+
+class TestWorkerLeases:
+    """Test the lease API used by resident GPU workers"""
+
+    def submit(self, prompt="A resident worker", steps=20):
+        response = client.post(
+            "/jobs",
+            json={
+                "type": "TEXT_TO_IMAGE",
+                "prompt": prompt,
+                "steps": steps
+            }
+        )
+        return response.json()["job_id"]
+
+    def lease(self, max_jobs=1, batch_key=None):
+        response = client.post(
+            "/workers/lease",
+            json={"worker_id": "w1", "max_jobs": max_jobs, "batch_key": batch_key}
+        )
+        assert response.status_code == 200
+        return response.json()["leases"]
+
+    def test_lease_empty_queue(self):
+        """Test that an idle queue hands out no leases"""
+        assert self.lease() == []
+
+    def test_lease_marks_job_running(self):
+        """Test that a leased job carries its payload and becomes RUNNING"""
+        job_id = self.submit()
+
+        leases = self.lease()
+        assert len(leases) == 1
+        assert leases[0]["job_id"] == job_id
+        assert leases[0]["attempt"] == 1
+        assert leases[0]["payload"]["prompt"] == "A resident worker"
+        assert leases[0]["payload"]["steps"] == 20
+
+        assert client.get(f"/jobs/{job_id}").json()["status"] == "RUNNING"
+        assert self.lease() == []
+
+    def test_negative_prompt_in_payload(self):
+        """Test that the negative prompt reaches the worker"""
+        client.post("/jobs", json={"prompt": "A castle", "negative_prompt": "blurry"})
+        assert self.lease()[0]["payload"]["negative_prompt"] == "blurry"
+
+    def test_interactive_jobs_leased_first(self):
+        """Test that interactive jobs jump ahead of queued batch work"""
+        client.post("/jobs", json={"prompt": "Bulk", "priority": "batch"})
+        urgent = client.post("/jobs", json={"prompt": "Agent waiting", "priority": "interactive"}).json()["job_id"]
+
+        lease = self.lease()[0]
+        assert lease["job_id"] == urgent
+        assert lease["payload"]["priority"] == "interactive"
+
+    def test_preemption_check_leases_only_more_urgent(self):
+        """Test the lease a busy worker makes between denoising steps"""
+        self.submit()
+
+        def check(running):
+            response = client.post("/workers/lease", json={"worker_id": "w1", "more_urgent_than": running})
+            return response.json()["leases"]
+
+        assert check("standard") == []
+        assert len(check("batch")) == 1
+        assert check("interactive") == []
+
+    def test_latency_by_priority(self):
+        """Test that completion latency is reported per priority class"""
+        job_id = client.post("/jobs", json={"prompt": "Quick", "priority": "interactive"}).json()["job_id"]
+        self.lease()
+        client.post(f"/jobs/{job_id}/callback", json={"status": "completed", "output_url": "outputs/q.png"})
+
+        latency = client.get("/system/stats").json()["latency_by_priority"]
+        assert latency["interactive"]["count"] == 1
+        assert latency["interactive"]["p99_seconds"] is not None
+        assert latency["batch"]["p99_seconds"] is None
+
+    def test_output_options_in_payload(self):
+        """Test that the output format and quality reach the worker"""
+        client.post("/jobs", json={"prompt": "A castle", "output_format": "jpeg", "output_quality": 80})
+        payload = self.lease()[0]["payload"]
+        assert payload["output_format"] == "jpeg"
+        assert payload["output_quality"] == 80
+        assert payload["png_compression"] is None
+
+    def test_invalid_output_options(self):
+        """Test that unknown formats and out-of-range levels are rejected"""
+        assert client.post("/jobs", json={"prompt": "A", "output_format": "gif"}).status_code == 422
+        assert client.post("/jobs", json={"prompt": "A", "output_quality": 0}).status_code == 422
+        assert client.post("/jobs", json={"prompt": "A", "png_compression": 10}).status_code == 422
+
+    def test_worker_stats_reported(self):
+        """Test that counters sent with lease requests show up in system stats"""
+        client.post(
+            "/workers/lease",
+            json={"worker_id": "w2", "stats": {"prompt_cache": {"size_mb": 1.5, "hit_ratio": 0.75}}},
+        )
+        workers = client.get("/system/stats").json()["workers"]
+        assert workers["w2"]["prompt_cache"]["hit_ratio"] == 0.75
+
+    def test_list_workers(self):
+        """Test that GET /workers reports health and live leases per worker"""
+        self.submit()
+        self.lease()
+        client.post("/workers/lease", json={"worker_id": "w3", "stats": {"utilization": 0.5, "restarts": 2}})
+
+        workers = {w["worker_id"]: w for w in client.get("/workers").json()["workers"]}
+        assert workers["w1"]["status"] == "healthy"
+        assert workers["w1"]["active_leases"] == 1
+        assert workers["w3"]["active_leases"] == 0
+        assert workers["w3"]["restarts"] == 2
+
+    def test_idle_worker_goes_stale(self, monkeypatch):
+        """Test that a worker that stopped polling without leases is stale"""
+        monkeypatch.setattr(get_settings(), "worker_stale_seconds", 0)
+        self.lease()
+        time.sleep(0.01)
+        workers = client.get("/workers").json()["workers"]
+        assert [w["status"] for w in workers if w["worker_id"] == "w1"] == ["stale"]
+
+    def test_queue_wait_percentiles(self):
+        """Test that leasing a job records its queue wait in system stats"""
+        self.submit()
+        self.lease()
+        queue = client.get("/system/stats").json()["queue"]
+        assert queue["wait_p50_seconds"] is not None
+        assert queue["wait_p95_seconds"] >= queue["wait_p50_seconds"]
+
+    def test_queue_wait_percentiles_forget_old_waits(self, monkeypatch):
+        """Test that waits from before the window do not keep the p95 up"""
+        monkeypatch.setattr(get_settings(), "queue_wait_window_seconds", 60)
+        QUEUE_WAITS.append((time.time() - 120, 45.0))
+        assert client.get("/system/stats").json()["queue"]["wait_p95_seconds"] is None
+
+    def test_heartbeat_and_ack(self):
+        """Test that heartbeats extend a lease and ack removes it"""
+        self.submit()
+        lease_id = self.lease()[0]["lease_id"]
+
+        response = client.post(f"/workers/leases/{lease_id}/heartbeat", json={"visibility_timeout": 60})
+        assert response.status_code == 200
+
+        response = client.post(f"/workers/leases/{lease_id}/ack")
+        assert response.status_code == 200
+        assert client.post(f"/workers/leases/{lease_id}/ack").status_code == 404
+
+    def test_nack_requeues_job(self):
+        """Test that a nacked job goes back to PENDING and is redelivered"""
+        job_id = self.submit()
+        lease_id = self.lease()[0]["lease_id"]
+
+        response = client.post(f"/workers/leases/{lease_id}/nack", json={"requeue": True})
+        assert response.status_code == 200
+        assert client.get(f"/jobs/{job_id}").json()["status"] == "PENDING"
+
+        leases = self.lease()
+        assert leases[0]["job_id"] == job_id
+        assert leases[0]["attempt"] == 2
+
+    def test_callback_acks_lease(self):
+        """Test that a terminal callback removes the job from the queue"""
+        job_id = self.submit()
+        lease_id = self.lease()[0]["lease_id"]
+
+        client.post(
+            f"/jobs/{job_id}/callback",
+            json={"status": "completed", "output_url": "outputs/test.png"}
+        )
+        assert JOB_QUEUE.stats()["total"] == 0
+        assert client.post(f"/workers/leases/{lease_id}/heartbeat").status_code == 404
+
+    def test_lease_burst(self):
+        """Test that a burst of submissions is queued, not executed"""
+        for i in range(50):
+            self.submit(f"Burst {i}")
+
+        assert JOB_QUEUE.stats()["ready"] == 50
+        assert len(self.lease(max_jobs=8)) == 8
+
+    def test_micro_batch_lease(self):
+        """Test that a multi-job lease only groups jobs with matching steps"""
+        first = self.submit("A", steps=20)
+        self.submit("B", steps=30)
+        third = self.submit("C", steps=20)
+
+        leases = self.lease(max_jobs=4)
+        assert [lease["job_id"] for lease in leases] == [first, third]
+        assert leases[0]["payload"]["batch_key"] == "TEXT_TO_IMAGE:runwayml/stable-diffusion-v1-5:default:20"
+        assert self.lease(max_jobs=4, batch_key="TEXT_TO_IMAGE:runwayml/stable-diffusion-v1-5:default:20") == []
+
+    def test_unknown_model_rejected(self):
+        """Test that jobs can only ask for configured checkpoints"""
+        response = client.post("/jobs", json={"prompt": "A", "model": "someone/unknown"})
+        assert response.status_code == 422
+
+    def test_lease_prefers_warm_model(self, monkeypatch):
+        """Test that a worker gets jobs for the model it already has loaded"""
+        monkeypatch.setattr(get_settings(), "available_models", "tiny/sd-small")
+        client.post("/jobs", json={"prompt": "A", "steps": 20})
+        small = client.post("/jobs", json={"prompt": "B", "steps": 20, "model": "tiny/sd-small"}).json()["job_id"]
+
+        response = client.post(
+            "/workers/lease",
+            json={"worker_id": "w1", "max_jobs": 4, "warm_models": ["tiny/sd-small"]},
+        )
+        leases = response.json()["leases"]
+        assert [lease["job_id"] for lease in leases] == [small]
+        assert leases[0]["payload"]["model"] == "tiny/sd-small"
+        assert client.get("/system/stats").json()["workers"]["w1"]["warm_models"] == ["tiny/sd-small"]
+
+    def test_micro_batch_separates_samplers(self):
+        """Test that jobs with different samplers never share a batch"""
+        first = client.post("/jobs", json={"prompt": "A", "steps": 20}).json()["job_id"]
+        client.post("/jobs", json={"prompt": "B", "steps": 20, "sampler": "euler"})
+
+        leases = self.lease(max_jobs=4)
+        assert [lease["job_id"] for lease in leases] == [first]
+        assert leases[0]["payload"]["sampler"] == "default"
+
+    def test_batch_execution_reported(self):
+        """Test that batch size and wait window are reported per job"""
+        job_id = self.submit()
+        self.lease()
+
+        client.post(
+            f"/jobs/{job_id}/callback",
+            json={
+                "status": "completed",
+                "output_url": "outputs/test.png",
+                "execution_time": 3.2,
+                "batch_size": 4,
+                "batch_wait_ms": 12.5,
+                "output_bytes": 48213,
+                "encode_ms": 9.4
+            }
+        )
+        execution = client.get(f"/jobs/{job_id}").json()["execution"]
+        assert execution["batch_size"] == 4
+        assert execution["batch_wait_ms"] == 12.5
+        assert execution["execution_time"] == 3.2
+        assert execution["output_bytes"] == 48213
+        assert execution["encode_ms"] == 9.4
+
+    def test_billed_by_steps_run(self):
+        """Test that the final cost follows the steps the worker actually ran"""
+        job_id = client.post("/jobs", json={"prompt": "Quick", "steps": 8, "sampler": "dpm_solver_pp"}).json()["job_id"]
+        assert client.get(f"/jobs/{job_id}").json()["aidp"]["cost_aidp"] == 0.12
+
+        client.post(
+            f"/jobs/{job_id}/callback",
+            json={"status": "completed", "output_url": "outputs/quick.png", "compute_cost": 0.15, "steps_run": 8},
+        )
+        data = client.get(f"/jobs/{job_id}").json()
+        assert data["compute_cost"] == 0.12
+        assert data["execution"]["steps_run"] == 8
+
+
+class TestBulkJobs:
+    """Test bulk submission and bulk status lookup"""
+
+    def test_submit_batch(self):
+        """Test that a batch of jobs is created, routed and queued in one call"""
+        response = client.post(
+            "/jobs/batch",
+            json=[{"type": "TEXT_TO_IMAGE", "prompt": f"Prompt {i}", "steps": 20} for i in range(25)]
+        )
+        assert response.status_code == 200
+        jobs = response.json()["jobs"]
+        assert len(jobs) == 25
+        assert len({job["job_id"] for job in jobs}) == 25
+        assert all(job["status"] == "PENDING" for job in jobs)
+        assert all(job["aidp"]["aidp_job_id"].startswith("aidp_") for job in jobs)
+        assert JOB_QUEUE.stats()["ready"] == 25
+
+    def test_submit_batch_validates_every_item(self):
+        """Test that one invalid item rejects the batch"""
+        response = client.post(
+            "/jobs/batch",
+            json=[{"prompt": "Fine", "steps": 20}, {"prompt": "Broken", "steps": 0}]
+        )
+        assert response.status_code == 422
+        assert len(JOBS) == 0
+
+    def test_submit_batch_limit(self, monkeypatch):
+        """Test that oversized batches are rejected"""
+        monkeypatch.setattr(get_settings(), "max_batch_jobs", 2)
+        response = client.post("/jobs/batch", json=[{"prompt": "Test"}] * 3)
+        assert response.status_code == 413
+
+    def test_bulk_lookup(self):
+        """Test looking up many jobs with one request"""
+        jobs = client.post(
+            "/jobs/batch",
+            json=[{"prompt": "First"}, {"prompt": "Second"}]
+        ).json()["jobs"]
+        first, second = jobs[0]["job_id"], jobs[1]["job_id"]
+        client.post(
+            f"/jobs/{second}/callback",
+            json={"status": "completed", "output_url": "outputs/second.png"}
+        )
+
+        response = client.get(f"/jobs?ids={second},acr_missing,{first}")
+        assert response.status_code == 200
+        data = response.json()
+        assert [job["job_id"] for job in data["jobs"]] == [second, first]
+        assert data["jobs"][0]["status"] == "COMPLETED"
+        assert data["jobs"][0]["proof_of_execution"]["verified"] is True
+        assert data["missing"] == ["acr_missing"]
+
+        response = client.post("/jobs/lookup", json=[first, second])
+        assert [job["job_id"] for job in response.json()["jobs"]] == [first, second]
+
+    def test_bulk_callbacks(self):
+        """Test that a worker can report several results in one request"""
+        jobs = client.post("/jobs/batch", json=[{"prompt": "First"}, {"prompt": "Second"}]).json()["jobs"]
+        first, second = jobs[0]["job_id"], jobs[1]["job_id"]
+
+        response = client.post("/jobs/callbacks", json=[
+            {"job_id": first, "status": "completed", "output_url": "outputs/first.png"},
+            {"job_id": "acr_missing", "status": "completed", "output_url": "outputs/missing.png"},
+            {"job_id": second, "status": "failed", "error": "CUDA out of memory"},
+        ])
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [r["status"] for r in results] == ["acknowledged", "not_found", "acknowledged"]
+        assert results[0]["proof_generated"] is True
+
+        assert get_job(first)["status"].value == "COMPLETED"
+        assert get_job(second)["error"] == "CUDA out of memory"
+
+    def test_resent_callback_not_reapplied(self):
+        """Test that a callback delivered twice only takes effect once"""
+        job_id = client.post("/jobs", json={"prompt": "Retried"}).json()["job_id"]
+        callback = {"status": "completed", "output_url": "outputs/retried.png"}
+
+        client.post(f"/jobs/{job_id}/callback", json=callback)
+        proof = get_job(job_id)["proof_of_execution"]
+        response = client.post("/jobs/callbacks", json=[{"job_id": job_id, **callback}])
+
+        assert response.json()["results"][0]["status"] == "duplicate"
+        assert get_job(job_id)["proof_of_execution"] == proof
+
+
+class TestJobOutput:
+    """Test output upload to the blob store and ranged, conditional download"""
+
+    IMAGE = bytes(range(256)) * 40
+
+    @pytest.fixture(autouse=True)
+    def blob_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(BLOB_STORE, "directory", str(tmp_path))
+        monkeypatch.setattr(BLOB_STORE, "incoming", str(tmp_path / ".incoming"))
+
+    def upload(self, content=IMAGE):
+        job_id = client.post("/jobs", json={"prompt": "Uploaded"}).json()["job_id"]
+        response = client.put(f"/jobs/{job_id}/output", content=content, headers={"Content-Type": "image/png"})
+        return job_id, response
+
+    def test_upload_and_download(self):
+        """Test that an uploaded image is streamed back with its ETag"""
+        job_id, response = self.upload()
+        assert response.status_code == 200
+        upload = response.json()
+        assert upload["output_url"] == f"/jobs/{job_id}/output"
+        assert upload["size"] == len(self.IMAGE)
+
+        client.post(f"/jobs/{job_id}/callback", json={"status": "completed", "output_url": upload["output_url"]})
+        assert client.get(f"/jobs/{job_id}").json()["output_url"] == f"/jobs/{job_id}/output"
+
+        response = client.get(f"/jobs/{job_id}/output")
+        assert response.status_code == 200
+        assert response.content == self.IMAGE
+        assert response.headers["content-type"] == "image/png"
+        assert response.headers["etag"] == upload["etag"]
+        assert response.headers["accept-ranges"] == "bytes"
+
+    def test_range_requests(self):
+        """Test byte ranges, suffix ranges and unsatisfiable ranges"""
+        job_id, _ = self.upload()
+        size = len(self.IMAGE)
+
+        response = client.get(f"/jobs/{job_id}/output", headers={"Range": "bytes=100-199"})
+        assert response.status_code == 206
+        assert response.content == self.IMAGE[100:200]
+        assert response.headers["content-range"] == f"bytes 100-199/{size}"
+
+        response = client.get(f"/jobs/{job_id}/output", headers={"Range": "bytes=-10"})
+        assert response.content == self.IMAGE[-10:]
+
+        response = client.get(f"/jobs/{job_id}/output", headers={"Range": f"bytes={size}-"})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{size}"
+
+    def test_conditional_requests(self):
+        """Test If-None-Match and a stale If-Range"""
+        job_id, response = self.upload()
+        etag = response.json()["etag"]
+
+        response = client.get(f"/jobs/{job_id}/output", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+        response = client.get(f"/jobs/{job_id}/output", headers={"Range": "bytes=0-9", "If-Range": '"old"'})
+        assert response.status_code == 200
+        assert response.content == self.IMAGE
+
+    def test_missing_output(self):
+        """Test 404s for unknown jobs and jobs without output"""
+        job_id = client.post("/jobs", json={"prompt": "Pending"}).json()["job_id"]
+        assert client.get(f"/jobs/{job_id}/output").status_code == 404
+        assert client.put("/jobs/acr_missing/output", content=b"x").status_code == 404
+
+    def test_upload_size_limit(self, monkeypatch):
+        """Test that oversized uploads are rejected"""
+        monkeypatch.setattr(get_settings(), "max_output_mb", 0)
+        _, response = self.upload()
+        assert response.status_code == 413
+
+    def test_cache_hit_output(self, tmp_path):
+        """Test that jobs completed from the result cache serve the cached file"""
+        output_path = tmp_path / "render.png"
+        output_path.write_bytes(self.IMAGE)
+        request = {"prompt": "A cached lighthouse", "steps": 20, "seed": 7}
+
+        first = client.post("/jobs", json=request).json()["job_id"]
+        client.post(f"/jobs/{first}/callback", json={"status": "completed", "output_url": str(output_path)})
+        second = client.post("/jobs", json=request).json()["job_id"]
+
+        response = client.get(f"/jobs/{second}/output")
+        assert response.status_code == 200
+        assert response.content == self.IMAGE
+
+
+class TestJobEvents:
+    """Test SSE and WebSocket job status streams"""
+
+    def submit(self):
+        response = client.post(
+            "/jobs",
+            json={
+                "type": "TEXT_TO_IMAGE",
+                "prompt": "Streamed",
+                "steps": 20
+            }
+        )
+        return response.json()["job_id"]
+
+    def test_sse_nonexistent_job(self):
+        """Test that streaming a missing job returns 404"""
+        assert client.get("/jobs/nonexistent/events").status_code == 404
+
+    def test_sse_finished_job(self):
+        """Test that a finished job streams its state once and closes"""
+        job_id = self.submit()
+        client.post(
+            f"/jobs/{job_id}/callback",
+            json={"status": "failed", "error": "Out of memory on GPU"}
+        )
+
+        with client.stream("GET", f"/jobs/{job_id}/events") as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/event-stream")
+            body = response.read().decode()
+
+        assert body.count("event: status") == 1
+        assert '"status": "FAILED"' in body
+
+    def test_stream_pushes_transitions_from_other_threads(self):
+        """Test that updates made on threadpool threads reach the stream"""
+        job_id = self.submit()
+
+        async def watch():
+            events = job_event_stream(job_id)
+            first = await events.__anext__()
+            threading.Thread(
+                target=update_job,
+                args=(get_job(job_id), {"status": "completed", "output_url": "outputs/sse.png"}),
+            ).start()
+            second = await asyncio.wait_for(events.__anext__(), 5)
+            await events.aclose()
+            return first, second
+
+        first, second = asyncio.run(watch())
+        assert first["status"] == "PENDING"
+        assert second["status"] == "COMPLETED"
+        assert second["output_url"] == "outputs/sse.png"
+
+    def test_websocket_pushes_transitions(self):
+        """Test that the WebSocket stream delivers state changes"""
+        job_id = self.submit()
+
+        with client.websocket_connect(f"/jobs/{job_id}/ws") as websocket:
+            assert websocket.receive_json()["status"] == "PENDING"
+
+            client.post(
+                f"/jobs/{job_id}/callback",
+                json={"status": "completed", "output_url": "outputs/ws.png"}
+            )
+            event = websocket.receive_json()
+            assert event["status"] == "COMPLETED"
+            assert event["output_url"] == "outputs/ws.png"
+
+
+class TestJobProgress:
+    """Test worker-reported step progress and latent previews"""
+
+    PREVIEW = b"\xff\xd8\xff\xe0 preview"
+
+    def submit(self, previews=True):
+        response = client.post("/jobs", json={"prompt": "Progressive", "steps": 20, "previews": previews})
+        return response.json()["job_id"]
+
+    def report(self, job_id, step, step_ms=80.0):
+        return client.post(
+            "/jobs/progress",
+            json=[{"job_id": job_id, "step": step, "total_steps": 20, "step_ms": step_ms, "avg_step_ms": step_ms}],
+        ).json()["results"]
+
+    def test_progress_marks_job_running(self):
+        """Test that the first step report marks the job RUNNING with its progress"""
+        job_id = self.submit()
+        assert self.report(job_id, 5) == [{"job_id": job_id, "status": "acknowledged"}]
+
+        data = client.get(f"/jobs/{job_id}").json()
+        assert data["status"] == "RUNNING"
+        assert data["progress"]["step"] == 5
+        assert data["progress"]["fraction"] == 0.25
+        assert data["preview_url"] is None
+
+    def test_previews_in_payload(self):
+        """Test that opting in to previews reaches the worker"""
+        job_id = self.submit()
+        assert get_job(job_id)["previews"] is True
+        assert get_job(self.submit(previews=False))["previews"] is False
+
+    def test_preview_upload_and_download(self):
+        """Test that the latest preview is served until the job finishes"""
+        job_id = self.submit()
+        self.report(job_id, 10)
+
+        response = client.put(
+            f"/jobs/{job_id}/preview?step=10",
+            content=self.PREVIEW,
+            headers={"Content-Type": "image/jpeg"},
+        )
+        assert response.json()["preview_url"] == f"/jobs/{job_id}/preview"
+        assert client.get(f"/jobs/{job_id}").json()["progress"]["preview_step"] == 10
+
+        response = client.get(f"/jobs/{job_id}/preview")
+        assert response.status_code == 200
+        assert response.content == self.PREVIEW
+        assert response.headers["x-preview-step"] == "10"
+
+        update_job(get_job(job_id), {"status": "completed", "output_url": "outputs/p.png", "avg_step_ms": 80.0})
+        assert client.get(f"/jobs/{job_id}/preview").status_code == 404
+
+        data = client.get(f"/jobs/{job_id}").json()
+        assert data["preview_url"] is None
+        assert data["progress"]["fraction"] == 1.0
+        assert data["execution"]["avg_step_ms"] == 80.0
+
+    def test_preview_size_limit(self, monkeypatch):
+        """Test that oversized previews are rejected"""
+        monkeypatch.setattr(get_settings(), "max_preview_kb", 1)
+        job_id = self.submit()
+        assert client.put(f"/jobs/{job_id}/preview", content=b"x" * 2048).status_code == 413
+
+    def test_progress_for_finished_job(self):
+        """Test that workers are told when a job no longer needs its steps"""
+        job_id = self.submit()
+        update_job(get_job(job_id), {"status": "failed", "error": "Out of memory on GPU"})
+        assert self.report(job_id, 3) == [{"job_id": job_id, "status": "finished"}]
+        assert self.report("acr_missing", 3) == [{"job_id": "acr_missing", "status": "not_found"}]
+
+    def test_step_times_by_model(self):
+        """Test that per-step timings are reported per model for capacity planning"""
+        for step_ms in (50.0, 70.0):
+            job_id = self.submit()
+            update_job(get_job(job_id), {"status": "completed", "output_url": "outputs/s.png", "avg_step_ms": step_ms})
+
+        step_times = client.get("/system/stats").json()["step_ms_by_model"]
+        assert step_times[get_settings().model_id]["count"] == 2
+
+    def test_stream_pushes_progress(self):
+        """Test that step reports reach the event stream as progress events"""
+        job_id = self.submit()
+        self.report(job_id, 1)
+
+        async def watch():
+            events = job_event_stream(job_id)
+            await events.__anext__()
+            threading.Thread(target=self.report, args=(job_id, 2)).start()
+            event = await asyncio.wait_for(events.__anext__(), 5)
+            await events.aclose()
+            return event
+
+        event = asyncio.run(watch())
+        assert event["event"] == "progress"
+        assert event["status"] == "RUNNING"
+        assert event["progress"]["step"] == 2
+
+
+class TestCancellation:
+    """Test DELETE /jobs/{id} and deadline enforcement"""
+
+    def submit(self, prompt="Abandoned", **fields):
+        return client.post("/jobs", json={"prompt": prompt, "steps": 20, **fields}).json()["job_id"]
+
+    def lease(self):
+        return client.post("/workers/lease", json={"worker_id": "w1", "max_jobs": 4}).json()["leases"]
+
+    def test_cancel_queued_job(self):
+        """Test that a cancelled job is dropped from the queue"""
+        job_id = self.submit()
+
+        response = client.delete(f"/jobs/{job_id}")
+        assert response.status_code == 200
+        assert response.json()["status"] == "CANCELLED"
+        assert self.lease() == []
+
+        terminations = client.get("/system/stats").json()["terminations"]
+        assert terminations == {"cancelled": 1, "timed_out": 0, "dequeued": 1}
+
+    def test_cancel_running_job(self):
+        """Test that the worker of a cancelled job is told and its late result dropped"""
+        job_id = self.submit()
+        lease_id = self.lease()[0]["lease_id"]
+
+        client.delete(f"/jobs/{job_id}")
+
+        assert client.post(f"/workers/leases/{lease_id}/heartbeat").status_code == 404
+        progress = client.post("/jobs/progress", json=[{"job_id": job_id, "step": 4}]).json()
+        assert progress["results"][0]["status"] == "finished"
+
+        result = client.post(f"/jobs/{job_id}/callback", json={"status": "completed", "output_url": "outputs/late.png"})
+        assert result.json()["status"] == "cancelled"
+        assert client.get(f"/jobs/{job_id}").json()["status"] == "CANCELLED"
+
+    def test_cancel_finished_or_missing_job(self):
+        """Test that only unfinished jobs can be cancelled"""
+        job_id = self.submit()
+        client.post(f"/jobs/{job_id}/callback", json={"status": "completed", "output_url": "outputs/done.png"})
+
+        assert client.delete(f"/jobs/{job_id}").status_code == 409
+        assert client.delete("/jobs/acr_missing").status_code == 404
+
+    def test_cancel_coalesced_jobs(self):
+        """Test that cancelling a shared leader hands its run to a follower"""
+        leader_id = self.submit("Shared", seed=5)
+        follower_id = self.submit("Shared", seed=5)
+        self.lease()
+
+        assert client.delete(f"/jobs/{leader_id}").status_code == 200
+        follower = client.get(f"/jobs/{follower_id}").json()
+        assert follower["status"] == "PENDING"
+        assert (follower.get("execution") or {}).get("coalesced_with") is None
+
+        leases = self.lease()
+        assert [lease["job_id"] for lease in leases] == [follower_id]
+        assert leases[0]["payload"]["job_id"] == follower_id
+
+        client.post(f"/jobs/{follower_id}/callback", json={"status": "completed", "output_url": "outputs/shared.png"})
+        assert client.get(f"/jobs/{leader_id}").json()["status"] == "CANCELLED"
+        assert client.get(f"/jobs/{follower_id}").json()["status"] == "COMPLETED"
+
+    def test_cancel_coalesced_follower(self):
+        """Test that a follower cancels alone"""
+        leader_id = self.submit("Shared", seed=5)
+        follower_id = self.submit("Shared", seed=5)
+
+        assert client.delete(f"/jobs/{follower_id}").status_code == 200
+        client.post(f"/jobs/{leader_id}/callback", json={"status": "completed", "output_url": "outputs/shared.png"})
+        assert client.get(f"/jobs/{leader_id}").json()["status"] == "COMPLETED"
+        assert client.get(f"/jobs/{follower_id}").json()["status"] == "CANCELLED"
+
+    def test_leader_deadline_spares_followers(self):
+        """Test that a leader past its deadline hands its run to the latest-deadline follower"""
+        leader_id = self.submit("Shared", seed=5, timeout_seconds=60)
+        early_id = self.submit("Shared", seed=5, timeout_seconds=120)
+        late_id = self.submit("Shared", seed=5, timeout_seconds=600)
+        DEADLINES[:] = [(0.0, leader_id)]
+
+        assert reap_deadlines() == [leader_id]
+        assert client.get(f"/jobs/{leader_id}").json()["status"] == "FAILED"
+        assert [lease["job_id"] for lease in self.lease()] == [late_id]
+        assert get_job(early_id)["coalesced_with"] == late_id
+
+        client.post(f"/jobs/{late_id}/callback", json={"status": "completed", "output_url": "outputs/shared.png"})
+        assert client.get(f"/jobs/{early_id}").json()["status"] == "COMPLETED"
+        assert client.get(f"/jobs/{late_id}").json()["status"] == "COMPLETED"
+
+    def test_deadline_in_response_and_payload(self):
+        """Test that per-job timeouts set the deadline workers check"""
+        job_id = self.submit(timeout_seconds=60)
+        data = client.get(f"/jobs/{job_id}").json()
+        job = get_job(job_id)
+
+        assert (job["deadline"] - job["created_at"]).total_seconds() == 60
+        assert data["deadline"] is not None
+        assert self.lease()[0]["payload"]["deadline"] > time.time()
+        assert client.post("/jobs", json={"prompt": "x", "timeout_seconds": 0}).status_code == 422
+
+    def test_jobs_past_deadline_fail(self):
+        """Test that jobs still unfinished at their deadline are reaped to FAILED"""
+        job_id = self.submit()
+        self.lease()
+        DEADLINES[:] = [(0.0, job_id)]
+
+        assert reap_deadlines() == [job_id]
+        data = client.get(f"/jobs/{job_id}").json()
+        assert data["status"] == "FAILED"
+        assert data["error"].startswith("Deadline exceeded")
+        assert JOB_QUEUE.stats()["total"] == 0
+        assert client.get("/system/stats").json()["terminations"]["timed_out"] == 1
+
+    def test_late_result_after_deadline_dropped(self):
+        """Test that a job failed at its deadline stays failed when its result arrives late"""
+        job_id = self.submit()
+        self.lease()
+        DEADLINES[:] = [(0.0, job_id)]
+        reap_deadlines()
+
+        result = client.post(f"/jobs/{job_id}/callback", json={
+            "status": "completed", "output_url": "outputs/late.png", "steps_run": 20,
+        })
+        assert result.json()["status"] == "finished"
+        data = client.get(f"/jobs/{job_id}").json()
+        assert data["status"] == "FAILED"
+        assert data["output_url"] is None
+        assert data["compute_cost"] is None
+
+    def test_worker_reported_timeout_counted(self):
+        """Test that a deadline noticed by the worker is counted once"""
+        job_id = self.submit()
+        self.lease()
+        callback = {"status": "failed", "error": "Deadline exceeded after 12 steps", "timed_out": True}
+
+        client.post(f"/jobs/{job_id}/callback", json=callback)
+        client.post(f"/jobs/{job_id}/callback", json=callback)
+        assert client.get("/system/stats").json()["terminations"]["timed_out"] == 1
+
+
+class TestAdmissionControl:
+    """Test per-key rate limits and the queue-depth cap on submissions"""
+
+    def submit(self, prompt="Admitted", api_key="agent-1"):
+        return client.post("/jobs", json={"prompt": prompt, "steps": 20}, headers={"X-API-Key": api_key})
+
+    def test_rate_limit_per_key(self, monkeypatch):
+        """Test that a key over its bucket gets 429 while other keys are admitted"""
+        monkeypatch.setattr(ADMISSION, "rate_per_second", 0.1)
+        monkeypatch.setattr(ADMISSION, "burst", 2)
+
+        assert [self.submit(f"p{i}").status_code for i in range(3)] == [200, 200, 429]
+        response = self.submit("p3")
+        assert int(response.headers["retry-after"]) >= 1
+        assert self.submit("p4", api_key="agent-2").status_code == 200
+
+        response = client.post("/jobs/batch", json=[{"prompt": "b"}] * 2, headers={"X-API-Key": "agent-1"})
+        assert response.status_code == 429
+
+    def test_queue_depth_cap(self, monkeypatch):
+        """Test that a full queue refuses new work with Retry-After from the drain rate"""
+        monkeypatch.setattr(ADMISSION, "max_queue_depth", 2)
+        self.submit("q0")
+        self.submit("q1")
+
+        response = self.submit("q2")
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == str(ADMISSION.max_retry_after)
+
+        client.post("/workers/lease", json={"worker_id": "w1", "max_jobs": 1})
+        assert self.submit("q3").status_code == 200
+        admission = client.get("/system/stats").json()["admission"]
+        assert admission["queue_full"] == 1
+        assert admission["drain_rate_per_second"] > 0
+
+    def test_tenant_recorded_without_key(self):
+        """Test that jobs carry a hashed tenant, never the raw key"""
+        job_id = self.submit(api_key="super-secret").json()["job_id"]
+        assert "super-secret" not in get_job(job_id)["tenant"]
+
+
+class TestMetrics:
+    """Test the Prometheus /metrics endpoint"""
+
+    def scrape(self) -> dict:
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        samples = {}
+        for line in response.text.splitlines():
+            if line and not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_route_latency_uses_route_template(self):
+        """Test that requests are timed per route template, not per raw path"""
+        job_id = client.post("/jobs", json={"prompt": "Timed"}).json()["job_id"]
+        before = self.scrape().get('acr_http_request_duration_seconds_count{method="GET",route="/jobs/{job_id}"}', 0)
+        client.get(f"/jobs/{job_id}")
+        client.get("/jobs/acr_missing")
+
+        samples = self.scrape()
+        assert samples['acr_http_request_duration_seconds_count{method="GET",route="/jobs/{job_id}"}'] == before + 2
+        assert samples['acr_http_requests_total{method="GET",route="/jobs/{job_id}",status="404"}'] >= 1
+        assert not any(job_id in name for name in samples)
+
+    def test_job_state_and_worker_phase_times(self):
+        """Test that a leased and completed job records its state times and worker phases"""
+        before = self.scrape()
+        job_id = client.post("/jobs", json={"prompt": "Phased"}).json()["job_id"]
+        client.post("/workers/lease", json={"worker_id": "w1", "max_jobs": 1, "stats": {
+            "utilization": 0.5, "prompt_cache": {"hits": 3, "misses": 1},
+        }})
+
+        samples = self.scrape()
+        assert samples['acr_queue_leased_jobs'] == 1
+        assert samples['acr_worker_utilization{worker="w1"}'] == 0.5
+        assert samples['acr_worker_prompt_cache_lookups_total{worker="w1",result="hit"}'] == 3
+
+        client.post(f"/jobs/{job_id}/callback", json={
+            "status": "completed",
+            "output_url": "outputs/phased.png",
+            "execution_time": 2.5,
+            "model_load_ms": 500,
+            "encode_ms": 40,
+            "reported_at": time.time() - 0.2,
+        })
+
+        def delta(name):
+            return samples.get(name, 0) - before.get(name, 0)
+
+        samples = self.scrape()
+        assert delta('acr_job_state_seconds_count{state="pending"}') == 1
+        assert delta('acr_job_state_seconds_count{state="running"}') == 1
+        assert delta('acr_jobs_finished_total{status="COMPLETED"}') == 1
+        assert delta('acr_worker_phase_seconds_sum{phase="inference"}') == pytest.approx(2.0)
+        assert delta('acr_worker_phase_seconds_sum{phase="model_load"}') == pytest.approx(0.5)
+        assert delta('acr_worker_phase_seconds_sum{phase="encode"}') == pytest.approx(0.04)
+        assert delta('acr_worker_phase_seconds_sum{phase="callback"}') >= 0.2
+        assert get_job(job_id)["execution"]["model_load_ms"] == 500
+
+
+class TestLiveMarketplace:
+    """Test the async submit path against a stand-in marketplace"""
+
+    @pytest.fixture(autouse=True)
+    def marketplace(self, monkeypatch):
+        monkeypatch.setitem(AIDP_CONFIG, "api_key", "test-key")
+        monkeypatch.setitem(AIDP_CONFIG, "use_real_api", True)
+        marketplace_app.state.requests = 0
+        marketplace_app.state.fail_rate = 0.0
+        AIDP_API_BREAKER.reset()
+        init_aidp_client(transport=httpx.ASGITransport(app=marketplace_app))
+        yield marketplace_app
+        asyncio.run(close_aidp_client())
+        AIDP_API_BREAKER.reset()
+
+    def test_live_submission(self, marketplace):
+        """Test that a job is routed through the marketplace"""
+        response = client.post("/jobs", json={"prompt": "Live", "steps": 20})
+        assert response.status_code == 200
+        aidp = response.json()["aidp"]
+        assert aidp["api_mode"] == "live"
+        assert aidp["aidp_job_id"].startswith("aidp_live_")
+        assert aidp["assigned_node"]["gpu"] == "H100"
+        assert marketplace.state.requests == 1
+
+    def test_batch_shares_pooled_client(self, marketplace):
+        """Test that a batch is routed concurrently over the shared client"""
+        pooled = get_aidp_client()
+        response = client.post("/jobs/batch", json=[{"prompt": f"Live {i}"} for i in range(20)])
+        assert all(job["aidp"]["api_mode"] == "live" for job in response.json()["jobs"])
+        assert marketplace.state.requests == 20
+        assert get_aidp_client() is pooled
+
+    def test_marketplace_error_falls_back(self, marketplace):
+        """Test that marketplace errors fall back to simulated routing"""
+        marketplace.state.fail_rate = 1.0
+        response = client.post("/jobs", json={"prompt": "Fallback", "steps": 20})
+        assert response.status_code == 200
+        assert response.json()["aidp"]["api_mode"] == "simulation"
+
+    def test_circuit_opens_during_outage(self, marketplace):
+        """Test that an outage trips the breaker and later jobs skip the marketplace"""
+        marketplace.state.fail_rate = 1.0
+        for i in range(AIDP_API_BREAKER.min_calls):
+            client.post("/jobs", json={"prompt": f"Outage {i}"})
+        assert marketplace.state.requests == AIDP_API_BREAKER.min_calls
+
+        response = client.post("/jobs", json={"prompt": "Fast fail"})
+        assert response.json()["aidp"]["api_mode"] == "simulation"
+        assert marketplace.state.requests == AIDP_API_BREAKER.min_calls
+
+        health = client.get("/health").json()
+        assert health["status"] == "degraded"
+        assert health["aidp_api"]["circuit_breaker"]["state"] == "open"
+        assert health["aidp_api"]["circuit_breaker"]["rejected"] == 1
+
+
+    def test_cancelled_probe_releases_half_open_slot(self, marketplace, monkeypatch):
+        """Test that a probe cancelled mid-call lets the next call probe"""
+        monkeypatch.setattr(AIDP_API_BREAKER, "open_seconds", 0)
+        for _ in range(AIDP_API_BREAKER.min_calls):
+            AIDP_API_BREAKER.record_failure()
+        marketplace.state.latency_ms = 1000
+
+        async def probe():
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(_try_real_aidp_api({"prompt": "Slow"}), 0.05)
+            await close_aidp_client()
+
+        try:
+            asyncio.run(probe())
+        finally:
+            marketplace.state.latency_ms = 0
+        assert AIDP_API_BREAKER.state == "half_open"
+        assert AIDP_API_BREAKER.allow_request() is True
 
 class TestAPIDocumentation:
     """Test API documentation endpoints"""
@@ -328,6 +1510,13 @@ class TestAPIDocumentation:
         assert response.status_code == 200
         assert "swagger" in response.text.lower()
 
+    def test_health(self):
+        """Test the health endpoint in simulation mode"""
+        response = client.get("/health")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ok"
+        assert response.json()["aidp_api"]["mode"] == "simulation"
+
     def test_redoc_docs(self):
         """Test that ReDoc docs are available"""
         response = client.get("/redoc")
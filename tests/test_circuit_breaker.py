@@ -0,0 +1,78 @@
+"""
+Tests for the marketplace circuit breaker
+"""
+
+from api.services.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock):
+    return CircuitBreaker(
+        "test",
+        failure_rate_threshold=0.5,
+        window_size=10,
+        min_calls=4,
+        open_seconds=30,
+        clock=clock,
+    )
+
+
+class TestCircuitBreaker:
+    """Test state transitions"""
+
+    def test_opens_on_failure_rate(self):
+        breaker = make_breaker(FakeClock())
+        for outcome in (True, False, True):
+            breaker.record_failure() if outcome else breaker.record_success()
+        assert breaker.state == CLOSED  # below min_calls
+
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        assert breaker.allow_request() is False
+        assert breaker.snapshot()["rejected"] == 1
+
+    def test_half_open_probe_closes(self):
+        clock = FakeClock()
+        breaker = make_breaker(clock)
+        for _ in range(4):
+            breaker.record_failure()
+
+        clock.now = 31
+        assert breaker.state == HALF_OPEN
+        assert breaker.allow_request() is True
+        assert breaker.allow_request() is False  # one probe at a time
+
+        breaker.record_success()
+        assert breaker.state == CLOSED
+        assert breaker.allow_request() is True
+
+    def test_failed_probe_reopens(self):
+        clock = FakeClock()
+        breaker = make_breaker(clock)
+        for _ in range(4):
+            breaker.record_failure()
+
+        clock.now = 31
+        assert breaker.allow_request() is True
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        assert breaker.snapshot()["retry_in_seconds"] == 30
+
+    def test_released_probe_frees_its_slot(self):
+        clock = FakeClock()
+        breaker = make_breaker(clock)
+        for _ in range(4):
+            breaker.record_failure()
+
+        clock.now = 31
+        assert breaker.allow_request() is True
+        breaker.release()  # cancelled: no outcome
+        assert breaker.state == HALF_OPEN
+        assert breaker.allow_request() is True
@@ -0,0 +1,205 @@
+"""
+Tests for the lease-based job queue
+"""
+
+import time
+
+from api.services.job_queue import JobQueue
+
+
+class TestJobQueue:
+    """Test lease expiry, retries and journaling"""
+
+    def test_expired_lease_is_redelivered(self):
+        queue = JobQueue(visibility_timeout=0.01, max_attempts=3)
+        queue.enqueue("job_1", {"prompt": "a"})
+
+        assert queue.lease("w1")[0]["job_id"] == "job_1"
+        time.sleep(0.02)
+
+        requeued, dead = queue.reap_expired()
+        assert requeued == ["job_1"]
+        assert dead == []
+        assert queue.lease("w2")[0]["attempt"] == 2
+
+    def test_heartbeat_keeps_lease(self):
+        queue = JobQueue(visibility_timeout=0.05)
+        queue.enqueue("job_1", {})
+        lease_id = queue.lease("w1")[0]["lease_id"]
+
+        time.sleep(0.03)
+        assert queue.heartbeat(lease_id, 1.0) is not None
+        time.sleep(0.03)
+
+        assert queue.reap_expired() == ([], [])
+        assert queue.stats()["leased"] == 1
+
+    def test_dead_letter_after_max_attempts(self):
+        queue = JobQueue(visibility_timeout=0.01, max_attempts=2)
+        queue.enqueue("job_1", {})
+
+        for _ in range(2):
+            queue.lease("w1")
+            time.sleep(0.02)
+            requeued, dead = queue.reap_expired()
+
+        assert dead == ["job_1"]
+        assert queue.stats()["total"] == 0
+
+    def test_lease_batches_compatible_jobs(self):
+        queue = JobQueue()
+        queue.enqueue("job_1", {}, batch_key="TEXT_TO_IMAGE:20")
+        queue.enqueue("job_2", {}, batch_key="TEXT_TO_IMAGE:30")
+        queue.enqueue("job_3", {}, batch_key="TEXT_TO_IMAGE:20")
+
+        leases = queue.lease("w1", max_jobs=4)
+        assert [lease["job_id"] for lease in leases] == ["job_1", "job_3"]
+
+        assert queue.lease("w1", max_jobs=4, batch_key="TEXT_TO_IMAGE:20") == []
+        assert queue.lease("w1", max_jobs=4)[0]["job_id"] == "job_2"
+        assert queue.stats()["ready"] == 0
+
+    def test_unbatchable_jobs_lease_alone(self):
+        queue = JobQueue()
+        queue.enqueue("job_1", {})
+        queue.enqueue("job_2", {})
+
+        assert len(queue.lease("w1", max_jobs=4)) == 1
+        assert queue.stats()["ready"] == 1
+
+    def test_journal_replay(self, tmp_path):
+        journal = str(tmp_path / "queue.jsonl")
+
+        queue = JobQueue(journal_path=journal)
+        queue.enqueue("job_1", {"prompt": "a"})
+        queue.enqueue("job_2", {"prompt": "b"})
+        queue.ack(queue.lease("w1")[0]["lease_id"])
+
+        # A restarted router sees only the unacknowledged job
+        restarted = JobQueue(journal_path=journal)
+        leases = restarted.lease("w1", max_jobs=5)
+        assert [lease["job_id"] for lease in leases] == ["job_2"]
+        assert leases[0]["payload"] == {"prompt": "b"}
+
+    def test_lease_prefers_warm_affinity(self):
+        queue = JobQueue()
+        queue.enqueue("job_1", {}, batch_key="sd15:20", affinity="sd15")
+        queue.enqueue("job_2", {}, batch_key="tiny:20", affinity="tiny")
+        queue.enqueue("job_3", {}, batch_key="tiny:20", affinity="tiny")
+
+        leases = queue.lease("w1", max_jobs=4, prefer_affinities=["tiny"])
+        assert [lease["job_id"] for lease in leases] == ["job_2", "job_3"]
+        assert queue.lease("w2", max_jobs=4, prefer_affinities=["tiny"])[0]["job_id"] == "job_1"
+
+    def test_affinity_does_not_starve_old_jobs(self):
+        queue = JobQueue(affinity_max_wait=0.01)
+        queue.enqueue("job_1", {}, affinity="sd15")
+        queue.enqueue("job_2", {}, affinity="tiny")
+        time.sleep(0.02)
+
+        assert queue.lease("w1", prefer_affinities=["tiny"])[0]["job_id"] == "job_1"
+
+    def test_urgent_priority_leased_first(self):
+        queue = JobQueue()
+        queue.enqueue("job_1", {}, priority=2)
+        queue.enqueue("job_2", {}, priority=1)
+        queue.enqueue("job_3", {}, priority=0)
+
+        assert [queue.lease("w1")[0]["job_id"] for _ in range(3)] == ["job_3", "job_2", "job_1"]
+
+    def test_max_priority_only_leases_more_urgent_jobs(self):
+        queue = JobQueue()
+        queue.enqueue("job_1", {}, priority=1)
+
+        assert queue.lease("w1", max_priority=0) == []
+        queue.enqueue("job_2", {}, priority=0)
+        assert queue.lease("w1", max_priority=0)[0]["job_id"] == "job_2"
+        assert queue.stats()["ready_by_priority"] == {1: 1}
+
+    def test_batch_fill_stays_at_first_pick_level(self):
+        queue = JobQueue()
+        queue.enqueue("batch_1", {}, batch_key="k", priority=2)
+        queue.enqueue("urgent", {}, batch_key="k", priority=0)
+        queue.enqueue("batch_2", {}, batch_key="k", priority=2)
+
+        assert [lease["job_id"] for lease in queue.lease("w1", max_jobs=4, max_priority=1)] == ["urgent"]
+        assert queue.lease("w1", max_jobs=4, batch_key="k", max_priority=1) == []
+        assert [lease["job_id"] for lease in queue.lease("w1", max_jobs=4, batch_key="k")] == ["batch_1", "batch_2"]
+
+    def test_batch_fill_in_fair_order(self):
+        queue = JobQueue()
+        for i in range(3):
+            queue.enqueue(f"flood_{i}", {}, batch_key="k", tenant="flood")
+        queue.enqueue("polite_0", {}, batch_key="k", tenant="polite")
+
+        assert [lease["job_id"] for lease in queue.lease("w1", max_jobs=3)] == ["flood_0", "polite_0", "flood_1"]
+
+    def test_promote_moves_job_to_urgent_level(self, tmp_path):
+        journal = str(tmp_path / "queue.jsonl")
+        queue = JobQueue(journal_path=journal)
+        queue.enqueue("job_1", {"priority": "batch"}, batch_key="k", affinity="m", priority=2)
+
+        assert queue.promote("job_1", 0, {"priority": "interactive"})
+        assert not queue.promote("job_1", 1)
+        assert queue.stats()["ready_by_priority"] == {0: 1}
+        assert JobQueue(journal_path=journal).stats()["ready_by_priority"] == {0: 1}
+
+        leases = queue.lease("w1", max_jobs=2, prefer_affinities=["m"], max_priority=0)
+        assert [lease["job_id"] for lease in leases] == ["job_1"]
+        assert leases[0]["payload"]["priority"] == "interactive"
+        assert queue.lease("w1", batch_key="k") == []
+
+    def test_priority_survives_journal_replay(self, tmp_path):
+        journal = str(tmp_path / "queue.jsonl")
+
+        queue = JobQueue(journal_path=journal)
+        queue.enqueue("job_1", {}, priority=2)
+        queue.enqueue("job_2", {}, priority=0)
+
+        restarted = JobQueue(journal_path=journal)
+        assert restarted.lease("w1")[0]["job_id"] == "job_2"
+
+    def test_cancel_drops_ready_and_leased_jobs(self, tmp_path):
+        journal = str(tmp_path / "queue.jsonl")
+        queue = JobQueue(journal_path=journal)
+        queue.enqueue("job_1", {})
+        queue.enqueue("job_2", {})
+        lease_id = queue.lease("w1")[0]["lease_id"]
+
+        assert queue.cancel("job_1") == "leased"
+        assert queue.heartbeat(lease_id) is None
+        assert queue.cancel("job_2") == "ready"
+        assert queue.cancel("job_2") is None
+        assert queue.lease("w1") == []
+        assert JobQueue(journal_path=journal).stats()["total"] == 0
+
+    def test_tenants_share_queue_fairly(self):
+        queue = JobQueue()
+        for i in range(4):
+            queue.enqueue(f"flood_{i}", {}, tenant="flood")
+        queue.enqueue("polite_0", {}, tenant="polite")
+        queue.enqueue("polite_1", {}, tenant="polite")
+
+        order = [queue.lease("w1")[0]["job_id"] for _ in range(6)]
+        assert order == ["flood_0", "polite_0", "flood_1", "polite_1", "flood_2", "flood_3"]
+
+    def test_idle_tenant_tags_pruned(self):
+        queue = JobQueue()
+        for i in range(1000):
+            queue.enqueue(f"job_{i}", {}, tenant=f"key_{i}")
+        while queue.lease("w1", max_jobs=100):
+            pass
+
+        for i in range(100):
+            queue.enqueue(f"new_{i}", {}, tenant=f"new_{i}")
+        assert len(queue._tenant_tags) < 1024
+        assert queue.lease("w1")[0]["job_id"] == "new_0"
+
+    def test_tenant_weights(self):
+        queue = JobQueue(tenant_weights={"gold": 2.0})
+        for i in range(4):
+            queue.enqueue(f"basic_{i}", {}, tenant="basic")
+            queue.enqueue(f"gold_{i}", {}, tenant="gold")
+
+        order = [queue.lease("w1")[0]["job_id"] for _ in range(6)]
+        assert sum(job_id.startswith("gold") for job_id in order) == 4
@@ -0,0 +1,192 @@
+"""
+Tests for the job store backends
+"""
+
+import time
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import inspect
+
+from api.main import app
+from api.models.job import JobStatus, JobType
+from api.services import job_manager
+from api.services.job_archive import JobArchive
+from api.services.job_store import MemoryJobStore, SQLJobStore
+
+
+def make_job(job_id="acr_0000000001", status=JobStatus.PENDING):
+    return {
+        "id": job_id,
+        "type": JobType.TEXT_TO_IMAGE,
+        "prompt": "A lighthouse",
+        "steps": 30,
+        "status": status,
+        "created_at": datetime(2025, 1, 8, 12, 34, 56),
+        "output_url": None,
+        "aidp_data": {"assigned_node": {"node_id": "aidp_node_01"}},
+    }
+
+
+@pytest.fixture
+def sql_store(tmp_path):
+    store = SQLJobStore(f"sqlite:///{tmp_path}/jobs.db", flush_interval=60)
+    yield store
+    store.close()
+
+
+class TestMemoryJobStore:
+    """Test the in-process dict backend"""
+
+    def test_roundtrip(self):
+        store = MemoryJobStore()
+        job = make_job()
+        store.add(job)
+        assert store.get(job["id"]) is job
+        assert store.get("missing") is None
+
+
+class TestJobRetention:
+    """Test LRU/TTL eviction and the job archive"""
+
+    def test_lru_eviction_archives_jobs(self, tmp_path):
+        store = MemoryJobStore(max_live_jobs=2, archive=JobArchive(str(tmp_path / "archive.jsonl")))
+        for i in range(3):
+            store.add(make_job(f"acr_{i:010d}", JobStatus.COMPLETED))
+            if i == 1:
+                store.get("acr_0000000000")  # touch: job 1 becomes least recently used
+
+        assert list(store.jobs) == ["acr_0000000000", "acr_0000000002"]
+        assert store.stats()["evicted_lru"] == 1
+
+        archived = store.get("acr_0000000001")
+        assert archived["prompt"] == "A lighthouse"
+        assert archived["status"] is JobStatus.COMPLETED
+        assert store.stats()["archive_hits"] == 1
+
+    def test_lru_eviction_keeps_unfinished_jobs(self):
+        store = MemoryJobStore(max_live_jobs=2)
+        store.add(make_job("acr_0000000001"))
+        store.add(make_job("acr_0000000002", JobStatus.COMPLETED))
+        store.add(make_job("acr_0000000003", JobStatus.RUNNING))
+        assert sorted(store.jobs) == ["acr_0000000001", "acr_0000000003"]
+
+        # Nothing left to evict: the bound gives way
+        store.add(make_job("acr_0000000004"))
+        assert len(store.jobs) == 3
+        assert store.stats()["evicted_lru"] == 1
+
+    def test_terminal_ttl_eviction(self):
+        store = MemoryJobStore(terminal_ttl=0.01)
+        job = make_job()
+        store.add(job)
+        job["status"] = JobStatus.COMPLETED
+        store.save(job)
+
+        time.sleep(0.02)
+        store.add(make_job("acr_0000000002"))
+
+        assert store.get(job["id"]) is None
+        assert store.stats()["evicted_ttl"] == 1
+        assert len(store) == 1
+
+    def test_archive_index_survives_restart(self, tmp_path):
+        path = str(tmp_path / "archive.jsonl")
+        store = MemoryJobStore(max_live_jobs=1, archive=JobArchive(path))
+        store.add(make_job("acr_0000000001", JobStatus.COMPLETED))
+        store.add(make_job("acr_0000000002"))
+
+        restarted = MemoryJobStore(archive=JobArchive(path))
+        assert restarted.get("acr_0000000001")["id"] == "acr_0000000001"
+
+    def test_archived_job_served_by_api(self, tmp_path, monkeypatch):
+        store = MemoryJobStore(max_live_jobs=1, archive=JobArchive(str(tmp_path / "archive.jsonl")))
+        monkeypatch.setattr(job_manager, "JOB_STORE", store)
+        client = TestClient(app)
+
+        first = client.post("/jobs", json={"prompt": "Evicted", "steps": 20}).json()["job_id"]
+        client.post(f"/jobs/{first}/callback", json={"status": "completed", "output_url": "outputs/evicted.png"})
+        client.post("/jobs", json={"prompt": "Live", "steps": 20})
+        job_manager.JOB_QUEUE.clear()
+
+        assert first not in store.jobs
+        data = client.get(f"/jobs/{first}").json()
+        assert data["status"] == "COMPLETED"
+        assert data["aidp"]["aidp_job_id"].startswith("aidp_")
+
+        stats = client.get("/system/stats").json()
+        assert stats["job_store"]["evicted_lru"] == 1
+        assert stats["job_store"]["archived_jobs"] == 1
+
+
+class TestSQLJobStore:
+    """Test the SQLAlchemy backend"""
+
+    def test_roundtrip_preserves_types(self, sql_store):
+        sql_store.add(make_job())
+
+        job = sql_store.get("acr_0000000001")
+        assert job["status"] is JobStatus.PENDING
+        assert job["type"] is JobType.TEXT_TO_IMAGE
+        assert job["created_at"] == datetime(2025, 1, 8, 12, 34, 56)
+        assert job["aidp_data"]["assigned_node"]["node_id"] == "aidp_node_01"
+
+    def test_buffered_updates_are_readable_and_flushed(self, sql_store, tmp_path):
+        sql_store.add(make_job())
+
+        job = sql_store.get("acr_0000000001")
+        job["status"] = JobStatus.COMPLETED
+        sql_store.save(job)
+
+        # Visible before the batch is written
+        assert sql_store.get("acr_0000000001")["status"] is JobStatus.COMPLETED
+
+        sql_store.flush()
+        other_process = SQLJobStore(f"sqlite:///{tmp_path}/jobs.db")
+        assert other_process.get("acr_0000000001")["status"] is JobStatus.COMPLETED
+        other_process.close()
+
+    def test_get_many(self, sql_store):
+        sql_store.add_many([make_job(f"acr_{i:010d}") for i in range(3)])
+        job = sql_store.get("acr_0000000001")
+        job["status"] = JobStatus.RUNNING
+        sql_store.save(job)
+
+        found = sql_store.get_many(["acr_0000000000", "acr_0000000001", "acr_missing"])
+        assert set(found) == {"acr_0000000000", "acr_0000000001"}
+        assert found["acr_0000000001"]["status"] is JobStatus.RUNNING
+
+    def test_batch_size_triggers_flush(self, tmp_path):
+        store = SQLJobStore(f"sqlite:///{tmp_path}/jobs.db", write_batch_size=2, flush_interval=60)
+        for i in range(2):
+            job = make_job(f"acr_{i:010d}")
+            store.add(job)
+            store.save(job)
+
+        store._flusher.join(0.5)
+        assert store._pending == {}
+        store.close()
+
+    def test_indexes(self, sql_store):
+        indexes = {tuple(index["column_names"]) for index in inspect(sql_store.engine).get_indexes("jobs")}
+        assert ("status",) in indexes
+        assert ("created_at",) in indexes
+        assert ("status", "created_at") in indexes
+
+    def test_api_with_sql_backend(self, sql_store, monkeypatch):
+        monkeypatch.setattr(job_manager, "JOB_STORE", sql_store)
+        client = TestClient(app)
+
+        job_id = client.post("/jobs", json={"prompt": "Stored in SQL", "steps": 20}).json()["job_id"]
+        client.post(
+            f"/jobs/{job_id}/callback",
+            json={"status": "completed", "output_url": "outputs/sql.png", "execution_time": 1.5}
+        )
+        sql_store.flush()
+        job_manager.JOB_QUEUE.clear()
+
+        data = client.get(f"/jobs/{job_id}").json()
+        assert data["status"] == "COMPLETED"
+        assert data["output_url"] == "outputs/sql.png"
+        assert data["proof_of_execution"]["verified"] is True
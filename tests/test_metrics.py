@@ -0,0 +1,71 @@
+"""
+Tests for the metrics registry and its text exposition format
+"""
+
+import gc
+import threading
+
+from api.core.metrics import Histogram, Registry
+
+
+class TestMetrics:
+    """Test sharded counters, histogram buckets and rendering"""
+
+    def test_counter_sums_thread_shards(self):
+        registry = Registry()
+        requests = registry.counter("requests_total", "Requests", ("route",))
+        child = requests.labels("/jobs")
+
+        def work():
+            for _ in range(1000):
+                child.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert child.value() == 4000
+        assert requests.labels("/jobs") is child
+
+    def test_exited_threads_fold_into_base(self):
+        registry = Registry()
+        child = registry.counter("jobs_total", "Jobs").labels()
+
+        for _ in range(50):
+            thread = threading.Thread(target=child.inc, args=(2,))
+            thread.start()
+            thread.join()
+        gc.collect()
+
+        assert child.value() == 100
+        assert len(child._shards) <= 1
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+
+        cumulative, total, count = histogram.snapshot()
+        # Upper bounds are inclusive, the last bucket is +Inf
+        assert cumulative == [2, 3, 4]
+        assert total == 2.65
+        assert count == 4
+
+    def test_render_text_format(self):
+        registry = Registry()
+        registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.5,)).labels('/a"b').observe(0.25)
+        registry.counter("plain_total", "No labels").inc(3)
+        registry.collector(lambda: [("depth", "gauge", "Depth", [({"state": "ready"}, 2), ({"state": "x"}, None)])])
+
+        text = registry.render()
+        assert "# TYPE latency_seconds histogram" in text
+        assert 'latency_seconds_bucket{route="/a\\"b",le="0.5"} 1' in text
+        assert 'latency_seconds_bucket{route="/a\\"b",le="+Inf"} 1' in text
+        assert 'latency_seconds_sum{route="/a\\"b"} 0.25' in text
+        assert 'latency_seconds_count{route="/a\\"b"} 1' in text
+        assert "plain_total 3\n" in text
+        assert 'depth{state="ready"} 2' in text
+        # Samples without a value are left out
+        assert 'state="x"' not in text
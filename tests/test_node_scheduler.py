@@ -0,0 +1,63 @@
+"""
+Tests for GPU node selection
+"""
+
+import random
+
+import pytest
+
+from api.services.node_scheduler import NodeScheduler, SCHEDULER_POLICIES
+
+NODES = [
+    {"node_id": "a100_us", "gpu": "A100", "region": "us-east"},
+    {"node_id": "a100_eu", "gpu": "A100", "region": "eu-west"},
+    {"node_id": "4090_ap", "gpu": "RTX4090", "region": "asia-pacific"},
+]
+
+
+class TestNodeScheduler:
+    """Test scheduling policies and load tracking"""
+
+    def test_prefers_fastest_idle_node(self):
+        scheduler = NodeScheduler(NODES)
+        assert scheduler.select(30)["gpu"] == "A100"
+
+    def test_spreads_load(self):
+        scheduler = NodeScheduler(NODES)
+        picked = {scheduler.select(30)["node_id"] for _ in range(3)}
+        assert picked == {"a100_us", "a100_eu", "4090_ap"}
+
+    def test_release_updates_speed_estimate(self):
+        scheduler = NodeScheduler(NODES, ewma_alpha=1.0)
+        node = scheduler.select(10)
+        scheduler.release(node["node_id"], 10, execution_time=20.0)
+
+        stats = scheduler.stats()["nodes"][node["node_id"]]
+        assert stats["in_flight"] == 0
+        assert stats["seconds_per_step"] == 2.0
+        # The slow node is now avoided
+        assert scheduler.select(10)["node_id"] != node["node_id"]
+
+    def test_region_preference(self):
+        scheduler = NodeScheduler(NODES, region_penalty_seconds=100)
+        assert scheduler.select(30, region="asia-pacific")["node_id"] == "4090_ap"
+
+    def test_region_falls_back_when_overloaded(self):
+        scheduler = NodeScheduler(NODES, region_penalty_seconds=0.5)
+        for _ in range(3):
+            scheduler.select(50, region="asia-pacific")
+        assert scheduler.select(50, region="asia-pacific")["region"] != "asia-pacific"
+
+    def test_release_unknown_node_is_ignored(self):
+        scheduler = NodeScheduler(NODES)
+        scheduler.release("marketplace_node", 30, 5.0)
+
+    @pytest.mark.parametrize("policy", SCHEDULER_POLICIES)
+    def test_policies_pick_pool_nodes(self, policy):
+        scheduler = NodeScheduler(NODES, policy=policy, rng=random.Random(1))
+        for _ in range(10):
+            assert scheduler.select(30) in NODES
+
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            NodeScheduler(NODES, policy="round_robin")
@@ -0,0 +1,147 @@
+"""
+Tests for the worker's persistent callback outbox, against a fake router
+"""
+
+import os
+
+import pytest
+import requests
+
+from gpu_worker import outbox as outbox_module
+from gpu_worker.outbox import CallbackOutbox
+
+
+class FakeResponse:
+    def __init__(self, body: dict, status_code: int = 200):
+        self.body = body
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}")
+
+    def json(self):
+        return self.body
+
+
+class FakeRouter:
+    """Stands in for requests.post/put; fails the first `failures` callback posts."""
+
+    def __init__(self, failures: int = 0, status: str = "acknowledged"):
+        self.failures = failures
+        self.status = status
+        self.batches = []
+        self.uploads = []
+
+    def post(self, url, json, timeout):
+        if self.failures:
+            self.failures -= 1
+            raise requests.ConnectionError("router down")
+        self.batches.append(json)
+        return FakeResponse({"results": [{"job_id": item["job_id"], "status": self.status} for item in json]})
+
+    def put(self, url, data, headers, timeout):
+        self.uploads.append((url, data.read(), headers["Content-Type"]))
+        job_id = url.split("/")[-2]
+        return FakeResponse({"output_url": f"/jobs/{job_id}/output"})
+
+
+@pytest.fixture
+def router(monkeypatch):
+    fake = FakeRouter()
+    monkeypatch.setattr(outbox_module.requests, "post", fake.post)
+    monkeypatch.setattr(outbox_module.requests, "put", fake.put)
+    monkeypatch.setattr(outbox_module, "OUTBOX_RETRY_BASE_SECONDS", 0.01)
+    return fake
+
+
+@pytest.fixture
+def outboxes():
+    started = []
+
+    def start(outbox: CallbackOutbox) -> CallbackOutbox:
+        outbox.start()
+        started.append(outbox)
+        return outbox
+
+    yield start
+    for outbox in started:
+        outbox.stop()
+        # Not past the fake router's lifetime
+        outbox.join(5)
+
+
+def make_outbox(directory, **kwargs) -> CallbackOutbox:
+    return CallbackOutbox("http://router", directory=str(directory), batch_window_ms=1, **kwargs)
+
+
+def entries(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+
+
+class TestCallbackOutbox:
+    """Test journaling, replay, batching, retries and pruning"""
+
+    def test_undelivered_callbacks_survive_restart(self, tmp_path, router, outboxes):
+        crashed = make_outbox(tmp_path)  # never started: the worker died first
+        for i in range(3):
+            crashed.put(f"job_{i}", {"status": "completed", "output_url": f"outputs/{i}.png"})
+        assert len(entries(tmp_path)) == 3
+
+        restarted = make_outbox(tmp_path)
+        assert restarted.pending_job_ids() == ["job_0", "job_1", "job_2"]
+
+        assert outboxes(restarted).flush(5)
+        assert [item["job_id"] for item in router.batches[0]] == ["job_0", "job_1", "job_2"]
+        assert router.batches[0][0]["output_url"] == "outputs/0.png"
+
+    def test_callbacks_go_out_in_batches(self, tmp_path, router, outboxes):
+        outbox = make_outbox(tmp_path, batch_size=2)
+        for i in range(5):
+            outbox.put(f"job_{i}", {"status": "completed"})
+
+        assert outboxes(outbox).flush(5)
+        assert [len(batch) for batch in router.batches] == [2, 2, 1]
+        assert outbox.stats()["requests"] == 3
+
+    def test_retries_after_failures(self, tmp_path, router, outboxes):
+        router.failures = 2
+        delivered = []
+        outbox = make_outbox(tmp_path, on_delivered=delivered.append)
+        for i in range(5):
+            outbox.put(f"job_{i}", {"status": "completed"})
+
+        assert outboxes(outbox).flush(5)
+        assert len(router.batches) == 1
+        assert len(router.batches[0]) == 5
+        assert delivered == [f"job_{i}" for i in range(5)]
+        assert outbox.stats()["retries"] == 2
+
+    def test_delivered_entries_pruned(self, tmp_path, router, outboxes):
+        outbox = outboxes(make_outbox(tmp_path))
+        outbox.put("job_0", {"status": "completed"})
+
+        assert outbox.flush(5)
+        assert entries(tmp_path) == []
+        assert outbox.stats() == {"pending": 0, "delivered": 1, "uploaded": 0, "requests": 1, "retries": 0}
+
+    def test_unaccepted_callbacks_kept(self, tmp_path, router, outboxes):
+        router.status = "error"
+        outbox = outboxes(make_outbox(tmp_path))
+        outbox.put("job_0", {"status": "completed"})
+
+        assert not outbox.flush(0.3)
+        assert len(entries(tmp_path)) == 1
+        assert outbox.pending_job_ids() == ["job_0"]
+
+    def test_upload_before_callback(self, tmp_path, router, outboxes, monkeypatch):
+        monkeypatch.setattr(outbox_module, "OUTBOX_DELETE_UPLOADED", True)
+        image = tmp_path / "render.png"
+        image.write_bytes(b"png")
+        outbox = outboxes(make_outbox(tmp_path / "outbox"))
+        outbox.put("job_0", {"status": "completed"}, upload=str(image))
+
+        assert outbox.flush(5)
+        assert router.uploads == [("http://router/jobs/job_0/output", b"png", "image/png")]
+        assert router.batches[0][0]["output_url"] == "/jobs/job_0/output"
+        assert not image.exists()
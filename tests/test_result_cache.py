@@ -0,0 +1,60 @@
+"""
+Tests for the on-disk result cache
+"""
+
+import os
+
+from api.services.result_cache import ResultCache
+
+
+def make_image(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+class TestResultCache:
+    """Test lookups, LRU eviction and index reload"""
+
+    def test_store_and_lookup(self, tmp_path):
+        cache = ResultCache(str(tmp_path / "cache"), max_bytes=1000)
+        assert cache.lookup("k1") is None
+
+        cached = cache.store("k1", make_image(tmp_path, "a.png", 100))
+        assert cached.endswith("k1.png")
+        assert cache.lookup("k1") == cached
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["bytes"] == 100
+
+    def test_missing_source_is_not_cached(self, tmp_path):
+        cache = ResultCache(str(tmp_path / "cache"), max_bytes=1000)
+        assert cache.store("k1", str(tmp_path / "nope.png")) is None
+        assert cache.stats()["entries"] == 0
+
+    def test_lru_eviction_by_size(self, tmp_path):
+        cache = ResultCache(str(tmp_path / "cache"), max_bytes=250)
+        first = cache.store("k1", make_image(tmp_path, "a.png", 100))
+        cache.store("k2", make_image(tmp_path, "b.png", 100))
+        cache.lookup("k1")  # k2 is now least recently used
+        cache.store("k3", make_image(tmp_path, "c.png", 100))
+
+        assert cache.lookup("k2") is None
+        assert cache.lookup("k1") == first
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["bytes"] == 200
+
+    def test_index_survives_restart(self, tmp_path):
+        directory = str(tmp_path / "cache")
+        cached = ResultCache(directory, max_bytes=1000).store("k1", make_image(tmp_path, "a.png", 10))
+
+        reloaded = ResultCache(directory, max_bytes=1000)
+        assert reloaded.lookup("k1") == cached
+
+    def test_deleted_file_is_a_miss(self, tmp_path):
+        cache = ResultCache(str(tmp_path / "cache"), max_bytes=1000)
+        os.remove(cache.store("k1", make_image(tmp_path, "a.png", 10)))
+        assert cache.lookup("k1") is None
+        assert cache.stats()["entries"] == 0
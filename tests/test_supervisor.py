@@ -0,0 +1,122 @@
+"""
+Tests for the worker supervisor's scaling decisions and restart backoff
+"""
+
+import signal
+
+import pytest
+
+from gpu_worker import supervisor
+from gpu_worker.supervisor import RESTART_BACKOFF_RESET_SECONDS, WorkerSlot, desired_workers
+
+
+class FakeProcess:
+    """Stands in for subprocess.Popen; alive until exit() is called."""
+
+    def __init__(self, *args, **kwargs):
+        self.pid = 1234
+        self.returncode = None
+        self.signals = []
+
+    def poll(self):
+        return self.returncode
+
+    def exit(self, code: int = 1):
+        self.returncode = code
+
+    def send_signal(self, signum):
+        self.signals.append(signum)
+
+
+@pytest.fixture
+def slot(monkeypatch):
+    monkeypatch.setattr(supervisor.subprocess, "Popen", FakeProcess)
+    monkeypatch.setattr(supervisor.time, "time", lambda: 0.0)
+    slot = WorkerSlot("host", "cuda", "0")
+    slot.wanted = True
+    return slot
+
+
+def scale(current, ready=0, wait=None, idle_for=0.0):
+    queue = {"ready": ready, "wait_p95_seconds": wait}
+    return desired_workers(current, queue, idle_since=0.0, now=idle_for, min_workers=1, max_workers=3)
+
+
+class TestScaling:
+    """Test desired_workers, one step at a time"""
+
+    def test_scales_up_on_backlog(self):
+        assert scale(1, ready=supervisor.SUPERVISOR_BACKLOG_PER_WORKER + 1) == 2
+        assert scale(1, ready=supervisor.SUPERVISOR_BACKLOG_PER_WORKER) == 1
+
+    def test_scales_up_on_slow_waits_only_while_jobs_wait(self):
+        slow = supervisor.SUPERVISOR_TARGET_WAIT_SECONDS + 1
+        assert scale(1, ready=1, wait=slow) == 2
+        assert scale(1, ready=0, wait=slow) == 1
+
+    def test_stays_within_bounds(self):
+        assert scale(3, ready=1000) == 3
+        assert scale(1, idle_for=supervisor.SUPERVISOR_IDLE_SECONDS + 1) == 1
+
+    def test_scales_down_after_idle_period(self):
+        assert scale(2, idle_for=supervisor.SUPERVISOR_IDLE_SECONDS + 1) == 1
+        assert scale(2, idle_for=supervisor.SUPERVISOR_IDLE_SECONDS - 1) == 2
+
+
+class TestWorkerSlot:
+    """Test restarts, backoff and retirement"""
+
+    def test_crash_backoff_doubles(self, slot):
+        slot.check(0.0)
+        slot.process.exit()
+
+        slot.check(10.0)
+        assert slot.process is None
+        assert slot.restarts == 1
+        assert slot.next_start == 12.0
+
+        slot.check(11.0)
+        assert slot.process is None
+        slot.check(12.0)
+        slot.process.exit()
+
+        slot.check(13.0)
+        assert slot.next_start == 17.0
+
+    def test_backoff_resets_after_stable_uptime(self, slot):
+        slot.check(0.0)
+        slot.process.exit()
+        slot.check(1.0)
+        slot.check(3.0)
+        assert slot.crashes == 1
+
+        slot.check(3.0 + RESTART_BACKOFF_RESET_SECONDS + 1)
+        assert slot.crashes == 0
+        slot.process.exit()
+        slot.check(400.0)
+        assert slot.next_start == 402.0
+        assert slot.restarts == 2
+
+    def test_retired_worker_drains_and_is_not_a_crash(self, slot):
+        slot.check(0.0)
+        process = slot.process
+
+        slot.wanted = False
+        slot.stop()
+        assert process.signals == [signal.SIGTERM]
+        assert slot.process is None
+
+        # Wanted again while still draining: wait for it to exit first
+        slot.wanted = True
+        slot.check(1.0)
+        assert slot.process is None
+        process.exit(0)
+        slot.check(2.0)
+        assert slot.process is not None
+        assert slot.restarts == 0
+
+    def test_shutdown_interrupts(self, slot):
+        slot.check(0.0)
+        process = slot.process
+        slot.stop(drain=False)
+        assert process.signals == [signal.SIGINT]